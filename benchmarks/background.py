@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+import argparse
+import io
+import os
+import random
+import sys
+import time
+from contextlib import redirect_stdout
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from engine import app as engine_app
+from engine.render import BackgroundRenderer
+from run import reset_engine
+from workloads import WORKLOADS, ZOMBOY_DIR
+
+
+def run(name, frames, seed, cached):
+    # Draw cost per frame in the simulator, with or without the pre-composited background
+    from sim.screen import Screen as SimScreen
+    reset_engine()
+    scr = SimScreen(window=False)
+    engine_app.app_screen = scr
+    random.seed(seed)
+    with redirect_stdout(io.StringIO()):
+        a, frame = WORKLOADS.get(name)(False)
+    bg = getattr(a, 'bg', 0)
+    a.renderer = BackgroundRenderer(bg) if cached else None
+    elapsed = 0.0
+    for i in range(frames):
+        frame(i)
+        a.handle_events()
+        a.step(a.tick)
+        start = time.perf_counter()
+        if not cached and not hasattr(a, 'bg'):  # zomboy clears the screen itself
+            scr.bg_color(bg)
+            scr.fill_rect(0, 0, 640, 480)
+        a.draw(a.view)
+        elapsed += time.perf_counter() - start
+    return elapsed * 1000000 / frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulator draw time per frame, in microseconds, '
+                                                 'with and without the background cache')
+    parser.add_argument('workloads', nargs='*', help='Workloads to run: ' + ', '.join(sorted(WORKLOADS)))
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    names = args.workloads if args.workloads else ['zomboy', 'scroll', 'scroll_tiles']
+    cwd = os.getcwd()
+    os.chdir(ZOMBOY_DIR)
+    try:
+        for name in names:
+            full = run(name, args.frames, args.seed, False)
+            cached = run(name, args.frames, args.seed, True)
+            print(name.ljust(14) + ' draw ' + str(int(full)) + ' -> ' + str(int(cached)) +
+                  ' (x' + str(round(full / cached, 2)) + ')')
+    finally:
+        os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    main()
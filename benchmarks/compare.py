@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+import json
+import sys
+
+
+def main():
+    # Compares two result files of run.py, ratios above 1 mean the second run is faster
+    if len(sys.argv) < 3:
+        print("Usage: compare.py <baseline json> <new json>")
+        return
+    old = json.load(open(sys.argv[1], 'r'))
+    new = json.load(open(sys.argv[2], 'r'))
+    print('Comparing ' + (old.get('revision') or sys.argv[1]) + ' -> ' + (new.get('revision') or sys.argv[2]))
+    for name in sorted(new['workloads']):
+        if name not in old['workloads']:
+            continue
+        a = old['workloads'][name]
+        b = new['workloads'][name]
+        line = name.ljust(12) + ' fps ' + str(round(a['fps'], 1)) + ' -> ' + str(round(b['fps'], 1)) + \
+            ' (x' + str(round(b['fps'] / a['fps'], 2)) + ')'
+        for phase in ('advance', 'collisions', 'draw', 'flush'):
+            pa = a['per_frame'].get(phase, 0)
+            pb = b['per_frame'].get(phase, 0)
+            if pa > 0 and pb > 0:
+                line += '  ' + phase + ' x' + str(round(float(pa) / pb, 2))
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,13 @@
+from gpu.screen import Screen, NullUART, CMD_SET_SPRITE, N_SPRITES
+
+
+class NullScreen(Screen):
+    # The board's screen with every command encoded as usual and the bytes thrown away
+    def __init__(self):
+        super().__init__(NullUART())
+
+    def set_sprite(self, index, pixels):
+        # Same stream as Screen.set_sprite, without the per sprite print
+        if 0 <= index < N_SPRITES:
+            self.put_cmd16(CMD_SET_SPRITE, index)
+            self.send(self.pixels2bytes(pixels))
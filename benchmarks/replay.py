@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+import argparse
+import io
+import os
+import sys
+import time
+from contextlib import redirect_stdout
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from gpu.record import Recorder, analyze, diff, replay
+from nullscreen import NullScreen
+from run import run_workload
+from workloads import WORKLOADS, ZOMBOY_DIR
+
+
+def record(name, log, frames, seed, dirty):
+    # Runs a workload headless, with its display commands saved to the log
+    with open(log, 'wb') as f:
+        rec = Recorder(NullScreen(), f)
+        cwd = os.getcwd()
+        os.chdir(ZOMBOY_DIR)
+        try:
+            run_workload(name, frames, seed, dirty, screen=rec)
+        finally:
+            os.chdir(cwd)
+        rec.close()
+
+
+def play(log, repeat, present):
+    from sim.screen import Screen as SimScreen
+    data = open(log, 'rb').read()
+    scr = SimScreen(window=present)
+    with redirect_stdout(io.StringIO()):
+        replay(scr, data)  # Warm up, the first pass also uploads the sprites
+    start = time.perf_counter()
+    frames = 0
+    for _ in range(repeat):
+        frames += replay(scr, data, present)
+    elapsed = time.perf_counter() - start
+    print(str(frames) + ' frames in ' + str(round(elapsed, 3)) + 's, ' + str(round(frames / elapsed, 1)) + ' fps')
+
+
+def stats(log):
+    info = analyze(open(log, 'rb').read())
+    sizes = info.get('frame_bytes')
+    print(str(info.get('bytes')) + ' bytes, ' + str(info.get('frames')) + ' frames')
+    if sizes:
+        print('frame bytes min ' + str(min(sizes)) + ' avg ' + str(sum(sizes) // len(sizes)) + ' max ' + str(max(sizes)))
+    commands = info.get('commands')
+    for name in sorted(commands, key=lambda k: -commands[k][1]):
+        count, total = commands.get(name)
+        print(name.ljust(18) + str(count).rjust(10) + str(total).rjust(12) + ' bytes')
+
+
+def compare(a, b):
+    res = diff(open(a, 'rb').read(), open(b, 'rb').read())
+    if res is None:
+        print('Identical')
+    else:
+        frame, offset, name = res
+        print('First difference in frame ' + str(frame) + ' at offset ' + str(offset) +
+              (' (' + name + ')' if name else ''))
+    return res is None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Records display command logs and replays them into the simulator')
+    sub = parser.add_subparsers(dest='command')
+    p = sub.add_parser('record', help='Record a workload: ' + ', '.join(sorted(WORKLOADS)))
+    p.add_argument('workload')
+    p.add_argument('log')
+    p.add_argument('--frames', type=int, default=300)
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--dirty', action='store_true', help='Use the dirty rectangle renderer')
+    p = sub.add_parser('play', help='Replay a log into the simulator as fast as possible')
+    p.add_argument('log')
+    p.add_argument('--repeat', type=int, default=1)
+    p.add_argument('--show', action='store_true', help='Show each frame in the simulator window')
+    p = sub.add_parser('stats', help='Bytes per frame and per command')
+    p.add_argument('log')
+    p = sub.add_parser('diff', help='First frame where two logs differ')
+    p.add_argument('a')
+    p.add_argument('b')
+    args = parser.parse_args()
+    if args.command == 'record':
+        if args.workload not in WORKLOADS:
+            parser.error('Unknown workload ' + args.workload)
+        record(args.workload, os.path.abspath(args.log), args.frames, args.seed, args.dirty)
+    elif args.command == 'play':
+        play(args.log, args.repeat, args.show)
+    elif args.command == 'stats':
+        stats(args.log)
+    elif args.command == 'diff':
+        sys.exit(0 if compare(args.a, args.b) else 1)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
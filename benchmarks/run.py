@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from contextlib import redirect_stdout
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from engine import app as engine_app
+from engine import sprite, physics
+from engine.profiler import COLUMNS, enable_profiler, disable_profiler
+from nullscreen import NullScreen
+from workloads import WORKLOADS, ZOMBOY_DIR
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def reset_engine():
+    # Workloads share the engine's module level state, each one starts from scratch
+    engine_app.app = None
+    engine_app.app_screen = NullScreen()
+    engine_app.is_pressed_impl = lambda k: False
+    physics.physics_store = None
+    sprite.use_sprite_cache = False
+    sprite.sprite_sheets.clear()
+    sprite.sprites_manager.clear()
+
+
+def run_workload(name, frames, seed, dirty, tick_rate=60, screen=None):
+    reset_engine()
+    if screen:
+        engine_app.app_screen = screen
+    random.seed(seed)
+    with redirect_stdout(io.StringIO()):
+        a, frame = WORKLOADS.get(name)(dirty)
+    a.tick = 1.0 / tick_rate
+    scr = engine_app.app_screen
+    prof = enable_profiler(capacity=frames, scr=scr)
+    prof.clear()
+    start = time.perf_counter()
+    for i in range(frames):
+        frame(i)
+        a.handle_events()
+        a.loop(a.tick)
+    elapsed = time.perf_counter() - start
+    disable_profiler()
+    avg = prof.averages(frames)
+    res = {'frames': frames, 'seconds': elapsed, 'fps': frames / elapsed,
+           'entities': len(a.scene.entities), 'dirty_rendering': dirty}
+    res['per_frame'] = dict(zip(COLUMNS, avg))
+    return res
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless engine benchmarks, phase times are in microseconds')
+    parser.add_argument('workloads', nargs='*', help='Workloads to run: ' + ', '.join(sorted(WORKLOADS)))
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--dirty', action='store_true', help='Use the dirty rectangle renderer')
+    parser.add_argument('--json', help='Write the results to this file')
+    args = parser.parse_args()
+    names = args.workloads if args.workloads else sorted(WORKLOADS)
+    for name in names:
+        if name not in WORKLOADS:
+            parser.error('Unknown workload ' + name)
+    cwd = os.getcwd()
+    os.chdir(ZOMBOY_DIR)  # Asset paths are relative to the game
+    results = {}
+    try:
+        for name in names:
+            r = run_workload(name, args.frames, args.seed, args.dirty)
+            results[name] = r
+            pf = r['per_frame']
+            print(name.ljust(12) + str(round(r['fps'], 1)).rjust(8) + ' fps  ' +
+                  '  '.join([k + ' ' + str(pf[k]) for k in COLUMNS]))
+    finally:
+        os.chdir(cwd)
+    if args.json:
+        report = {'revision': git_revision(), 'python': platform.python_version(), 'frames': args.frames,
+                  'seed': args.seed, 'workloads': results}
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+import argparse
+import os
+
+from run import run_workload
+from workloads import ZOMBOY_DIR
+
+PAIRS = (('pile_200', 'pile_200_tiles'), ('scroll', 'scroll_tiles'))
+
+
+def main():
+    # Draw and collision cost of platforms as static entities against the same platforms in a TileMap
+    parser = argparse.ArgumentParser(description='Entity per tile against TileMap, times are in microseconds per frame')
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--dirty', action='store_true', help='Use the dirty rectangle renderer')
+    args = parser.parse_args()
+    cwd = os.getcwd()
+    os.chdir(ZOMBOY_DIR)
+    try:
+        for entities, tiles in PAIRS:
+            a = run_workload(entities, args.frames, args.seed, args.dirty)
+            b = run_workload(tiles, args.frames, args.seed, args.dirty)
+            line = entities.ljust(10) + ' entities ' + str(a['entities']) + ' -> ' + str(b['entities'])
+            for phase in ('draw', 'collisions', 'frame'):
+                pa = a['per_frame'].get(phase)
+                pb = b['per_frame'].get(phase)
+                line += '  ' + phase + ' ' + str(pa) + ' -> ' + str(pb)
+                if pb > 0:
+                    line += ' (x' + str(round(float(pa) / pb, 2)) + ')'
+            print(line)
+    finally:
+        os.chdir(cwd)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+import os
+import random
+import sys
+
+from engine import app as engine_app
+from engine import Application, Entity, AnimatedSprite, StaticSprite, TileMap, Point, Rect
+
+ZOMBOY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'zomboy')
+MONSTERS = ['bird', 'mush', 'pig', 'rock', 'slime', 'snail']
+
+
+class Walker(Entity):
+    # Walks in a straight line and bounces off the edges of a world rect
+    def __init__(self, name, world):
+        super().__init__(AnimatedSprite())
+        self.anim.load('rsc/' + name + '.json', {'BaseVelocity': 30.0})
+        self.anim.set_active_sequence('WalkRight')
+        self.world = world
+
+    def advance(self, dt):
+        p = self.get_position()
+        v = self.get_velocity()
+        w = self.world
+        if (p.x <= w.tl.x and v.x < 0) or (p.x >= w.br.x - 32 and v.x > 0):
+            v.x = -v.x
+            self.anim.set_active_sequence('WalkRight' if v.x > 0 else 'WalkLeft')
+            self.set_velocity(v)
+        if (p.y <= w.tl.y and v.y < 0) or (p.y >= w.br.y - 32 and v.y > 0):
+            v.y = -v.y
+            self.set_velocity(v)
+        return super().advance(dt)
+
+
+class Faller(Walker):
+    # Falls under gravity and comes to rest on whatever it lands on
+    def collision(self, other, col_point):
+        v = self.get_velocity()
+        if col_point.y > 16 and v.y >= 0:
+            self.revert(False, True)
+            v.y = 0
+            self.set_velocity(v)
+
+
+def platform_sprites():
+    anim = AnimatedSprite()
+    anim.load('rsc/platform.json')
+    return anim.get_sequence_by_name('Center').sprites
+
+
+def add_tiles(a, sprites, x0, y, count, layer=None):
+    # Into a tile layer when given, otherwise as one static entity per tile
+    for i in range(count):
+        sprite = sprites[random.randint(0, len(sprites) - 1)]
+        if layer:
+            layer.set_tile(x0 // 32 + i, y // 32, sprite)
+        else:
+            e = Entity(StaticSprite(sprite))
+            e.dynamic = False
+            e.set_position(x0 + i * 32, y)
+            a.scene.add(e)
+
+
+def tile_layer(a, world, tiles):
+    if not tiles:
+        return None
+    layer = TileMap(world.br.x // 32, world.br.y // 32)
+    a.scene.add_layer(layer)
+    return layer
+
+
+def zomboy_level(dirty):
+    # The real game with a scripted player, running, jumping and attacking
+    if ZOMBOY_DIR not in sys.path:
+        sys.path.insert(0, ZOMBOY_DIR)
+    import zomboy
+    keys = set()
+    engine_app.is_pressed_impl = lambda k: k in keys
+    a = zomboy.GameApplication()
+    if dirty:
+        from engine.render import DirtyRenderer
+        a.renderer = DirtyRenderer()
+
+    def frame(i):
+        keys.clear()
+        phase = i % 240
+        if phase < 80:
+            keys.add('right')
+        elif phase < 160:
+            keys.add('left')
+            if phase % 40 == 0:
+                keys.add('up')
+        elif phase < 200:
+            keys.add('x')
+        else:
+            keys.add('z')
+
+    return a, frame
+
+
+def crowd(count, dirty):
+    # Many animated walkers spread over a world four screens large, most of them off screen
+    world = Rect(0, 0, 1280, 960)
+    a = Application(dirty_rendering=dirty)
+    for i in range(count):
+        w = Walker(MONSTERS[i % len(MONSTERS)], world)
+        w.set_position(random.randint(0, 1248), random.randint(0, 928))
+        w.set_velocity(random.randint(-40, 40), random.randint(-40, 40))
+        a.scene.add(w)
+
+    def frame(i):
+        pass
+
+    return a, frame
+
+
+def pile(count, dirty, tiles=False):
+    # Bodies dropped into a narrow pit, so most of them touch each other and the floor
+    world = Rect(160, -2000, 480, 448)
+    a = Application(dirty_rendering=dirty)
+    add_tiles(a, platform_sprites(), 128, 448, 12, tile_layer(a, Rect(0, 0, 640, 480), tiles))
+    for i in range(count):
+        f = Faller(MONSTERS[i % len(MONSTERS)], world)
+        f.set_position(random.randint(160, 448), 400 - (i // 10) * 24)
+        f.set_velocity(random.randint(-30, 30), 0)
+        f.set_accel(0, 200)
+        a.scene.add(f)
+
+    def frame(i):
+        pass
+
+    return a, frame
+
+
+def scroll(dirty, tiles=False):
+    # A level ten screens wide, the view pans across it and back
+    world = Rect(0, 0, 6400, 480)
+    a = Application(dirty_rendering=dirty)
+    sprites = platform_sprites()
+    layer = tile_layer(a, world, tiles)
+    for row in range(7):
+        for _ in range(30):
+            add_tiles(a, sprites, random.randint(0, 195) * 32, 32 + row * 64, random.randint(2, 6), layer)
+    for i in range(100):
+        w = Walker(MONSTERS[i % len(MONSTERS)], world)
+        w.set_position(random.randint(0, 6368), random.randint(0, 448))
+        w.set_velocity(random.randint(-40, 40), 0)
+        a.scene.add(w)
+
+    def frame(i):
+        x = (i * 8) % 11520
+        if x > 5760:
+            x = 11520 - x
+        a.view.set_position(Point(x, 0))
+
+    return a, frame
+
+
+# Name -> builder taking the dirty rendering flag.
+# The _tiles variants hold the same platforms in a TileMap instead of static entities.
+WORKLOADS = {
+    'zomboy': zomboy_level,
+    'crowd_500': lambda dirty: crowd(500, dirty),
+    'crowd_2000': lambda dirty: crowd(2000, dirty),
+    'pile_200': lambda dirty: pile(200, dirty),
+    'pile_200_tiles': lambda dirty: pile(200, dirty, True),
+    'scroll': scroll,
+    'scroll_tiles': lambda dirty: scroll(dirty, True),
+}
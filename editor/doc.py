@@ -1,29 +1,405 @@
+import io
+import random
+from bisect import bisect_left
 from .line import *
 
+# Line views kept for the visible window, dropped when they get stale or too many
+MAX_VIEWS = 256
+
+
+def newline_positions(text, offset=0):
+    res = []
+    i = text.find('\n')
+    while i >= 0:
+        res.append(offset + i)
+        i = text.find('\n', i + 1)
+    return res
+
+
+class AddBuffer:
+    # Append only text of all inserts, pieces slice it like a string
+    def __init__(self):
+        self.data = io.StringIO()
+        self.size = 0
+        self.nls = []
+
+    def append(self, text):
+        start = self.size
+        self.data.seek(start)
+        self.data.write(text)
+        self.nls.extend(newline_positions(text, start))
+        self.size = start + len(text)
+        return start
+
+    def __getitem__(self, item):
+        self.data.seek(item.start)
+        return self.data.read(item.stop - item.start)
+
+
+class Piece:
+    # A span of one buffer, and a treap node ordered by position in the document.
+    # size and nl are the characters and newlines of the whole subtree.
+    __slots__ = ('buf', 'nls', 'start', 'length', 'lines', 'prio', 'left', 'right', 'size', 'nl')
+
+    def __init__(self, buf, nls, start, length, prio=None):
+        self.buf = buf
+        self.nls = nls
+        self.start = start
+        self.length = length
+        self.lines = bisect_left(nls, start + length) - bisect_left(nls, start)
+        self.prio = random.random() if prio is None else prio
+        self.left = None
+        self.right = None
+        self.size = length
+        self.nl = self.lines
+
+    def update(self):
+        size = self.length
+        nl = self.lines
+        if self.left:
+            size += self.left.size
+            nl += self.left.nl
+        if self.right:
+            size += self.right.size
+            nl += self.right.nl
+        self.size = size
+        self.nl = nl
+
+
+def split(node, pos):
+    # Two trees, with the first pos characters and with the rest
+    if node is None:
+        return None, None
+    ls = node.left.size if node.left else 0
+    if pos <= ls:
+        a, b = split(node.left, pos)
+        node.left = b
+        node.update()
+        return a, node
+    if pos >= ls + node.length:
+        a, b = split(node.right, pos - ls - node.length)
+        node.right = a
+        node.update()
+        return node, b
+    k = pos - ls
+    # Same priority as the node it was cut from, so it can take its place above the right subtree
+    rest = Piece(node.buf, node.nls, node.start + k, node.length - k, node.prio)
+    rest.right = node.right
+    rest.update()
+    node.length = k
+    node.lines = node.lines - rest.lines
+    node.right = None
+    node.update()
+    return node, rest
+
+
+def merge(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a.prio > b.prio:
+        a.right = merge(a.right, b)
+        a.update()
+        return a
+    b.left = merge(a, b.left)
+    b.update()
+    return b
+
+
+def count_pieces(node):
+    if node is None:
+        return 0
+    return 1 + count_pieces(node.left) + count_pieces(node.right)
+
+
+def collect(node, lo, hi, out):
+    # Appends the text of [lo, hi) of the subtree, in order
+    if node is None or hi <= 0 or lo >= node.size:
+        return
+    ls = node.left.size if node.left else 0
+    collect(node.left, lo, hi, out)
+    s = max(lo, ls)
+    e = min(hi, ls + node.length)
+    if s < e:
+        out.append(node.buf[(node.start + s - ls):(node.start + e - ls)])
+    collect(node.right, lo - ls - node.length, hi - ls - node.length, out)
+
 
 class Document:
+    # A piece table, the text is spans of the loaded file and of inserted strings,
+    # kept in a treap that counts characters and newlines, so finding a line and
+    # editing it take O(log n) whatever the size of the file or the line.
     def __init__(self, filename):
-        self.lines = [Line('')]
+        self.root = None
+        self.add = AddBuffer()
+        self.last = None
+        self.views = {}
         if filename:
             self.load(filename)
 
     def load(self, filename):
         try:
-            lines = open(filename).readlines()
-            self.lines = [Line(s.rstrip()) for s in lines]
+            text = open(filename).read()
         except OSError:
             return False
+        if text.endswith('\n'):
+            text = text[:-1]
+        self.set_text(text)
         return True
 
+    def set_text(self, text):
+        self.root = Piece(text, newline_positions(text), 0, len(text)) if text else None
+        self.add = AddBuffer()
+        self.last = None
+        self.views = {}
+
+    def get_text(self):
+        return self.text(0, self.length())
+
+    def length(self):
+        return self.root.size if self.root else 0
+
     def size(self):
-        return len(self.lines)
+        return (self.root.nl if self.root else 0) + 1
+
+    def line_start(self, index):
+        # Offset of the first character of a line, found through the newline counts
+        if index <= 0:
+            return 0
+        k = index
+        node = self.root
+        acc = 0
+        while node:
+            lnl = node.left.nl if node.left else 0
+            if k <= lnl:
+                node = node.left
+                continue
+            k -= lnl
+            ls = node.left.size if node.left else 0
+            if k <= node.lines:
+                i = bisect_left(node.nls, node.start) + k - 1
+                return acc + ls + node.nls[i] - node.start + 1
+            k -= node.lines
+            acc += ls + node.length
+            node = node.right
+        return self.length() + 1
+
+    def line_end(self, index):
+        if index + 1 >= self.size():
+            return self.length()
+        return self.line_start(index + 1) - 1
+
+    def text(self, offset, length):
+        out = []
+        collect(self.root, offset, offset + length, out)
+        return ''.join(out)
+
+    def line_text(self, index):
+        start = self.line_start(index)
+        return self.text(start, self.line_end(index) - start)
+
+    def line_size(self, index):
+        return self.line_end(index) - self.line_start(index)
 
     def __getitem__(self, item):
-        return self.lines[item]
+        # Lines are materialized on demand, for the ones on screen
+        view = self.views.get(item)
+        if view is None:
+            if len(self.views) >= MAX_VIEWS:
+                self.views = {}
+            view = Line(self.line_text(item))
+            self.views[item] = view
+        return view
+
+    def prefetch(self, first, count):
+        # Materializes a window of lines with a single walk of the table
+        last = min(first + count, self.size()) - 1
+        if last < first:
+            return
+        if len(self.views) + count > MAX_VIEWS:
+            self.views = {}
+        start = self.line_start(first)
+        texts = self.text(start, self.line_end(last) - start).split('\n')
+        for i in range(len(texts)):
+            if first + i not in self.views:
+                self.views[first + i] = Line(texts[i])
+
+    def insert_at(self, offset, text):
+        if text and not self.extend_last(offset, text):
+            start = self.add.append(text)
+            self.last = Piece(self.add, self.add.nls, start, len(text))
+            a, b = split(self.root, offset)
+            self.root = merge(merge(a, self.last), b)
+
+    def extend_last(self, offset, text):
+        # Typing on at the end of the previous insert grows its piece instead of adding one
+        node = self.last
+        if node is None or offset <= 0 or node.start + node.length != self.add.size:
+            return False
+        path = []
+        n = self.root
+        pos = offset - 1
+        while n:
+            path.append(n)
+            ls = n.left.size if n.left else 0
+            if pos < ls:
+                n = n.left
+            elif pos >= ls + n.length:
+                pos -= ls + n.length
+                n = n.right
+            else:
+                break
+        if n is not node or pos != node.length - 1:
+            return False
+        self.add.append(text)
+        lines = text.count('\n')
+        node.length += len(text)
+        node.lines += lines
+        for p in path:
+            p.size += len(text)
+            p.nl += lines
+        return True
+
+    def delete_at(self, offset, length):
+        if length > 0:
+            a, b = split(self.root, offset)
+            b, c = split(b, length)
+            self.root = merge(a, c)
+
+    def insert_text(self, index, x, text):
+        self.insert_at(self.line_start(index) + x, text)
+        if '\n' in text:
+            self.views = {}
+        elif index in self.views:
+            # The view on screen is edited in place, its tokens are updated from x on
+            self.views[index].insert_text(x, text)
+
+    def delete_char(self, index, x):
+        # At the end of a line the newline goes, joining the next line
+        start = self.line_start(index)
+        end = self.line_end(index)
+        if start + x < end:
+            self.delete_at(start + x, 1)
+            if index in self.views:
+                self.views[index].delete_char(x)
+        elif index + 1 < self.size():
+            self.delete_at(end, 1)
+            self.views = {}
+
+    def split_line(self, index, x):
+        self.insert_text(index, x, '\n')
+
+    def join_lines(self, index):
+        if index + 1 < self.size():
+            self.delete_at(self.line_end(index), 1)
+            self.views = {}
 
     def delete_line(self, index):
-        if 0 <= index < len(self.lines):
-            del self.lines[index]
+        n = self.size()
+        if 0 <= index < n:
+            if n == 1:
+                self.delete_at(0, self.length())
+            elif index + 1 < n:
+                start = self.line_start(index)
+                self.delete_at(start, self.line_start(index + 1) - start)
+            else:
+                start = self.line_start(index) - 1
+                self.delete_at(start, self.length() - start)
+            self.views = {}
 
     def insert(self, line, at):
-        self.lines.insert(at, line)
+        if at >= self.size():
+            self.insert_at(self.length(), '\n' + line.text)
+        else:
+            self.insert_at(self.line_start(at), line.text + '\n')
+        self.views = {}
+
+
+def unit_test(steps=2000):
+    # Random edits against a plain list of lines
+    random.seed(1)
+    doc = Document('')
+    doc.set_text('first\n\tsecond\n\nlast')
+    ref = ['first', '\tsecond', '', 'last']
+    for step in range(steps):
+        y = random.randint(0, len(ref) - 1)
+        x = random.randint(0, len(ref[y]))
+        op = random.randint(0, 5)
+        if op <= 1:
+            text = random.choice(['a', 'bc', '\t', 'xyz'])
+            doc.insert_text(y, x, text)
+            ref[y] = ref[y][:x] + text + ref[y][x:]
+        elif op == 2:
+            doc.split_line(y, x)
+            ref[y:(y + 1)] = [ref[y][:x], ref[y][x:]]
+        elif op == 3:
+            doc.delete_char(y, x)
+            if x < len(ref[y]):
+                ref[y] = ref[y][:x] + ref[y][x + 1:]
+            elif y + 1 < len(ref):
+                ref[y:(y + 2)] = [ref[y] + ref[y + 1]]
+        elif op == 4 and len(ref) > 1:
+            doc.delete_line(y)
+            del ref[y]
+        else:
+            doc.insert(Line('new'), y)
+            ref.insert(y, 'new')
+        y = min(y, len(ref) - 1)
+        if doc.size() != len(ref) or doc[y].text != ref[y] or not same_tokens(doc[y], Line(ref[y])):
+            print("Mismatch at step " + str(step))
+            return False
+    if doc.get_text() != '\n'.join(ref) or [doc[i].text for i in range(doc.size())] != ref:
+        print("Document text mismatch")
+        return False
+    # Keystrokes in a row extend one piece, the one split by the first of them
+    pieces = count_pieces(doc.root)
+    offset = doc.line_start(y)
+    typed = ''.join('k' if i % 10 else '\n' for i in range(100))
+    for i in range(len(typed)):
+        doc.insert_at(offset + i, typed[i])
+    text = '\n'.join(ref)
+    if doc.get_text() != text[:offset] + typed + text[offset:]:
+        print("Typed text mismatch")
+        return False
+    if count_pieces(doc.root) > pieces + 2:
+        print("Typing added " + str(count_pieces(doc.root) - pieces) + " pieces")
+        return False
+    print("All tests successful")
+    return True
+
+
+def benchmark(lines=300000, long_line=1000000, edits=2000):
+    # A large file and a very long line, edited at random places while the visible window is redrawn
+    import time
+    random.seed(1)
+    text = '\n'.join(['line ' + str(i) + '\tvalue = ' + str(i * 7) for i in range(lines)])
+    text = text + '\n' + 'x' * long_line
+    doc = Document('')
+    start = time.perf_counter()
+    doc.set_text(text)
+    print("load: " + str(doc.size()) + " lines in " + str(round((time.perf_counter() - start) * 1000, 1)) + " ms")
+    last = doc.size() - 1
+    for name in ('insert', 'split', 'join', 'long line insert', 'long line delete'):
+        start = time.perf_counter()
+        for _ in range(edits):
+            y = last if name.startswith('long') else random.randint(0, last - 1)
+            x = random.randint(0, 10 if y < last else long_line - 10)
+            if name == 'split':
+                doc.split_line(y, x)
+            elif name == 'join':
+                doc.join_lines(y)
+            elif name.endswith('delete'):
+                doc.delete_char(y, x)
+            else:
+                doc.insert_text(y, x, 'q')
+            last = doc.size() - 1
+            first = max(0, y - 15)
+            doc.prefetch(first, min(last, y + 15) - first)
+        us = (time.perf_counter() - start) * 1000000 / edits
+        print(name + ": " + str(round(us, 1)) + " us per edit, with a 30 line window")
+    return True
+
+
+if __name__ == '__main__':
+    unit_test()
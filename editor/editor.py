@@ -33,6 +33,7 @@ def main(filename):
             view.move_cursor(100000, 0)
         if key == 'Escape':
             break
+        screen.flip()
     screen.stop()
 
 
@@ -1,3 +1,5 @@
+from bisect import bisect_left, bisect_right
+
 TAB_SIZE = 4
 
 
@@ -8,6 +10,42 @@ class Token:
         self.text = text
 
 
+def tab_positions(text, offset=0):
+    res = []
+    i = text.find('\t')
+    while i >= 0:
+        res.append(offset + i)
+        i = text.find('\t', i + 1)
+    return res
+
+
+def first_token_ending(tokens, pos):
+    # Index of the first token whose end is at or after pos
+    lo = 0
+    hi = len(tokens)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        t = tokens[mid]
+        if t.index + len(t.text) < pos:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def first_token_after(tokens, pos):
+    # Index of the first token starting after pos
+    lo = 0
+    hi = len(tokens)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if tokens[mid].index <= pos:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
 class Line:
     def __init__(self, text):
         self.text = ''
@@ -20,33 +58,26 @@ class Line:
         return len(self.text)
 
     def append_text(self, text):
-        self.text = self.text + text
-        if len(self.tokens) > 0:
-            self.tokens[-1].text += text
-        else:
-            self.calc_tokens()
+        self.replace(len(self.text), 0, text)
 
     def insert_text(self, x, text):
-        self.text = self.text[0:x] + text + self.text[x:]
-        self.calc_tokens()
+        self.replace(x, 0, text)
 
     def join(self, line):
-        self.set_text(self.text + line.text)
+        self.replace(len(self.text), 0, line.text)
 
     def split(self, x):
         text = self.text[x:]
-        self.set_text(self.text[0:x])
+        self.replace(x, len(text), '')
         return Line(text)
 
     def delete_char(self, x):
-        self.set_text(self.text[0:x] + self.text[x + 1:])
+        if x < len(self.text):
+            self.replace(x, 1, '')
 
     def set_text(self, text):
         self.text = text
-        self.tabs = []
-        for i in range(len(text)):
-            if text[i] == '\t':
-                self.tabs.append(i)
+        self.tabs = tab_positions(text)
         self.calc_tokens()
 
     def calc_tokens(self):
@@ -63,3 +94,120 @@ class Line:
                 i = tab_index + 1
         if i < len(self.text):
             self.tokens.append(Token(x, i, self.text[i:]))
+
+    def replace(self, at, count, text):
+        # Replaces count characters at 'at' with text.  Tokens ending before the edit are kept,
+        # the ones after it are only moved, just the text in between is tokenized again.
+        end = at + count
+        delta = len(text) - count
+        tokens = self.tokens
+        tabs = self.tabs
+        first = first_token_ending(tokens, at)
+        # A token starting past a tab that survives the edit keeps its text
+        last = first_token_after(tokens, end)
+        tail = tokens[last:]
+        self.text = self.text[0:at] + text + self.text[end:]
+        a = bisect_left(tabs, at)
+        tabs[a:] = tab_positions(text, at) + [t + delta for t in tabs[bisect_left(tabs, end):]]
+        if first > 0:
+            t = tokens[first - 1]
+            x = t.x + len(t.text)
+            i = t.index + len(t.text) + 1
+        else:
+            x = 0
+            i = 0
+        stop = tail[0].index + delta if tail else len(self.text)
+        res = tokens[0:first]
+        k = bisect_right(tabs, i - 1)
+        while k < len(tabs) and tabs[k] < stop:
+            tab_index = tabs[k]
+            if i == tab_index:
+                i = i + 1
+                x = x + (TAB_SIZE - i % 4)
+            else:
+                res.append(Token(x, i, self.text[i:tab_index]))
+                x = x + (tab_index - i)
+                i = tab_index + 1
+            k += 1
+        if not tail:
+            if i < len(self.text):
+                res.append(Token(x, i, self.text[i:]))
+        else:
+            # Tab widths depend on their index, so the columns are recomputed while moving
+            e = stop
+            for t in tail:
+                i = t.index + delta
+                t.index = i
+                # The tab right after a token takes no width, the ones following it do
+                while e < i:
+                    e = e + 1
+                    x = x + (TAB_SIZE - e % 4)
+                t.x = x
+                n = len(t.text)
+                x = x + n
+                e = i + n + 1
+            res.extend(tail)
+        self.tokens = res
+
+
+def same_tokens(a, b):
+    if len(a.tokens) != len(b.tokens):
+        return False
+    for s, t in zip(a.tokens, b.tokens):
+        if s.x != t.x or s.index != t.index or s.text != t.text:
+            return False
+    return True
+
+
+def unit_test(steps=5000):
+    # Random edits checked against the full recomputation of a new line
+    import random
+    random.seed(1)
+    line = Line('\tab\t\tcd\t')
+    for step in range(steps):
+        op = random.randint(0, 4)
+        x = random.randint(0, line.size())
+        text = ''.join(random.choice('ab\t') for _ in range(random.randint(1, 4)))
+        if op <= 1:
+            line.insert_text(x, text)
+        elif op == 2:
+            line.delete_char(x)
+        elif op == 3:
+            line.join(Line(text))
+        elif line.size() > 30:
+            rest = line.split(x)
+            if not same_tokens(rest, Line(rest.text)):
+                print("Split mismatch at step " + str(step))
+                return False
+        ref = Line(line.text)
+        if line.tabs != [i for i in range(line.size()) if line.text[i] == '\t'] or not same_tokens(line, ref):
+            print("Mismatch at step " + str(step) + ": " + repr(line.text))
+            return False
+    print("All tests successful")
+    return True
+
+
+def benchmark(length=20000, edits=2000):
+    # Keystrokes at random places in a long line that is a third tabs
+    import random
+    import time
+    random.seed(1)
+    text = ''.join(random.choice('ab\t') for _ in range(length))
+    positions = [random.randint(0, length) for _ in range(edits)]
+    for name in ('full', 'incremental'):
+        line = Line(text)
+        start = time.perf_counter()
+        for x in positions:
+            if name == 'full':
+                line.set_text(line.text[0:x] + 'q' + line.text[x:])
+                line.set_text(line.text[0:x] + line.text[x + 1:])
+            else:
+                line.insert_text(x, 'q')
+                line.delete_char(x)
+        us = (time.perf_counter() - start) * 1000000 / (edits * 2)
+        print(name + ": " + str(round(us, 1)) + " us per keystroke on a " + str(length) + " character line")
+    return True
+
+
+if __name__ == '__main__':
+    unit_test()
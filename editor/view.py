@@ -15,8 +15,7 @@ class View:
     def move_cursor(self, dx, dy):
         self.cursor.move(dx, dy)
         self.cursor.clamp_y(0, self.doc.size())
-        line = self.doc[self.cursor.y]
-        self.cursor.clamp_x(0, line.size())
+        self.cursor.clamp_x(0, self.doc.line_size(self.cursor.y))
         self.place_cursor()
 
     def place_cursor(self):
@@ -24,11 +23,8 @@ class View:
         self.screen.text_cursor(x, y)
 
     def insert_text(self, text):
-        line = self.doc[self.cursor.y]
-        if self.cursor.x >= line.size():
-            line.append_text(text)
-        else:
-            line.insert_text(self.cursor.x, text)
+        x = min(self.cursor.x, self.doc.line_size(self.cursor.y))
+        self.doc.insert_text(self.cursor.y, x, text)
         self.cursor.move(1, 0)
         self.draw_cursor_line()
         self.place_cursor()
@@ -42,35 +38,27 @@ class View:
         self.screen.text_cursor(x, y)
 
     def enter(self):
-        line = self.doc[self.cursor.y]
-        line = line.split(self.cursor.x)
-        self.doc.insert(line, self.cursor.y + 1)
+        self.doc.split_line(self.cursor.y, self.cursor.x)
         self.cursor = Cursor(0, self.cursor.y + 1)
         self.redraw_all()
 
     def delete(self):
-        line = self.doc[self.cursor.y]
-        if self.cursor.x < line.size():
-            line.delete_char(self.cursor.x)
+        if self.cursor.x < self.doc.line_size(self.cursor.y):
+            self.doc.delete_char(self.cursor.y, self.cursor.x)
             self.draw_cursor_line()
         elif self.cursor.y < (self.doc.size() - 1):
-            next_line = self.doc[self.cursor.y + 1]
-            line.join(next_line)
-            self.doc.delete_line(self.cursor.y + 1)
+            self.doc.join_lines(self.cursor.y)
             self.redraw_all()
 
     def backspace(self):
-        line = self.doc[self.cursor.y]
         if self.cursor.x > 0:
-            line.delete_char(self.cursor.x - 1)
+            self.doc.delete_char(self.cursor.y, self.cursor.x - 1)
             self.cursor.move(-1, 0)
             self.draw_cursor_line()
             self.place_cursor()
         elif self.cursor.y > 0:
-            prev_line = self.doc[self.cursor.y - 1]
-            x = prev_line.size()
-            prev_line.join(line)
-            self.doc.delete_line(self.cursor.y)
+            x = self.doc.line_size(self.cursor.y - 1)
+            self.doc.join_lines(self.cursor.y - 1)
             self.cursor = Cursor(x, self.cursor.y - 1)
             self.redraw_all()
 
@@ -115,6 +103,7 @@ class View:
 
     def redraw_all(self):
         self.screen.cls()
+        self.doc.prefetch(self.line_offset, self.view_lines)
         for y in range(self.view_lines):
             self.draw_line(y)
         x, y = self.doc2scr(self.cursor)
@@ -1,12 +1,23 @@
 from .app import is_pressed
 from .app import get_screen_size
 from .app import get_screen
+from .app import FrameStats
 from .app import Application
 from .bitmatrix import BitMatrix
 from .entity import Entity
+from .physics import PhysicsStore
+from .physics import enable_batch_physics
+from .physics import get_physics_store
 from .physics import RigidBody
+from .profiler import Profiler
+from .profiler import enable_profiler
+from .profiler import disable_profiler
+from .profiler import get_profiler
+from .render import DirtyRenderer
+from .render import BackgroundRenderer
 from .rtree import RTree
 from .scene import Scene
+from .spatialhash import SpatialHash
 from .sprite import Sprite
 from .sprite import AnimationSequence
 from .sprite import StaticSprite
@@ -15,6 +26,7 @@ from .sprite import load_json_file
 from .sprite import load_json_str
 from .sprite import load_file
 from .sprite import load_str
+from .tilemap import TileMap
 from .utils import rgb
 from .utils import Point
 from .utils import vector2
@@ -27,5 +39,5 @@ from .utils import parse_color
 from .utils import all_pixels
 from .view import View
 
-__all__ = [ 'is_pressed','get_screen_size','get_screen','Application','BitMatrix','Entity','RigidBody','RTree','Scene','Sprite','AnimationSequence','StaticSprite','AnimatedSprite','load_json_file','load_json_str','load_file','load_str','rgb','Point','vector2','Rect','parse_rect','parse_float','is_transparent','parse_point','parse_color','all_pixels','View' ]
+__all__ = [ 'is_pressed','get_screen_size','get_screen','FrameStats','Application','BitMatrix','Entity','PhysicsStore','enable_batch_physics','get_physics_store','RigidBody','Profiler','enable_profiler','disable_profiler','get_profiler','DirtyRenderer','BackgroundRenderer','RTree','Scene','SpatialHash','Sprite','AnimationSequence','StaticSprite','AnimatedSprite','load_json_file','load_json_str','load_file','load_str','TileMap','rgb','Point','vector2','Rect','parse_rect','parse_float','is_transparent','parse_point','parse_color','all_pixels','View' ]
 
@@ -1,4 +1,6 @@
 import time
+from . import profiler
+from .physics import enable_batch_physics
 from .scene import Scene
 from .view import View
 
@@ -6,6 +8,69 @@ app = None
 app_screen = None
 is_pressed_impl = None
 
+if hasattr(time, 'perf_counter'):
+    def ticks():
+        return time.perf_counter()
+
+    def ticks_add(t, seconds):
+        return t + seconds
+
+    def ticks_diff(t1, t0):
+        return t1 - t0
+
+    sleep = time.sleep
+else:
+    # MicroPython, microsecond ticks that wrap around
+    def ticks():
+        return time.ticks_us()
+
+    def ticks_add(t, seconds):
+        return time.ticks_add(t, int(seconds * 1000000))
+
+    def ticks_diff(t1, t0):
+        return time.ticks_diff(t1, t0) / 1000000.0
+
+    def sleep(seconds):
+        time.sleep_us(int(seconds * 1000000))
+
+
+# EXPORT
+class FrameStats(object):
+    # Frame times in seconds, published once per window of frames
+    def __init__(self, window=30):
+        self.window = window
+        self.fps = 0.0
+        self.min = 0.0
+        self.avg = 0.0
+        self.max = 0.0
+        self.steps = 0
+        self.dropped = 0.0
+        self.count = 0
+        self.total = 0.0
+        self.cur_min = 0.0
+        self.cur_max = 0.0
+
+    def add(self, dt):
+        if self.count == 0:
+            self.cur_min = dt
+            self.cur_max = dt
+        else:
+            self.cur_min = min(self.cur_min, dt)
+            self.cur_max = max(self.cur_max, dt)
+        self.count += 1
+        self.total += dt
+        if self.count >= self.window:
+            self.avg = self.total / self.count
+            self.fps = 1.0 / self.avg if self.avg > 0 else 0.0
+            self.min = self.cur_min
+            self.max = self.cur_max
+            self.count = 0
+            self.total = 0.0
+
+    def __str__(self):
+        return ("fps=" + str(round(self.fps, 1)) + " frame min/avg/max=" + str(round(self.min * 1000, 1)) + "/" +
+                str(round(self.avg * 1000, 1)) + "/" + str(round(self.max * 1000, 1)) + "ms")
+
 
 # EXPORT
 def is_pressed(key):
@@ -49,28 +114,60 @@ def get_screen():
 
 # EXPORT
 class Application(object):
-    def __init__(self, scale=1.0):
+    def __init__(self, scale=1.0, batch_physics=False, dirty_rendering=False, tick_rate=60, max_steps=5,
+                 frame_rate=None, interpolate=True, background_cache=False):
         global app
         app = self
+        if batch_physics:
+            enable_batch_physics()
         self.scene = Scene()
         self.view = View()
-        self.fps = 30
+        self.renderer = None
+        if dirty_rendering:
+            from .render import DirtyRenderer
+            self.renderer = DirtyRenderer()
+        elif background_cache:
+            from .render import BackgroundRenderer
+            self.renderer = BackgroundRenderer()
+        # The scene always advances in steps of tick seconds, at most max_steps per frame
+        self.tick = 1.0 / tick_rate
+        self.max_steps = max_steps
+        self.accumulator = 0.0
+        self.interpolate = interpolate
+        self.frame_time = 1.0 / (frame_rate if frame_rate else tick_rate)
+        self.deadline = None
+        self.stats = FrameStats()
         self.keys = []
-        self.last_ts = time.time()
+        self.last_ts = ticks()
         get_screen().set_transparent_color(True, 0x20)
 
+    @property
+    def fps(self):
+        return self.stats.fps
+
     def calc_dt(self):
-        cur = time.time()
-        dt = cur - self.last_ts
+        cur = ticks()
+        dt = ticks_diff(cur, self.last_ts)
         self.last_ts = cur
-        if dt > 0:
-            self.fps = 0.9 * self.fps + 0.1 / dt
+        self.stats.add(dt)
         return dt
 
+    def pace(self):
+        # Sleeps until the next frame deadline, a late frame moves the deadline instead of catching up
+        now = ticks()
+        if self.deadline is None:
+            self.deadline = now
+        self.deadline = ticks_add(self.deadline, self.frame_time)
+        wait = ticks_diff(self.deadline, now)
+        if wait > 0:
+            sleep(wait)
+        elif wait < -self.frame_time:
+            self.deadline = now
+
     @staticmethod
     def flip():
+        # Presents the frame, on the board this also sends whatever commands are still queued
         get_screen().flip()
-        get_screen().nop()
 
     def clear(self, color=(192, 128, 255)):
         pass
@@ -85,20 +182,125 @@ class Application(object):
         return True
 
     def draw(self, view):
-        self.scene.draw(view)
-        # self.flip()
+        if self.renderer:
+            self.renderer.draw(self.scene, view)
+        else:
+            self.scene.draw(view)
+        p = profiler.active
+        if p and p.overlay:
+            p.draw_overlay(get_screen())
+
+    def step(self, dt):
+        # Runs as many fixed steps as the elapsed time covers, returns how many
+        self.accumulator += dt
+        steps = 0
+        while self.accumulator >= self.tick and steps < self.max_steps:
+            self.scene.advance(self.tick)
+            self.accumulator -= self.tick
+            steps += 1
+        if self.accumulator >= self.tick:
+            # Too far behind, the backlog is dropped instead of running one huge step
+            self.stats.dropped += self.accumulator
+            self.accumulator = 0.0
+        self.stats.steps += steps
+        self.view.alpha = self.accumulator / self.tick if self.interpolate else 1.0
+        return steps
 
     def loop(self, dt):
-        self.scene.advance(dt)
+        p = profiler.active
+        if p:
+            p.begin_frame()
+        self.step(dt)
         self.draw(self.view)
+        self.flip()
+        if p:
+            p.end_frame()
         return True
 
     def run(self):
+        self.last_ts = ticks()
         while self.handle_events():
             if not self.loop(self.calc_dt()):
                 break
+            self.pace()
         get_screen().stop()
 
+
+def unit_test():
+    # Fixed steps make the outcome independent of how real time is sliced into frames
+    global app_screen
+    from gpu.screen import Screen, NullUART, LoopbackUART, CMD_FLIP
+    from gpu.record import analyze
+    from .entity import Entity
+    from .sprite import AnimatedSprite
+    saved = app_screen
+    app_screen = Screen(NullUART())
+    ok = True
+    try:
+        for name, dts in (('even', [1.0 / 60] * 90), ('jitter', [0.004, 0.031, 0.012, 0.02, 0.0] * 20),
+                          ('stall', [1.0 / 60] * 10 + [0.7] + [1.0 / 60] * 10)):
+            a = Application()
+            e = Entity(AnimatedSprite())
+            e.set_position(10, 20)
+            e.set_velocity(37.0, -11.0)
+            e.set_accel(0.0, 90.0)
+            a.scene.add(e)
+            ref = Entity(AnimatedSprite())
+            ref.set_position(10, 20)
+            ref.set_velocity(37.0, -11.0)
+            ref.set_accel(0.0, 90.0)
+            for dt in dts:
+                before = a.stats.steps
+                steps = a.step(dt)
+                for _ in range(steps):
+                    ref.advance(a.tick)
+                    ref.integrate(a.tick)
+                if steps > a.max_steps or a.stats.steps != before + steps:
+                    print(name + ": too many steps in one frame")
+                    ok = False
+                p = e.get_draw_position(a.view.alpha)
+                q0 = e.get_interpolated_position(0.0)
+                q1 = e.get_position()
+                if not (min(q0.x, q1.x) <= p.x <= max(q0.x, q1.x) and min(q0.y, q1.y) <= p.y <= max(q0.y, q1.y)):
+                    print(name + ": draw position outside of the last step")
+                    ok = False
+            if e.get_position() != ref.get_position():
+                print(name + ": " + str(e.get_position()) + " differs from " + str(ref.get_position()))
+                ok = False
+            print(name + ": " + str(a.stats.steps) + " steps, " + str(round(a.stats.dropped, 3)) + "s dropped, " +
+                  "final " + str(e.get_position()))
+
+        class Counted(Application):
+            def __init__(self, frames):
+                Application.__init__(self, frame_rate=1000)
+                self.left = frames
+
+            def handle_events(self):
+                self.left -= 1
+                return self.left >= 0
+
+        # run() presents every frame exactly once
+        uart = LoopbackUART()
+        app_screen = Screen(uart)
+        a = Counted(5)
+        a.scene.add(Entity(AnimatedSprite()))
+        a.run()
+        flips = analyze(bytes(uart.data)).get('commands').get('flip', (0, 0))[0]
+        if flips != 5:
+            print(str(flips) + " flips in 5 frames")
+            ok = False
+        # Each frame's commands go out with its flip, nothing is left queued until the next one
+        a.loop(a.tick)
+        if app_screen.pos != 0 or uart.data[-2] != CMD_FLIP:
+            print(str(app_screen.pos) + " bytes still queued after a frame")
+            ok = False
+    finally:
+        app_screen = saved
+    if ok:
+        print("All tests successful")
+    return ok
+
+
 # EXPORT
 # def key_down(key_name):
 #     if key_name not in KeyCodes:
@@ -2,51 +2,40 @@
 from .utils import Point, Rect
 
 
-class BitArray:
-    def __init__(self, size):
-        self.bit_count = size
-        self.mask = 0
-
-    def size(self):
-        return self.bit_count
-
-    def setall(self, state):
-        if state:
-            self.mask = (1 << self.size()) - 1
-        else:
-            self.mask = 0
-
-    def set(self, index, v):
-        if 0 <= index < self.size():
-            if v:
-                self.mask = self.mask | (1 << index)
-            else:
-                self.mask = self.mask & ~(1 << index)
-
-    def overlap(self, other, offset):
-        mask = 0
-        if offset <= 0:
-            mask = self.mask & (other.mask >> -offset)
-        else:
-            mask = self.mask & (other.mask << offset)
-        if mask != 0:
-            x = 0
-            while (mask & 1) == 0:
-                x = x + 1
-                mask = mask >> 1
-            return x
-
-    def __getitem__(self, index):
-        if 0 <= index < self.size():
-            return (self.mask & (1 << index)) != 0
-        return False
+if hasattr(0, 'bit_length'):
+    def lowest_bit(m):
+        return (m & -m).bit_length() - 1
+else:
+    def lowest_bit(m):
+        # MicroPython has no int.bit_length
+        x = 0
+        while (m & 0xFFFF) == 0:
+            m >>= 16
+            x += 16
+        while (m & 1) == 0:
+            m >>= 1
+            x += 1
+        return x
+
+
+def highest_bit(m):
+    x = 0
+    while m > 0xFFFF:
+        m >>= 16
+        x += 16
+    while m > 1:
+        m >>= 1
+        x += 1
+    return x
 
 
 # EXPORT
 class BitMatrix(object):
     def __init__(self, width, height, init=True):
         self.sizes = (width, height)
-        self.rows = [BitArray(width) for _ in range(height)]
+        self.rows = [0] * height
+        self.bbox = None
+        self.bbox_valid = False
         if init:
             self.clear()
 
@@ -58,31 +47,82 @@ class BitMatrix(object):
 
     def get(self, x, y):
         if 0 <= x < self.width() and 0 <= y < self.height():
-            return self.rows[y][x]
+            return (self.rows[y] >> x) & 1 == 1
         return False
 
     def set(self, x, y, v):
         if 0 <= x < self.width() and 0 <= y < self.height():
-            self.rows[y].set(x, v)
+            if v:
+                self.rows[y] |= (1 << x)
+            else:
+                self.rows[y] &= ~(1 << x)
+            self.bbox_valid = False
+
+    def set_row(self, y, bits):
+        self.rows[y] = bits & ((1 << self.width()) - 1)
+        self.bbox_valid = False
+
+    def set_rows(self, rows):
+        full = (1 << self.width()) - 1
+        # Opaque rows share one int, as after setall
+        self.rows = [full if bits == full else bits & full for bits in rows]
+        self.bbox_valid = False
 
     def clear(self):
         self.setall(False)
 
     def setall(self, value=True):
-        for row in self.rows:
-            row.setall(value)
+        row = (1 << self.width()) - 1 if value else 0
+        self.rows = [row] * self.height()
+        self.bbox_valid = False
 
     def get_rect(self):
         return Rect(0, 0, self.width(), self.height())
 
+    def get_bbox(self):
+        # Bounding box of the set bits as (x0, y0, x1, y1), or None if empty
+        if not self.bbox_valid:
+            self.bbox = None
+            y0 = -1
+            y1 = -1
+            combined = 0
+            for y in range(self.height()):
+                row = self.rows[y]
+                if row:
+                    if y0 < 0:
+                        y0 = y
+                    y1 = y
+                    combined |= row
+            if combined:
+                self.bbox = (lowest_bit(combined), y0, highest_bit(combined) + 1, y1 + 1)
+            self.bbox_valid = True
+        return self.bbox
+
     def overlap(self, other, offset):
-        r = self.get_rect().intersection(other.get_rect().move(offset))
-        for y in range(r.tl.y, r.br.y):
-            row = self.rows[y]
-            orow = other.rows[y - offset.y]
-            x = row.overlap(orow, offset.x)
-            if x:
-                return Point(x, y)
+        # Returns the first overlapping pixel, in this matrix's coordinates,
+        # with other placed at offset
+        b1 = self.get_bbox()
+        b2 = other.get_bbox()
+        if b1 is None or b2 is None:
+            return None
+        ox = offset.x
+        oy = offset.y
+        if b2[0] + ox >= b1[2] or b2[2] + ox <= b1[0]:
+            return None
+        y0 = max(b1[1], b2[1] + oy)
+        y1 = min(b1[3], b2[3] + oy)
+        rows = self.rows
+        orows = other.rows
+        if ox >= 0:
+            for y in range(y0, y1):
+                m = rows[y] & (orows[y - oy] << ox)
+                if m:
+                    return Point(lowest_bit(m), y)
+        else:
+            for y in range(y0, y1):
+                m = rows[y] & (orows[y - oy] >> -ox)
+                if m:
+                    return Point(lowest_bit(m), y)
         return None
 
 
@@ -123,7 +163,7 @@ class BFBitMatrix(object):
                 if other.get(j, i):
                     p = Point(j + offset.x, i + offset.y)
                     if p in all_bits:
-                        return Point(j, i)
+                        return p
         return None
 
 
@@ -159,10 +199,46 @@ def unit_test():
             o2 = m2.overlap(m2, offset)
             if o1 != o2:
                 raise Exception("Failed overlap: "+str(i))
+        for i in range(n):
+            a1, a2 = random_pair(32, 32, randint(0, 3))
+            b1, b2 = random_pair(32, 32, randint(0, 3))
+            offset = Point(randint(-34, 34), randint(-34, 34))
+            if a1.overlap(b1, offset) != a2.overlap(b2, offset):
+                raise Exception("Failed sprite overlap: "+str(i))
         raise Exception("Test successful")
     except Exception as e:
         print(e)
 
 
+def random_pair(w, h, margin):
+    # Random blob with transparent borders, as a BitMatrix and a BFBitMatrix
+    from random import randint
+    m1 = BitMatrix(w, h)
+    m2 = BFBitMatrix(w, h)
+    for y in range(margin * 2, h - margin * 3):
+        for x in range(margin, w - margin):
+            v = randint(0, 3) > 0
+            m1.set(x, y, v)
+            m2.set(x, y, v)
+    return m1, m2
+
+
+def benchmark(n=20000):
+    import time
+    from random import randint, seed
+    seed(2)
+    results = {}
+    pairs = [(random_pair(32, 32, 4), random_pair(32, 32, 4)) for _ in range(8)]
+    offsets = [Point(randint(-40, 40), randint(-40, 40)) for _ in range(256)]
+    for name, k, count in (('BitMatrix', 0, n), ('BFBitMatrix', 1, n // 100)):
+        start = time.perf_counter()
+        for i in range(count):
+            a, b = pairs[i & 7]
+            a[k].overlap(b[k], offsets[i & 255])
+        results[name] = count / (time.perf_counter() - start)
+        print(name + ": " + str(int(results[name])) + " overlaps/sec")
+    return results
+
+
 if __name__ == '__main__':
     unit_test()
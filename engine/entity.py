@@ -1,5 +1,4 @@
 from .physics import RigidBody
-from .utils import Rect
 
 ids = 0
 
@@ -29,20 +28,32 @@ class Entity(RigidBody):
     def advance(self, dt):
         super().advance(dt)
         if self.is_dynamic:
-            self.anim.advance(dt, self.velocity)
+            self.anim.advance(dt, self.get_velocity())
         return True
 
+    def get_draw_position(self, alpha=1.0):
+        if alpha >= 1.0 or not self.is_dynamic:
+            return self.get_position()
+        return self.get_interpolated_position(alpha)
+
     def draw(self, view):
-        self.anim.draw(view.relative_position(self.get_position()))
+        self.anim.draw(view.relative_position(self.get_draw_position(view.alpha)))
 
     def get_rect(self):
-        r = Rect(self.anim.get_rect())
+        # anim.get_rect() returns a fresh rect, so it can be moved in place
         ofs = self.get_position()
-        r.move(ofs)
-        return r
+        return self.anim.get_rect().move_inplace(ofs.x, ofs.y)
+
+    def get_draw_rect(self, alpha=1.0):
+        ofs = self.get_draw_position(alpha)
+        return self.anim.get_rect().move_inplace(ofs.x, ofs.y)
 
     def get_id(self):
         return self.eid
 
+    def release(self):
+        super().release()
+        self.anim.release()
+
     def collision(self, other, col_point):
         pass
@@ -1,45 +1,338 @@
+from array import array
+
 from .utils import vector2
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+POSITION = 0
+PREPOS = 1
+VELOCITY = 2
+ACCEL = 3
+EXTERNAL = 4
+N_FIELDS = 5
+
+physics_store = None
+
+
+# EXPORT
+class PhysicsStore(object):
+    # Structure of arrays holding the state of all batched bodies.
+    # Each field has an x and a y row indexed by slot.
+    def __init__(self, capacity=256):
+        self.capacity = 0
+        self.count = 0
+        self.free_slots = []
+        self.data = None
+        self.scale = None
+        self.grow(capacity)
+
+    def grow(self, capacity):
+        if np is not None:
+            data = np.zeros((N_FIELDS, 2, capacity), dtype=np.float32)
+            scale = np.zeros(capacity, dtype=np.float32)
+            if self.data is not None:
+                data[:, :, :self.capacity] = self.data
+                scale[:self.capacity] = self.scale
+        else:
+            extra = capacity - self.capacity
+            data = self.data if self.data is not None else [array('f') for _ in range(N_FIELDS * 2)]
+            scale = self.scale if self.scale is not None else array('f')
+            for a in data:
+                a.extend(array('f', [0.0] * extra))
+            scale.extend(array('f', [0.0] * extra))
+        self.data = data
+        self.scale = scale
+        self.capacity = capacity
+
+    def allocate(self):
+        if len(self.free_slots) > 0:
+            return self.free_slots.pop()
+        if self.count >= self.capacity:
+            self.grow(self.capacity * 2)
+        slot = self.count
+        self.count += 1
+        return slot
+
+    def release(self, slot):
+        self.set_dynamic(slot, False)
+        for field in range(N_FIELDS):
+            self.set(slot, field, 0.0, 0.0)
+        self.free_slots.append(slot)
+
+    def set_dynamic(self, slot, dynamic):
+        self.scale[slot] = 1.0 if dynamic else 0.0
+
+    def get(self, slot, field):
+        if np is not None:
+            d = self.data[field]
+            return float(d[0, slot]), float(d[1, slot])
+        return self.data[field * 2][slot], self.data[field * 2 + 1][slot]
+
+    def set(self, slot, field, x, y):
+        if np is not None:
+            d = self.data[field]
+            d[0, slot] = x
+            d[1, slot] = y
+        else:
+            self.data[field * 2][slot] = x
+            self.data[field * 2 + 1][slot] = y
+
+    def integrate(self, dt):
+        # Same update as RigidBody.advance, applied to every dynamic slot at once
+        n = self.count
+        if np is not None:
+            d = self.data[:, :, :n]
+            k = self.scale[:n] * dt
+            np.copyto(d[PREPOS], d[POSITION])
+            d[POSITION] += d[VELOCITY] * k
+            d[VELOCITY] += (d[ACCEL] + d[EXTERNAL]) * k
+        else:
+            d = self.data
+            px, py = d[POSITION * 2], d[POSITION * 2 + 1]
+            qx, qy = d[PREPOS * 2], d[PREPOS * 2 + 1]
+            vx, vy = d[VELOCITY * 2], d[VELOCITY * 2 + 1]
+            ax, ay = d[ACCEL * 2], d[ACCEL * 2 + 1]
+            ex, ey = d[EXTERNAL * 2], d[EXTERNAL * 2 + 1]
+            scale = self.scale
+            for i in range(n):
+                k = scale[i] * dt
+                qx[i] = px[i]
+                qy[i] = py[i]
+                if k != 0.0:
+                    px[i] += vx[i] * k
+                    py[i] += vy[i] * k
+                    vx[i] += (ax[i] + ex[i]) * k
+                    vy[i] += (ay[i] + ey[i]) * k
+
+
+# EXPORT
+def enable_batch_physics(capacity=256):
+    # Dynamic bodies added to a scene after this call keep their state in the shared store
+    global physics_store
+    if not physics_store:
+        physics_store = PhysicsStore(capacity)
+    return physics_store
+
+
+# EXPORT
+def get_physics_store():
+    return physics_store
+
 
 # EXPORT
 class RigidBody(object):
+    # A body takes a store slot only while it is in a batched scene, see Scene.add and release
     def __init__(self):
+        self.store = None
+        self.slot = -1
         self.accel = vector2(0.0, 0.0)
         self.velocity = vector2(0.0, 0.0)
         self.position = vector2(0.0, 0.0)
         self.prepos = vector2(0.0, 0.0)
         self.external = vector2(0.0, 0.0)
 
+    def attach(self, store):
+        # Moves the state into the batch store, which integrates the body from then on
+        if not self.store:
+            slot = store.allocate()
+            store.set(slot, ACCEL, self.accel.x, self.accel.y)
+            store.set(slot, VELOCITY, self.velocity.x, self.velocity.y)
+            store.set(slot, POSITION, self.position.x, self.position.y)
+            store.set(slot, PREPOS, self.prepos.x, self.prepos.y)
+            store.set(slot, EXTERNAL, self.external.x, self.external.y)
+            store.set_dynamic(slot, True)
+            self.store = store
+            self.slot = slot
+
+    def release(self):
+        # Moves the state out of the batch store, the body keeps working standalone
+        if self.store:
+            store = self.store
+            self.accel = vector2(store.get(self.slot, ACCEL))
+            self.velocity = vector2(store.get(self.slot, VELOCITY))
+            self.position = vector2(store.get(self.slot, POSITION))
+            self.prepos = vector2(store.get(self.slot, PREPOS))
+            self.external = vector2(store.get(self.slot, EXTERNAL))
+            store.release(self.slot)
+            self.store = None
+            self.slot = -1
+
     def get_external_force(self):
+        if self.store:
+            return vector2(self.store.get(self.slot, EXTERNAL))
         return self.external
 
     def set_external_force(self, *args):
-        self.external = vector2(*args)
+        if self.store:
+            v = vector2(*args)
+            self.store.set(self.slot, EXTERNAL, v.x, v.y)
+        else:
+            self.external = vector2(*args)
 
     def advance(self, dt):
-        self.prepos = self.position
-        self.position = self.position + self.velocity.scaled(dt)
-        self.velocity += (self.accel + self.external).scaled(dt)
+        # Entity logic, the scene integrates every body after advancing it, see integrate
+        pass
+
+    def integrate(self, dt):
+        # Batched bodies are integrated together by PhysicsStore.integrate
+        if self.store:
+            return
+        p = self.position
+        v = self.velocity
+        self.prepos.x = p.x
+        self.prepos.y = p.y
+        p.add_to(v.x * dt, v.y * dt)
+        v.add_to((self.accel.x + self.external.x) * dt, (self.accel.y + self.external.y) * dt)
 
     def revert(self, revx=True, revy=True):
+        if self.store:
+            px, py = self.store.get(self.slot, POSITION)
+            qx, qy = self.store.get(self.slot, PREPOS)
+            self.store.set(self.slot, POSITION, qx if revx else px, qy if revy else py)
+            return
         x = self.prepos.x if revx else self.position.x
         y = self.prepos.y if revy else self.position.y
         self.position = vector2(x, y)
 
     def get_position(self):
+        if self.store:
+            x, y = self.store.get(self.slot, POSITION)
+            return vector2(int(x), int(y))
         return vector2(int(self.position.x), int(self.position.y))
 
     def set_position(self, *args):
-        self.position = vector2(*args)
+        # Placing a body also resets its previous position, so it is not interpolated from the old one
+        v = vector2(*args)
+        if self.store:
+            self.store.set(self.slot, POSITION, v.x, v.y)
+            self.store.set(self.slot, PREPOS, v.x, v.y)
+        else:
+            self.position = v
+            self.prepos = vector2(v.x, v.y)
+
+    def get_interpolated_position(self, alpha):
+        # Between the position before the last step (alpha=0) and the current one (alpha=1)
+        if self.store:
+            px, py = self.store.get(self.slot, POSITION)
+            qx, qy = self.store.get(self.slot, PREPOS)
+        else:
+            px, py = self.position.x, self.position.y
+            qx, qy = self.prepos.x, self.prepos.y
+        return vector2(int(qx + (px - qx) * alpha), int(qy + (py - qy) * alpha))
 
     def get_velocity(self):
+        if self.store:
+            return vector2(self.store.get(self.slot, VELOCITY))
         return vector2(self.velocity.x, self.velocity.y)
 
     def set_velocity(self, *args):
-        self.velocity = vector2(*args)
+        if self.store:
+            v = vector2(*args)
+            self.store.set(self.slot, VELOCITY, v.x, v.y)
+        else:
+            self.velocity = vector2(*args)
 
     def get_accel(self):
+        if self.store:
+            return vector2(self.store.get(self.slot, ACCEL))
         return vector2(self.accel.x, self.accel.y)
 
     def set_accel(self, *args):
-        self.accel = vector2(*args)
+        if self.store:
+            v = vector2(*args)
+            self.store.set(self.slot, ACCEL, v.x, v.y)
+        else:
+            self.accel = vector2(*args)
+
+
+def benchmark(n=5000, frames=30):
+    import time
+    global physics_store
+    saved = physics_store
+    results = {}
+    for name in ('per_object', 'batch'):
+        physics_store = PhysicsStore(n) if name == 'batch' else None
+        bodies = [RigidBody() for _ in range(n)]
+        for i in range(n):
+            b = bodies[i]
+            b.set_position(i % 640, i // 640)
+            b.set_velocity(10.0, -5.0)
+            b.set_accel(0.0, 200.0)
+            if physics_store:
+                b.attach(physics_store)
+        start = time.perf_counter()
+        for _ in range(frames):
+            if physics_store:
+                physics_store.integrate(1.0 / 30)
+            else:
+                for b in bodies:
+                    b.integrate(1.0 / 30)
+        results[name] = (time.perf_counter() - start) / frames
+        print(name + ": " + str(round(results[name] * 1000, 2)) + " ms/frame for " + str(n) + " bodies, final " +
+              str(bodies[-1].get_position()))
+    physics_store = saved
+    return results
+
+
+def unit_test(steps=120):
+    # Batched and per object scenes must move bodies identically, values are exact in float32
+    from .entity import Entity
+    from .scene import Scene
+    from .sprite import AnimatedSprite
+    global physics_store
+
+    class Bouncer(Entity):
+        def advance(self, dt):
+            # Logic after the base class call, which used to integrate in one path and not the other
+            res = super().advance(dt)
+            v = self.get_velocity()
+            if self.get_position().y > 40 and v.y > 0:
+                self.set_position(self.get_position().x, 40)
+                self.set_velocity(v.x, -v.y)
+            return res
+
+    saved = physics_store
+    paths = []
+    ok = True
+    try:
+        for batch in (False, True):
+            physics_store = PhysicsStore(4) if batch else None
+            for _ in range(10):
+                RigidBody()
+            scene = Scene()
+            bodies = []
+            for i in range(6):
+                e = Bouncer(AnimatedSprite())
+                e.set_position(i * 8, 0)
+                e.set_velocity(32.0 + i * 4, -16.0)
+                e.set_accel(0.0, 64.0)
+                scene.add(e)
+                bodies.append(e)
+            if batch and physics_store.count != 6:
+                print("Bodies outside of a scene took store slots")
+                ok = False
+            path = []
+            for _ in range(steps):
+                scene.advance(1.0 / 64)
+                path.append([(e.get_position().x, e.get_position().y) for e in bodies])
+            paths.append(path)
+            for e in bodies:
+                scene.remove(e.get_id())
+            if batch and len(physics_store.free_slots) != 6:
+                print("Removed bodies kept their store slots")
+                ok = False
+    finally:
+        physics_store = saved
+    if paths[0] != paths[1]:
+        print("Batched bodies moved differently")
+        ok = False
+    if ok:
+        print("All tests successful")
+    return ok
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,143 @@
+import json
+import time
+from array import array
+
+# Per frame columns of the ring buffer, phase timings are in microseconds.
+# advance includes collisions, present is the backend showing a finished frame.
+PHASES = ('frame', 'advance', 'collisions', 'draw', 'flush', 'present')
+COUNTERS = ('entities', 'pairs', 'contacts', 'sprites', 'bytes')
+COLUMNS = PHASES + COUNTERS
+
+if hasattr(time, 'perf_counter_ns'):
+    def ticks_us():
+        return time.perf_counter_ns() // 1000
+
+    def ticks_diff(t1, t0):
+        return t1 - t0
+else:
+    ticks_us = time.ticks_us
+    ticks_diff = time.ticks_diff
+
+# The profiler being recorded into, hooks cost a single global lookup while it is None
+active = None
+last = None
+
+
+# EXPORT
+class Profiler(object):
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.size = capacity + 1  # One more row for the frame in progress
+        self.columns = {}
+        for name in COLUMNS:
+            self.columns[name] = array('l', [0] * self.size)
+        self.pos = 0
+        self.count = 0
+        self.frame_start = 0
+        self.overlay = False
+
+    def clear(self):
+        for name in COLUMNS:
+            col = self.columns.get(name)
+            for i in range(self.size):
+                col[i] = 0
+        self.pos = 0
+        self.count = 0
+
+    @staticmethod
+    def start():
+        return ticks_us()
+
+    def stop(self, phase, t0):
+        self.columns[phase][self.pos] += ticks_diff(ticks_us(), t0)
+
+    def add(self, counter, n=1):
+        self.columns[counter][self.pos] += n
+
+    def set(self, counter, n):
+        self.columns[counter][self.pos] = n
+
+    def begin_frame(self):
+        self.frame_start = ticks_us()
+
+    def end_frame(self):
+        # Work between frames, like handling events and pacing, counts towards the next one
+        self.stop('frame', self.frame_start)
+        pos = (self.pos + 1) % self.size
+        for name in COLUMNS:
+            self.columns[name][pos] = 0
+        self.pos = pos
+        self.count = min(self.count + 1, self.capacity)
+
+    def rows(self):
+        # Recorded frames, oldest first, as lists in COLUMNS order
+        res = []
+        first = (self.pos - self.count) % self.size
+        for i in range(self.count):
+            j = (first + i) % self.size
+            res.append([self.columns[name][j] for name in COLUMNS])
+        return res
+
+    def averages(self, frames=30):
+        rows = self.rows()[-frames:]
+        if not rows:
+            return None
+        return [sum([row[i] for row in rows]) // len(rows) for i in range(len(COLUMNS))]
+
+    def write_csv(self, filename):
+        with open(filename, 'w') as f:
+            f.write(','.join(COLUMNS) + '\n')
+            for row in self.rows():
+                f.write(','.join([str(v) for v in row]) + '\n')
+
+    def write_json(self, filename):
+        with open(filename, 'w') as f:
+            json.dump({'columns': list(COLUMNS), 'frames': self.rows()}, f)
+
+    def draw_overlay(self, scr, x=0, y=0):
+        # Averages of the last frames, in text cells at the top left of the screen
+        avg = self.averages()
+        if not avg:
+            return
+        values = dict(zip(COLUMNS, avg))
+        frame = values.get('frame')
+        lines = ['fps ' + str(1000000 // frame if frame > 0 else 0) + ' frame ' + str(frame) + 'us',
+                 'adv ' + str(values.get('advance')) + ' col ' + str(values.get('collisions')) +
+                 ' draw ' + str(values.get('draw')) + ' flush ' + str(values.get('flush')),
+                 'ent ' + str(values.get('entities')) + ' pairs ' + str(values.get('pairs')) +
+                 ' spr ' + str(values.get('sprites')) + ' bytes ' + str(values.get('bytes'))]
+        for i in range(len(lines)):
+            scr.text_cursor(x, y + i)
+            scr.text(lines[i])
+
+
+# EXPORT
+def enable_profiler(capacity=256, overlay=False, scr=None):
+    # Starts recording, into the previous profiler if there is one, and hooks the screen backend
+    global active, last
+    if last is None or last.capacity != capacity:
+        last = Profiler(capacity)
+    active = last
+    active.overlay = overlay
+    if scr is None:
+        from .app import get_screen
+        scr = get_screen()
+    scr.profiler = active
+    return active
+
+
+# EXPORT
+def disable_profiler():
+    # Stops recording, the returned profiler keeps its frames for export
+    global active
+    p = active
+    active = None
+    from . import app
+    if app.app_screen:
+        app.app_screen.profiler = None
+    return p
+
+
+# EXPORT
+def get_profiler():
+    return last
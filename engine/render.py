@@ -0,0 +1,357 @@
+from . import profiler
+from .app import get_screen
+from .utils import Rect
+
+# Wire size of the commands issued by the renderer, as encoded by gpu.screen
+FILL_BYTES = 3 + 5 + 5
+SPRITE_BYTES = 5 + 4
+SEARCH_MARGIN = 32
+
+
+def absorb(rects, r):
+    # Adds r to rects that do not overlap, uniting it with every one it comes to overlap
+    i = 0
+    while i < len(rects):
+        if rects[i].overlaps(r):
+            r.union(rects.pop(i))
+            i = 0
+        else:
+            i += 1
+    rects.append(r)
+
+
+def union_rects(rects, limit=None, max_area=None):
+    # Rects covering the same area that do not overlap each other,
+    # None as soon as there are more than limit of them or they cover more than max_area
+    res = []
+    for r in rects:
+        absorb(res, Rect(r))
+        if limit is not None and len(res) > limit:
+            return None
+        if max_area is not None and region_area(res) > max_area:
+            return None
+    return res
+
+
+def merge_rects(rects, max_rects):
+    # Unions overlapping rects, then the cheapest pairs until at most max_rects remain
+    res = union_rects(rects)
+    while len(res) > max_rects:
+        best = None
+        for i in range(len(res)):
+            a = res[i]
+            for j in range(i + 1, len(res)):
+                b = res[j]
+                w = max(a.br.x, b.br.x) - min(a.tl.x, b.tl.x)
+                h = max(a.br.y, b.br.y) - min(a.tl.y, b.tl.y)
+                cost = w * h - a.area() - b.area()
+                if best is None or cost < best[0]:
+                    best = cost, i, j
+        b = res.pop(best[2])
+        a = res.pop(best[1])
+        absorb(res, a.union(b))
+    return res
+
+
+def region_area(rects):
+    # Rects from merge_rects do not overlap, so this is the area of their union
+    return sum([r.area() for r in rects])
+
+
+# EXPORT
+class DirtyRenderer(object):
+    # Past full_fraction of the view, or too many separate rects, the whole view is redrawn instead
+    def __init__(self, bg_color=0, max_rects=8, buffers=None, full_fraction=0.5):
+        self.bg_color = bg_color
+        self.max_rects = max_rects
+        self.full_fraction = full_fraction
+        self.buffers = buffers
+        self.states = {}
+        self.history = []
+        self.last_view = None
+        self.static_version = None
+        self.full = True
+        self.pixels = 0
+        self.bytes = 0
+        self.sprites = 0
+
+    def invalidate(self):
+        self.full = True
+
+    def reset_stats(self):
+        self.pixels = 0
+        self.bytes = 0
+        self.sprites = 0
+
+    def entity_state(self, e, alpha):
+        r = e.get_draw_rect(alpha)
+        return r.tl.x, r.tl.y, r.br.x, r.br.y, e.anim.get_current_sprite()
+
+    def collect_dirty(self, scene, alpha, view_rect):
+        # World rects whose content changed since the last frame, as (x0, y0, x1, y1).
+        # Only entities drawn inside the view are tracked, one leaving it dirties where it was.
+        # The index holds where they are after the last step, a margin covers the interpolated ones.
+        dirty = []
+        states = {}
+        x0 = view_rect.tl.x
+        y0 = view_rect.tl.y
+        x1 = view_rect.br.x
+        y1 = view_rect.br.y
+        for eid, r in scene.index.search(Rect(view_rect).inflate(SEARCH_MARGIN)):
+            e = scene.entities.get(eid)
+            if e:
+                s = self.entity_state(e, alpha)
+                if s[0] < x1 and x0 < s[2] and s[1] < y1 and y0 < s[3]:
+                    states[eid] = s
+        for eid in states:
+            cur = states.get(eid)
+            prev = self.states.get(eid)
+            if prev != cur:
+                dirty.append(cur[0:4])
+                if prev:
+                    dirty.append(prev[0:4])
+        for eid in self.states:
+            if eid not in states:
+                dirty.append(self.states.get(eid)[0:4])
+        self.states = states
+        return dirty
+
+    def search(self, scene, r):
+        # Statics from their index, dynamics by the rects they are drawn at,
+        # which differ from the indexed ones while interpolating
+        res = scene.static_index.search(r)
+        for eid in self.states:
+            s = self.states.get(eid)
+            if s[0] < r.br.x and r.tl.x < s[2] and s[1] < r.br.y and r.tl.y < s[3]:
+                res.append((eid, Rect(s[0], s[1], s[2], s[3])))
+        return res
+
+    def close_region(self, scene, rects, view_rect):
+        # Grows the region until every entity touching it lies inside it, within the view,
+        # so redrawing whole sprites never paints over pixels outside the region.
+        # Returns None, None when a full redraw is cheaper.
+        limit = view_rect.area() * self.full_fraction
+        redraw = set()
+        changed = True
+        while changed:
+            changed = False
+            rects = union_rects(rects, 4 * self.max_rects, limit)
+            if rects is None:
+                return None, None
+            rects = merge_rects(rects, self.max_rects)
+            if region_area(rects) > limit:
+                return None, None
+            for layer in scene.layers:
+                # Tiles are redrawn whole as well
+                for i in range(len(rects)):
+                    snapped = layer.snap(rects[i])
+                    if snapped != rects[i]:
+                        rects[i] = snapped
+                        changed = True
+            for r in list(rects):
+                for eid, er in self.search(scene, r):
+                    if eid in redraw:
+                        continue
+                    redraw.add(eid)
+                    er = er.intersection(view_rect)
+                    if not any(rr.contains(er) for rr in rects):
+                        rects.append(er)
+                        changed = True
+        return rects, redraw
+
+    def clear(self, scr, r, view_rect):
+        x0 = max(r.tl.x, view_rect.tl.x)
+        y0 = max(r.tl.y, view_rect.tl.y)
+        x1 = min(r.br.x, view_rect.br.x)
+        y1 = min(r.br.y, view_rect.br.y)
+        if x1 > x0 and y1 > y0:
+            scr.bg_color(self.bg_color)
+            scr.fill_rect(int(x0 - view_rect.tl.x), int(y0 - view_rect.tl.y), int(x1 - x0), int(y1 - y0))
+            self.pixels += (x1 - x0) * (y1 - y0)
+            self.bytes += FILL_BYTES
+
+    def draw_tiles(self, scene, view, rects):
+        for layer in scene.layers:
+            cells = set()
+            for r in rects:
+                cells.update(layer.tiles_in(r))
+            for col, row in sorted(cells):
+                layer.draw_tile(view, col, row)
+                self.sprites += 1
+                self.pixels += 32 * 32
+                self.bytes += SPRITE_BYTES
+
+    def draw_entities(self, scene, view, ids):
+        # Same order as Scene.draw: statics, then dynamics, each by id
+        statics = sorted([eid for eid in ids if eid in scene.statics])
+        dynamics = sorted([eid for eid in ids if eid not in scene.statics])
+        for eid in statics + dynamics:
+            e = scene.entities.get(eid)
+            if e:
+                e.draw(view)
+                self.sprites += 1
+                self.pixels += 32 * 32
+                self.bytes += SPRITE_BYTES
+
+    def draw(self, scene, view):
+        p = profiler.active
+        if p:
+            t0 = p.start()
+        self.render(scene, view)
+        if p:
+            p.add('sprites', self.sprites)
+            p.stop('draw', t0)
+
+    def redraw_view(self, scr, scene, view, view_rect):
+        self.clear(scr, view_rect, view_rect)
+        for layer in scene.layers:
+            n = layer.draw(view)
+            self.sprites += n
+            self.pixels += n * 32 * 32
+            self.bytes += n * SPRITE_BYTES
+        self.draw_entities(scene, view, [v[0] for v in self.search(scene, view_rect)])
+
+    def render(self, scene, view):
+        self.reset_stats()
+        scr = get_screen()
+        buffers = self.buffers if self.buffers else getattr(scr, 'buffer_count', 1)
+        view_rect = view.get_rect()
+        static_version = (scene.static_version, [layer.version for layer in scene.layers])
+        if view_rect != self.last_view or static_version != self.static_version:
+            self.full = True
+        scene.update_statics()
+        dirty = self.collect_dirty(scene, view.alpha, view_rect)
+        if self.full:
+            self.full = False
+            self.last_view = view_rect
+            self.static_version = static_version
+            self.history = [[view_rect.as_tuple()]] * buffers
+            self.redraw_view(scr, scene, view, view_rect)
+            return
+        # With several framebuffers the one being drawn also misses the previous frames' changes
+        self.history = (self.history + [dirty])[-buffers:]
+        if sum([len(rects) for rects in self.history]) > 16 * self.max_rects:
+            # So many changes that sorting them out costs more than drawing everything
+            self.redraw_view(scr, scene, view, view_rect)
+            return
+        region = []
+        x0 = view_rect.tl.x
+        y0 = view_rect.tl.y
+        x1 = view_rect.br.x
+        y1 = view_rect.br.y
+        for rects in self.history:
+            for r in rects:
+                if r[0] < x1 and x0 < r[2] and r[1] < y1 and y0 < r[3]:
+                    region.append(Rect(max(r[0], x0), max(r[1], y0), min(r[2], x1), min(r[3], y1)))
+        if len(region) == 0:
+            return
+        region, redraw = self.close_region(scene, region, view_rect)
+        if region is None:
+            self.redraw_view(scr, scene, view, view_rect)
+            return
+        for r in region:
+            self.clear(scr, r, view_rect)
+        self.draw_tiles(scene, view, region)
+        self.draw_entities(scene, view, redraw)
+
+
+# EXPORT
+class BackgroundRenderer(object):
+    # Tile layers and static entities are composed once into the backend's offscreen layer,
+    # each frame copies it to the screen and draws only the dynamic entities over it.
+    # A scrolled view shifts the layer and composes just the exposed strips.
+    def __init__(self, bg_color=0):
+        self.bg_color = bg_color
+        self.version = None
+        self.last_view = None
+        self.sprites = 0
+        self.composed = 0
+        self.strips = 0
+
+    def invalidate(self):
+        self.version = None
+
+    def draw(self, scene, view):
+        p = profiler.active
+        if p:
+            t0 = p.start()
+        self.render(scene, view)
+        if p:
+            p.add('sprites', self.sprites)
+            p.stop('draw', t0)
+
+    def compose(self, scr, scene, view, x, y, w, h):
+        # Fills and draws the statics of a screen rect of the layer
+        scr.set_clip(x, y, w, h)
+        scr.bg_color(self.bg_color)
+        scr.fill_rect(x, y, w, h)
+        tl = view.rect.tl
+        self.sprites += scene.draw_statics(view, Rect(tl.x + x, tl.y + y, tl.x + x + w, tl.y + y + h))
+        self.strips += 1
+
+    def render(self, scene, view):
+        scr = get_screen()
+        r = view.get_rect()
+        self.sprites = 0
+        if not hasattr(scr, 'begin_background'):
+            # No offscreen layer in this backend, everything is drawn every frame
+            scr.bg_color(self.bg_color)
+            scr.fill_rect(0, 0, int(r.width()), int(r.height()))
+            self.sprites = scene.draw_statics(view, r) + scene.draw_dynamics(view, r)
+            return
+        version = (scene.static_version, [layer.version for layer in scene.layers], self.bg_color)
+        w = int(r.width())
+        h = int(r.height())
+        if version != self.version or self.last_view is None:
+            strips = None
+        else:
+            dx = r.tl.x - self.last_view.tl.x
+            dy = r.tl.y - self.last_view.tl.y
+            # The layer moves in whole pixels only
+            strips = [] if dx == 0 and dy == 0 else None
+            if (dx or dy) and dx == int(dx) and dy == int(dy):
+                scr.begin_background()
+                strips = scr.shift(int(dx), int(dy))
+                for strip in strips:
+                    self.compose(scr, scene, view, strip[0], strip[1], strip[2], strip[3])
+                scr.end_background()
+        if strips is None:
+            scr.begin_background()
+            self.compose(scr, scene, view, 0, 0, w, h)
+            scr.end_background()
+            self.composed += 1
+        self.version = version
+        self.last_view = r
+        scr.restore_background()
+        self.sprites += scene.draw_dynamics(view, r)
+
+
+def unit_test():
+    # Merged rects must cover every input, not overlap each other and stay within the limit
+    import random
+    random.seed(1)
+    ok = True
+    for _ in range(200):
+        rects = []
+        for _ in range(random.randint(1, 40)):
+            x = random.randint(0, 600)
+            y = random.randint(0, 440)
+            rects.append(Rect(x, y, x + random.randint(1, 40), y + random.randint(1, 40)))
+        merged = merge_rects(rects, 8)
+        if len(merged) > 8:
+            ok = False
+        for r in rects:
+            if not any(m.contains(r) for m in merged):
+                ok = False
+        for i in range(len(merged)):
+            for j in range(i + 1, len(merged)):
+                if merged[i].overlaps(merged[j]):
+                    ok = False
+    if union_rects(rects, 0) is not None or union_rects(rects, max_area=0) is not None:
+        ok = False
+    print("All tests successful" if ok else "merge_rects test failed")
+    return ok
+
+
+if __name__ == '__main__':
+    unit_test()
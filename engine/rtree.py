@@ -1,107 +1,156 @@
 #!/usr/bin/env python3
+import math
+import time
 from random import randint, seed
 
 from .utils import Rect
 
+MAX_ENTRIES = 8
+MIN_ENTRIES = 3
+
 
 class RTreeNode(object):
-    def __init__(self, parent):
+    def __init__(self, parent, leaf=True):
+        self.parent = parent
+        self.leaf = leaf
         self.children = []
         self.items = []
-        self.rect = None
-        self.parent = parent
+        self.x0 = 0
+        self.y0 = 0
+        self.x1 = 0
+        self.y1 = 0
 
-    def move(self, rid, rect):
-        if self.rect.contains(rect):
-            for i in range(len(self.items)):
-                if self.items[i][0] == rid:
-                    self.items[i] = (rid, rect)
-                    return True
-        return False
+    def size(self):
+        return len(self.items) if self.leaf else len(self.children)
+
+    def get_rect(self):
+        return Rect(self.x0, self.y0, self.x1, self.y1)
 
-    def add_item(self, rid, rect):
-        if not self.rect:
-            self.rect = Rect(rect)
+    def extend(self, rect):
+        if self.size() == 0:
+            self.x0 = rect.tl.x
+            self.y0 = rect.tl.y
+            self.x1 = rect.br.x
+            self.y1 = rect.br.y
         else:
-            self.rect.union(rect)
-        if len(self.children) > 0:
-            return self.add_to_child(rid, rect)
+            if rect.tl.x < self.x0:
+                self.x0 = rect.tl.x
+            if rect.tl.y < self.y0:
+                self.y0 = rect.tl.y
+            if rect.br.x > self.x1:
+                self.x1 = rect.br.x
+            if rect.br.y > self.y1:
+                self.y1 = rect.br.y
+
+    def extend_node(self, node):
+        if node.x0 < self.x0:
+            self.x0 = node.x0
+        if node.y0 < self.y0:
+            self.y0 = node.y0
+        if node.x1 > self.x1:
+            self.x1 = node.x1
+        if node.y1 > self.y1:
+            self.y1 = node.y1
+
+    def recalc_rect(self):
+        if self.leaf:
+            if len(self.items) == 0:
+                self.x0 = self.y0 = self.x1 = self.y1 = 0
+                return
+            r = self.items[0][1]
+            self.x0, self.y0, self.x1, self.y1 = r.tl.x, r.tl.y, r.br.x, r.br.y
+            for item in self.items:
+                r = item[1]
+                if r.tl.x < self.x0:
+                    self.x0 = r.tl.x
+                if r.tl.y < self.y0:
+                    self.y0 = r.tl.y
+                if r.br.x > self.x1:
+                    self.x1 = r.br.x
+                if r.br.y > self.y1:
+                    self.y1 = r.br.y
         else:
-            self.items.append((rid, rect))
-            if len(self.items) >= 8:
-                return self.split_node()
-            return self
+            if len(self.children) == 0:
+                self.x0 = self.y0 = self.x1 = self.y1 = 0
+                return
+            c = self.children[0]
+            self.x0, self.y0, self.x1, self.y1 = c.x0, c.y0, c.x1, c.y1
+            for c in self.children:
+                self.extend_node(c)
 
-    def add_to_child(self, rid, rect):
-        min_delta = 99999999
+    def contains(self, rect):
+        return rect.tl.x >= self.x0 and rect.tl.y >= self.y0 and rect.br.x <= self.x1 and rect.br.y <= self.y1
+
+    def choose_child(self, rect):
         best_child = None
+        min_delta = 0
+        min_area = 0
         for c in self.children:
-            r = Rect(rect)
-            r.union(c.rect)
-            delta = r.area() - c.rect.area()
-            if delta < min_delta:
-                min_delta = delta
+            area = (c.x1 - c.x0) * (c.y1 - c.y0)
+            w = max(c.x1, rect.br.x) - min(c.x0, rect.tl.x)
+            h = max(c.y1, rect.br.y) - min(c.y0, rect.tl.y)
+            delta = w * h - area
+            if best_child is None or delta < min_delta or (delta == min_delta and area < min_area):
                 best_child = c
-        if not best_child:
-            return self.add_item(rid, rect)
-        return best_child.add_item(rid, rect)
+                min_delta = delta
+                min_area = area
+        return best_child
 
-    def split_node(self):
-        if randint(0, 1) == 0:
-            self.items.sort(key=lambda t: t[1].tl.x)
-        else:
-            self.items.sort(key=lambda t: t[1].tl.y)
-        mid = int(len(self.items) / 2)
-        self.children.append(RTreeNode(self))
-        for i in self.items[0:mid]:
-            self.children[-1].add_item(i[0], i[1])
-        self.children.append(RTreeNode(self))
-        for i in self.items[mid:]:
-            self.children[-1].add_item(i[0], i[1])
-        self.items = []
-        return self.children
+    def get_depth(self):
+        depth = 1
+        node = self
+        while not node.leaf:
+            node = node.children[0]
+            depth += 1
+        return depth
 
-    def search(self, rect):
-        res = []
-        if not self.rect:
-            return res
-        if rect.overlaps(self.rect):
-            for i in self.items:
-                if i[1].overlaps(rect):
-                    res.append(i)
-            for c in self.children:
-                res = res + c.search(rect)
-        return res
 
-    def remove_item(self, rid):
-        for i in range(len(self.items)):
-            if self.items[i][0] == rid:
-                del self.items[i]
-                break
-        self.recalc_rect()
+def item_bounds(item):
+    r = item[1]
+    return r.tl.x, r.tl.y, r.br.x, r.br.y
 
-    def remove_child(self, child):
-        for i in range(0, len(self.children)):
-            if self.children[i] == child:
-                del self.children[i]
-                break
-        return True
 
-    def recalc_rect(self):
-        if len(self.children) == 0 and len(self.items) == 0 and self.parent:
-            return self.parent.remove_child(self)
-        self.rect = Rect()
-        for c in self.children:
-            self.rect.union(c.rect)
-        for item in self.items:
-            self.rect.union(item[1])
-        if self.parent:
-            self.parent.recalc_rect()
+def node_bounds(node):
+    return node.x0, node.y0, node.x1, node.y1
+
+
+def split_cost(entries, bounds):
+    # Sum of the perimeters of the two halves, used to pick the split axis
+    mid = len(entries) // 2
+    cost = 0
+    for part in (entries[:mid], entries[mid:]):
+        x0, y0, x1, y1 = bounds(part[0])
+        for e in part:
+            b = bounds(e)
+            x0 = min(x0, b[0])
+            y0 = min(y0, b[1])
+            x1 = max(x1, b[2])
+            y1 = max(y1, b[3])
+        cost += (x1 - x0) + (y1 - y0)
+    return cost
+
+
+def split_entries(entries, bounds):
+    by_x = sorted(entries, key=lambda e: bounds(e)[0] + bounds(e)[2])
+    by_y = sorted(entries, key=lambda e: bounds(e)[1] + bounds(e)[3])
+    entries = by_x if split_cost(by_x, bounds) <= split_cost(by_y, bounds) else by_y
+    mid = len(entries) // 2
+    return entries[:mid], entries[mid:]
 
-    def get_depth(self):
-        if len(self.children) > 0:
-            return self.children[0].get_depth() + 1
-        return 1
+
+def str_pack(entries, bounds, capacity):
+    # Sort-Tile-Recursive packing: vertical slices by x, then runs by y
+    n = len(entries)
+    pages = int(math.ceil(n / capacity))
+    slices = int(math.ceil(math.sqrt(pages)))
+    slice_size = slices * capacity
+    entries = sorted(entries, key=lambda e: bounds(e)[0] + bounds(e)[2])
+    groups = []
+    for i in range(0, n, slice_size):
+        vertical = sorted(entries[i:(i + slice_size)], key=lambda e: bounds(e)[1] + bounds(e)[3])
+        for j in range(0, len(vertical), capacity):
+            groups.append(vertical[j:(j + capacity)])
+    return groups
 
 
 # EXPORT
@@ -110,37 +159,179 @@ class RTree(object):
         self.root = RTreeNode(None)
         self.directory = {}
 
+    def __len__(self):
+        return len(self.directory)
+
+    def clear(self):
+        self.root = RTreeNode(None)
+        self.directory = {}
+
+    def bulk_load(self, items):
+        # Replaces the tree contents with a packed tree built from (rid, rect) pairs
+        self.clear()
+        items = [(rid, Rect(rect)) for rid, rect in items]
+        if len(items) == 0:
+            return
+        nodes = []
+        for group in str_pack(items, item_bounds, MAX_ENTRIES):
+            node = RTreeNode(None)
+            node.items = group
+            node.recalc_rect()
+            for item in group:
+                self.directory[item[0]] = node
+            nodes.append(node)
+        while len(nodes) > 1:
+            parents = []
+            for group in str_pack(nodes, node_bounds, MAX_ENTRIES):
+                node = RTreeNode(None, False)
+                node.children = group
+                for child in group:
+                    child.parent = node
+                node.recalc_rect()
+                parents.append(node)
+            nodes = parents
+        self.root = nodes[0]
+
     def add(self, rid, rect):
         rect = Rect(rect)
         self.remove(rid)
-        nodes = self.root.add_item(rid, rect)
-        if isinstance(nodes, list):
-            for child in nodes:
-                for item in child.items:
-                    self.directory[item[0]] = child
+        self.insert(rid, rect)
+
+    def insert(self, rid, rect):
+        node = self.root
+        while not node.leaf:
+            node.extend(rect)
+            node = node.choose_child(rect)
+        node.extend(rect)
+        node.items.append((rid, rect))
+        self.directory[rid] = node
+        while node and node.size() > MAX_ENTRIES:
+            node = self.split(node)
+
+    def split(self, node):
+        sibling = RTreeNode(node.parent, node.leaf)
+        if node.leaf:
+            node.items, sibling.items = split_entries(node.items, item_bounds)
+            for item in sibling.items:
+                self.directory[item[0]] = sibling
         else:
-            self.directory[rid] = nodes
+            node.children, sibling.children = split_entries(node.children, node_bounds)
+            for child in sibling.children:
+                child.parent = sibling
+        node.recalc_rect()
+        sibling.recalc_rect()
+        parent = node.parent
+        if not parent:
+            parent = RTreeNode(None, False)
+            parent.children = [node]
+            node.parent = parent
+            sibling.parent = parent
+            self.root = parent
+        parent.children.append(sibling)
+        parent.recalc_rect()
+        return parent
 
     def move(self, rid, rect):
-        if rid in self.directory:
-            node = self.directory.get(rid)
-            if not node.move(rid, rect):
-                self.add(rid, rect)
+        node = self.directory.get(rid)
+        if node is None:
+            return
+        if node.contains(rect):
+            for item in node.items:
+                if item[0] == rid:
+                    r = item[1]
+                    r.tl.x = rect.tl.x
+                    r.tl.y = rect.tl.y
+                    r.br.x = rect.br.x
+                    r.br.y = rect.br.y
+                    return
+        self.add(rid, rect)
 
     def remove(self, rid):
-        if rid in self.directory:
-            node = self.directory.get(rid)
-            node.remove_item(rid)
-            del self.directory[rid]
-            return True
-        return False
+        node = self.directory.get(rid)
+        if node is None:
+            return False
+        del self.directory[rid]
+        items = node.items
+        for i in range(len(items)):
+            if items[i][0] == rid:
+                del items[i]
+                break
+        self.condense(node)
+        return True
+
+    def condense(self, node):
+        # Underfull nodes are detached and their items re-inserted
+        orphans = []
+        while node.parent:
+            parent = node.parent
+            if node.size() < MIN_ENTRIES:
+                parent.children.remove(node)
+                self.collect_items(node, orphans)
+            else:
+                node.recalc_rect()
+            node = parent
+        node.recalc_rect()
+        while not self.root.leaf and len(self.root.children) == 1:
+            self.root = self.root.children[0]
+            self.root.parent = None
+        if not self.root.leaf and len(self.root.children) == 0:
+            self.root = RTreeNode(None)
+        for rid, rect in orphans:
+            self.insert(rid, rect)
+
+    def collect_items(self, node, out):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.leaf:
+                for item in node.items:
+                    del self.directory[item[0]]
+                    out.append(item)
+            else:
+                stack.extend(node.children)
 
     def search(self, rect):
-        return self.root.search(rect)
+        res = []
+        x0 = rect.tl.x
+        y0 = rect.tl.y
+        x1 = rect.br.x
+        y1 = rect.br.y
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.x0 >= x1 or node.x1 <= x0 or node.y0 >= y1 or node.y1 <= y0:
+                continue
+            if node.leaf:
+                for item in node.items:
+                    r = item[1]
+                    if r.tl.x < x1 and r.br.x > x0 and r.tl.y < y1 and r.br.y > y0:
+                        res.append(item)
+            else:
+                stack.extend(node.children)
+        return res
 
     def depth(self):
         return self.root.get_depth()
 
+    def validate(self):
+        stack = [self.root]
+        count = 0
+        while stack:
+            node = stack.pop()
+            if node.leaf:
+                for item in node.items:
+                    if not node.contains(item[1]) or self.directory.get(item[0]) is not node:
+                        return False
+                count += len(node.items)
+            else:
+                for c in node.children:
+                    if c.parent is not node or c.size() == 0:
+                        return False
+                    if c.x0 < node.x0 or c.y0 < node.y0 or c.x1 > node.x1 or c.y1 > node.y1:
+                        return False
+                stack.extend(node.children)
+        return count == len(self.directory)
+
 
 class BFTree(object):
     def __init__(self):
@@ -171,62 +362,114 @@ class BFTree(object):
         return ids[randint(0, len(ids) - 1)]
 
 
-def unit_test():
-    def rand_rect():
-        x = randint(0, 1000)
-        y = randint(0, 1000)
-        w = randint(16, 64)
-        h = randint(16, 64)
-        return Rect(x, y, x + w, y + h)
+def rand_rect(extent=1000):
+    x = randint(0, extent)
+    y = randint(0, extent)
+    w = randint(16, 64)
+    h = randint(16, 64)
+    return Rect(x, y, x + w, y + h)
+
 
+def same_results(res1, res2):
+    if len(res1) != len(res2):
+        return False
+    return sorted([r[0] for r in res1]) == sorted([r[0] for r in res2])
+
+
+def fuzz(index, ops=10000):
+    # Runs a random add/remove/search/move workload against index and BFTree,
+    # returns whether all searches matched and the time spent inside index
     seed(1)
-    t1 = RTree()
     t2 = BFTree()
-    fail = False
-    rects = 0
-    for i in range(10000):
-        if fail:
-            break
+    elapsed = 0.0
+    for i in range(ops):
         act = randint(0, 100)
         if act < 40:
             r = rand_rect()
             rid = i  # randint(0, 10000)
-            t1.add(rid, r)
+            start = time.perf_counter()
+            index.add(rid, r)
+            elapsed += time.perf_counter() - start
             t2.add(rid, r)
-            rects += 1
         elif act < 60:
             rid = t2.get_random_id()
-            if t1.remove(rid):
-                rects -= 1
+            start = time.perf_counter()
+            index.remove(rid)
+            elapsed += time.perf_counter() - start
             t2.remove(rid)
         elif act < 90:
             r = rand_rect()
-            res1 = t1.search(r)
-            res2 = t2.search(r)
-            if len(res1) != len(res2):
-                print("Mismatch result length")
+            start = time.perf_counter()
+            res1 = index.search(r)
+            elapsed += time.perf_counter() - start
+            if not same_results(res1, t2.search(r)):
+                print("Mismatch found ID")
                 print(i)
-                fail = True
-                break
-            res1.sort(key=lambda t: t[0])
-            res2.sort(key=lambda t: t[0])
-            for j in range(len(res1)):
-                if res1[j][0] != res2[j][0]:
-                    print("Mismatch found ID")
-                    print(i)
-                    fail = True
-                    break
+                return False, elapsed
         elif act < 100:
             rid = t2.get_random_id()
             r = rand_rect()
-            t1.move(rid, r)
+            start = time.perf_counter()
+            index.move(rid, r)
+            elapsed += time.perf_counter() - start
             t2.move(rid, r)
+        if i % 500 == 0 and hasattr(index, 'validate') and not index.validate():
+            print("Invalid tree structure")
+            print(i)
+            return False, elapsed
+    index.bulk_load([(rid, t2.rects.get(rid)) for rid in t2.rects])
+    if hasattr(index, 'validate') and not index.validate():
+        print("Invalid bulk loaded index")
+        return False, elapsed
+    for i in range(1000):
+        r = rand_rect()
+        if not same_results(index.search(r), t2.search(r)):
+            print("Mismatch in bulk loaded index")
+            return False, elapsed
+    return True, elapsed
+
+
+def unit_test():
+    from .spatialhash import SpatialHash
+    fail = False
+    for index in (RTree(), SpatialHash()):
+        ok, elapsed = fuzz(index)
+        print(type(index).__name__ + ": " + ("ok" if ok else "FAILED") + " " + str(round(elapsed * 1000, 1)) + "ms")
+        if not ok:
+            fail = True
     if not fail:
         print("All tests successful")
 
 
+def benchmark(sizes=(1000, 10000, 100000), queries=100):
+    from .spatialhash import SpatialHash
+    seed(2)
+    for n in sizes:
+        extent = int(40 * math.sqrt(n))
+        rects = [rand_rect(extent) for _ in range(n)]
+        probes = [rand_rect(extent).inflate(64) for _ in range(queries)]
+        print("n=" + str(n))
+        for name in ('RTree', 'RTree (bulk)', 'SpatialHash', 'BFTree'):
+            t = BFTree() if name == 'BFTree' else SpatialHash() if name == 'SpatialHash' else RTree()
+            start = time.perf_counter()
+            if name == 'RTree (bulk)':
+                t.bulk_load(enumerate(rects))
+            else:
+                for rid in range(n):
+                    t.add(rid, rects[rid])
+            build = time.perf_counter() - start
+            start = time.perf_counter()
+            for r in probes:
+                t.search(r)
+            search = (time.perf_counter() - start) / queries
+            start = time.perf_counter()
+            for rid in range(0, n, 10):
+                r = rects[rid]
+                t.move(rid, Rect(r).move((randint(-4, 4), randint(-4, 4))))
+            move = (time.perf_counter() - start) / len(range(0, n, 10))
+            print("  {:<13} build {:8.1f} ms  search {:8.1f} us  move {:6.1f} us".format(
+                name, build * 1e3, search * 1e6, move * 1e6))
+
+
 if __name__ == '__main__':
-    try:
-        unit_test()
-    except RecursionError:
-        print("RecursionError")
+    unit_test()
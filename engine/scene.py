@@ -1,66 +1,183 @@
+from . import physics
+from . import profiler
 from .rtree import RTree
 from .utils import Point
 
 
 # EXPORT
 class Scene(object):
-    def __init__(self):
+    def __init__(self, index_type=RTree):
         self.entities = {}
+        self.layers = []
         self.dynamics = set()
         self.statics = set()
-        self.rtree = RTree()
+        self.index = index_type()
+        self.static_index = index_type()
+        self.statics_dirty = False
+        self.static_version = 0
 
     def add(self, entity):
         eid = entity.get_id()
         self.entities[eid] = entity
         if entity.is_dynamic:
+            if physics.physics_store:
+                entity.attach(physics.physics_store)
             self.dynamics.add(eid)
+            self.index.add(eid, entity.get_rect())
         else:
             self.statics.add(eid)
-        r = entity.get_rect()
-        # self.rtree.add(eid, r)
+            self.statics_dirty = True
+            self.static_version += 1
+
+    def add_layer(self, layer):
+        # Tile layers are drawn below the entities, in the order they were added
+        self.layers.append(layer)
+        self.static_version += 1
+
+    def remove_layer(self, layer):
+        if layer in self.layers:
+            self.layers.remove(layer)
+            layer.release()
+            self.static_version += 1
+
+    def remove(self, eid):
+        if eid in self.dynamics:
+            self.dynamics.remove(eid)
+            self.index.remove(eid)
+        elif eid in self.statics:
+            self.statics.remove(eid)
+            self.statics_dirty = True
+            self.static_version += 1
+        if eid in self.entities:
+            self.entities.get(eid).release()
+            del self.entities[eid]
+
+    def update_statics(self):
+        # Statics never move, so they are loaded into their own index in one pass
+        if self.statics_dirty:
+            self.static_index.bulk_load([(eid, self.entities.get(eid).get_rect()) for eid in self.statics])
+            self.statics_dirty = False
+
+    def search(self, rect):
+        self.update_statics()
+        return self.static_index.search(rect) + self.index.search(rect)
 
     def advance(self, dt):
+        p = profiler.active
+        if p:
+            t0 = p.start()
+            p.set('entities', len(self.entities))
+        self.update_statics()
+        if physics.physics_store:
+            self.advance_batch(dt, physics.physics_store)
+        else:
+            self.advance_entities(dt)
+        if p:
+            p.stop('advance', t0)
+
+    def advance_entities(self, dt):
         ids = set(self.dynamics)  # Copy to allow deletions
         for eid in ids:
             e = self.entities.get(eid)
+            if not e:
+                continue
             before = e.get_rect()
             if not e.advance(dt):
-                # self.rtree.remove(eid)
-                self.dynamics.remove(eid)
-                del self.entities[eid]
+                self.remove(eid)
             else:
+                e.integrate(dt)
                 after = e.get_rect()
                 if before != after:
                     self.check_collisions(e, after)
                     after = e.get_rect()
-                    # self.rtree.move(e.get_id(), after)
+                self.index.move(eid, after)
+
+    def advance_batch(self, dt, store):
+        # Entity logic runs first, then all stored bodies are integrated in one step,
+        # the same order as advance_entities
+        moving = []
+        for eid in set(self.dynamics):
+            e = self.entities.get(eid)
+            if not e:
+                continue
+            before = e.get_rect()
+            if not e.advance(dt):
+                self.remove(eid)
+            else:
+                moving.append((e, before))
+        store.integrate(dt)
+        for e, before in moving:
+            after = e.get_rect()
+            if before != after:
+                self.check_collisions(e, after)
+                after = e.get_rect()
+            self.index.move(e.get_id(), after)
 
     def draw(self, view):
-        # visible = self.rtree.search(view.get_rect())
-        # vis_id = [v[0] for v in visible]
-        # ids = [eid for eid in vis_id if eid in self.statics]
-        # ids.extend([eid for eid in vis_id if eid not in self.statics])
-        ids = list(self.statics) + list(self.dynamics)
+        r = view.get_rect()
+        p = profiler.active
+        if p:
+            t0 = p.start()
+        count = self.draw_statics(view, r) + self.draw_dynamics(view, r)
+        if p:
+            p.add('sprites', count)
+            p.stop('draw', t0)
+
+    def draw_statics(self, view, r):
+        # Tile layers and static entities touching the world rect r, returns how many were drawn
+        self.update_statics()
+        count = 0
+        for layer in self.layers:
+            count += layer.draw(view, r)
+        ids = sorted([v[0] for v in self.static_index.search(r)])
+        for eid in ids:
+            e = self.entities.get(eid)
+            if e:
+                e.draw(view)
+        return count + len(ids)
+
+    def draw_dynamics(self, view, r):
+        ids = sorted([v[0] for v in self.index.search(r)])
         for eid in ids:
             e = self.entities.get(eid)
             if e:
                 e.draw(view)
+        return len(ids)
 
     def check_collisions(self, entity, rect):
-        return
-        eid = entity.get_id()
         spr1 = entity.anim.get_current_sprite()
-        cands = self.rtree.search(rect)
+        if not spr1 or not spr1.mask:
+            return
+        p = profiler.active
+        if p:
+            t0 = p.start()
+        eid = entity.get_id()
+        pairs = 0
+        contacts = 0
+        for layer in self.layers:
+            n, c = layer.collide(entity, spr1.mask, rect)
+            pairs += n
+            contacts += c
+        cands = self.search(rect)
         for (cand_id, cand_rect) in cands:
             if cand_id != eid:
                 cand = self.entities.get(cand_id)
+                if not cand:
+                    continue
                 spr2 = cand.anim.get_current_sprite()
+                if not spr2 or not spr2.mask:
+                    continue
                 offset = cand.get_position() - entity.get_position()
                 ox = int(offset.x)
                 oy = int(offset.y)
+                pairs += 1
                 pt = spr1.mask.overlap(spr2.mask, Point(ox, oy))
                 if pt:
+                    contacts += 1
                     dx, dy = pt.x, pt.y
                     entity.collision(cand, Point(dx, dy))
                     cand.collision(entity, Point(dx - ox, dy - oy))
+        if p:
+            p.add('pairs', pairs)
+            p.add('contacts', contacts)
+            p.stop('collisions', t0)
@@ -0,0 +1,99 @@
+from .utils import Rect
+
+
+# EXPORT
+class SpatialHash(object):
+    def __init__(self, cell_size=32):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.directory = {}
+
+    def __len__(self):
+        return len(self.directory)
+
+    def clear(self):
+        self.cells = {}
+        self.directory = {}
+
+    def cell_range(self, rect):
+        cs = self.cell_size
+        return (int(rect.tl.x // cs), int(rect.tl.y // cs),
+                int((rect.br.x - 1) // cs), int((rect.br.y - 1) // cs))
+
+    def bulk_load(self, items):
+        self.clear()
+        for rid, rect in items:
+            self.add(rid, rect)
+
+    def add(self, rid, rect):
+        rect = Rect(rect)
+        self.remove(rid)
+        cr = self.cell_range(rect)
+        cells = self.cells
+        for cy in range(cr[1], cr[3] + 1):
+            for cx in range(cr[0], cr[2] + 1):
+                key = (cx, cy)
+                cell = cells.get(key)
+                if cell is None:
+                    cells[key] = {rid}
+                else:
+                    cell.add(rid)
+        self.directory[rid] = (rect, cr)
+
+    def move(self, rid, rect):
+        entry = self.directory.get(rid)
+        if entry is None:
+            return
+        # Fast path, the entity still covers the same cells
+        if self.cell_range(rect) == entry[1]:
+            r = entry[0]
+            r.tl.x = rect.tl.x
+            r.tl.y = rect.tl.y
+            r.br.x = rect.br.x
+            r.br.y = rect.br.y
+        else:
+            self.add(rid, rect)
+
+    def remove(self, rid):
+        entry = self.directory.get(rid)
+        if entry is None:
+            return False
+        del self.directory[rid]
+        cr = entry[1]
+        cells = self.cells
+        for cy in range(cr[1], cr[3] + 1):
+            for cx in range(cr[0], cr[2] + 1):
+                key = (cx, cy)
+                cell = cells.get(key)
+                cell.discard(rid)
+                if len(cell) == 0:
+                    del cells[key]
+        return True
+
+    def search(self, rect):
+        x0 = rect.tl.x
+        y0 = rect.tl.y
+        x1 = rect.br.x
+        y1 = rect.br.y
+        cr = self.cell_range(rect)
+        cells = self.cells
+        directory = self.directory
+        seen = set()
+        res = []
+        if (cr[2] - cr[0] + 1) * (cr[3] - cr[1] + 1) > len(cells):
+            # Sparse grid, cheaper to visit the occupied cells
+            keys = [k for k in cells if cr[0] <= k[0] <= cr[2] and cr[1] <= k[1] <= cr[3]]
+        else:
+            keys = [(cx, cy) for cy in range(cr[1], cr[3] + 1) for cx in range(cr[0], cr[2] + 1)]
+        for key in keys:
+            cell = cells.get(key)
+            if cell is None:
+                continue
+            for rid in cell:
+                if rid in seen:
+                    continue
+                seen.add(rid)
+                r = directory.get(rid)[0]
+                if r.tl.x < x1 and r.br.x > x0 and r.tl.y < y1 and r.br.y > y0:
+                    res.append((rid, r))
+        return res
@@ -1,89 +1,444 @@
 import json
 import os
 import gc
+from array import array
+
+try:
+    import hashlib
+except ImportError:
+    import uhashlib as hashlib
+try:
+    import struct
+except ImportError:
+    import ustruct as struct
+try:
+    import mmap
+except ImportError:
+    mmap = None
 
 from .app import get_screen
 from .utils import Rect
 from .bitmatrix import BitMatrix
 
+# Draw flag bits, sent to the screen as they are, see Sprite
+FLIP_H = 1
+FLIP_V = 2
+ROTATE_90 = 4
+
+
+class SpriteSlot(object):
+    # A frame's residency in the GPU sprite slots, index is -1 while not uploaded
+    def __init__(self, loader):
+        self.loader = loader
+        self.index = -1
+        self.refs = 0
+        self.stamp = 0
+
 
 class SpritesManager:
     def __init__(self):
-        self.free_indices = []
-        self.last_used = -1
         self.limit = 160
+        self.clear()
 
     def clear(self):
         self.free_indices = []
         self.last_used = -1
-
-    def allocate(self, data):
+        self.resident = [None] * self.limit
+        self.clock = 0
+        # Frame digest -> (slot, mask, flip flags), shared by identical frames of all sheets
+        self.shared = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.uploads = 0
+        self.evictions = 0
+        self.shared_frames = 0
+        self.mirrored_frames = 0
+
+    def take_free_index(self):
         if len(self.free_indices) > 0:
-            sprite_id = self.free_indices[-1]
-            del self.free_indices[-1]
-        else:
-            sprite_id = self.last_used + 1
-            if sprite_id >= self.limit:
-                return -1
-            self.last_used = sprite_id
-        get_screen().set_sprite(sprite_id, data)
-        return sprite_id
+            return self.free_indices.pop()
+        if self.last_used + 1 < self.limit:
+            self.last_used += 1
+            return self.last_used
+        return -1
+
+    def evict(self):
+        # Least recently drawn slot, draws already sent keep their pixels
+        victim = None
+        for s in self.resident:
+            if s and (victim is None or s.stamp < victim.stamp):
+                victim = s
+        if victim is None:
+            return -1
+        index = victim.index
+        victim.index = -1
+        self.resident[index] = None
+        self.evictions += 1
+        return index
+
+    def upload(self, slot, index, data=None):
+        if data is None:
+            data = slot.loader()
+        get_screen().set_sprite(index, data)
+        slot.index = index
+        self.resident[index] = slot
+        self.uploads += 1
+
+    def allocate(self, loader, data=None):
+        # Uploads right away while slots are free, otherwise on first use
+        slot = SpriteSlot(loader)
+        index = self.take_free_index()
+        if index >= 0:
+            self.upload(slot, index, data)
+        return slot
+
+    def find_shared(self, data, rows):
+        # Identical or horizontally mirrored frames reuse an already loaded slot
+        digest = hashlib.sha256(data).digest()
+        entry = self.shared.get(digest)
+        if entry:
+            self.shared_frames += 1
+            return digest, entry
+        entry = self.shared.get(hashlib.sha256(mirror_pixels(data)).digest())
+        if entry:
+            self.mirrored_frames += 1
+            mask = BitMatrix(32, 32, False)
+            mask.set_rows(rows)
+            entry = entry[0], mask, entry[2] ^ 1
+            self.shared[digest] = entry
+        return digest, entry
+
+    def add_ref(self, slot):
+        slot.refs += 1
+
+    def release(self, slot):
+        slot.refs -= 1
+        if slot.refs <= 0 and slot.index >= 0:
+            self.resident[slot.index] = None
+            self.free_indices.append(slot.index)
+            slot.index = -1
+
+    def use(self, slot):
+        self.clock += 1
+        slot.stamp = self.clock
+        if slot.index >= 0:
+            self.hits += 1
+            return slot.index
+        self.misses += 1
+        index = self.take_free_index()
+        if index < 0:
+            index = self.evict()
+        if index >= 0:
+            self.upload(slot, index)
+        return index
 
 
 sprites_manager = SpritesManager()
 
+# Extracted frames and masks are cached next to each sheet, keyed by its size and content hash
+use_sprite_cache = True
+CACHE_MAGIC = b'RSC3'
+KEY_BYTES = 4 + 32
+CACHE_SUFFIX = '.cache'
+FRAME_BYTES = 32 * 32 * 2
+MASK_BYTES = 32 * 4
+KEY_COLOR = 0x20
+
+# Frames are read from the sheet file into this buffer, one 32 row band at a time, or from the cache
+frame_buffer = bytearray(FRAME_BYTES)
+frame_view = memoryview(frame_buffer)
+mask_buffer = bytearray(MASK_BYTES)
+mask_view = memoryview(mask_buffer)
+
+
+def sheet_size(filename):
+    return struct.pack('<I', os.stat(filename)[6] & 0xFFFFFFFF)
+
+
+def sheet_key(filename):
+    # Size and SHA-256 of the sheet, read through the frame buffer
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        while True:
+            n = f.readinto(frame_buffer)
+            if not n:
+                break
+            h.update(frame_view[:n])
+    return sheet_size(filename) + h.digest()
+
+
+def mask_rows(data):
+    # One int per row, bit x set where the pixel is not the transparent key color
+    rows = []
+    for i in range(32):
+        bits = 0
+        ofs = i * 64
+        for j in range(32):
+            if data[ofs + j * 2] != KEY_COLOR or data[ofs + j * 2 + 1] != 0:
+                bits |= (1 << j)
+        rows.append(bits)
+    return rows
+
+
+def mirror_pixels(data):
+    # The frame flipped horizontally, as drawn with flags bit 0 set
+    src = array('H', bytearray(data))
+    dst = array('H')
+    for ofs in range(0, 32 * 32, 32):
+        dst.extend(reversed(src[ofs:(ofs + 32)]))
+    return bytes(dst)
+
+
+def transform_rows(rows, flags, size=32):
+    # Mask rows of a frame as drawn with the given flags, see Sprite
+    res = []
+    for y in range(size):
+        bits = 0
+        for x in range(size):
+            sx, sy = x, y
+            if flags & FLIP_V:
+                sy = size - 1 - sy
+            if flags & FLIP_H:
+                sx = size - 1 - sx
+            if flags & ROTATE_90:
+                sx, sy = sy, size - 1 - sx
+            if (rows[sy] >> sx) & 1:
+                bits |= (1 << x)
+        res.append(bits)
+    return res
+
+
+def open_mapped(filename):
+    # (map, file), the file is mapped on CPython, otherwise it stays open for seek and readinto
+    f = open(filename, 'rb')
+    if mmap:
+        try:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            f.close()
+            return m, None
+        except (OSError, ValueError):
+            pass
+    return None, f
+
+
+def read_at(m, f, ofs, view):
+    if m:
+        view[:] = m[ofs:(ofs + len(view))]
+    else:
+        f.seek(ofs)
+        f.readinto(view)
+
+
+def write_sprite_cache(filename, sheet, keys, get_frame):
+    # Layout: magic, sheet size and hash, count, (x, y) per frame, all pixels, then all masks.
+    # Frames are fetched one at a time, twice, so none has to stay in memory.
+    with open(filename, 'wb') as f:
+        f.write(CACHE_MAGIC)
+        f.write(sheet)
+        f.write(struct.pack('<H', len(keys)))
+        for key in keys:
+            f.write(struct.pack('<HH', key[0], key[1]))
+        for key in keys:
+            f.write(get_frame(key)[0])
+        for key in keys:
+            f.write(struct.pack('<32I', *get_frame(key)[1]))
+
 
 class SpriteSheet:
     def __init__(self, filename=''):
         self.width = 0
         self.height = 0
-        self.data = None
+        self.file = None
+        self.map = None
         self.sprites = {}
         self.rect = None
+        self.filename = ''
+        self.key = None
+        self.cache_checked = False
+        self.frames = {}
+        self.cache_map = None
+        self.cache_file = None
+        self.cache_index = {}
+        self.cache_pixels = 0
+        self.cache_masks = 0
+        self.cache_dirty = False
         if filename:
             self.load(filename)
 
-
     def clean(self):
-        self.data = None
-        gc.collect()
+        if self.cache_dirty:
+            self.save_cache()
+        self.key = None
+        self.cache_checked = False
+        if self.file or self.map or self.frames or self.cache_index:
+            self.close_source()
+            self.close_cache()
+            self.frames = {}
+            gc.collect()
 
     def load(self, filename):
         try:
             gc.collect()
             print("Loading "+filename)
-            print("Free Mem: "+str(gc.mem_free()))
+            if hasattr(gc, 'mem_free'):
+                print("Free Mem: "+str(gc.mem_free()))
             with open(filename, 'rb') as f:
                 data = f.read(4)
                 self.width = (int(data[1]) << 8) | int(data[0])
                 self.height = (int(data[3]) << 8) | int(data[2])
                 data = None
-                self.data = f.read()
+                self.filename = filename
+                self.key = None
                 self.rect = Rect(0, 0, self.width, self.height)
-                return True
+            self.load_cache()
+            return True
         except OSError:
             return False
 
+    def load_cache(self):
+        # Only the header and the frame table are read, each frame is read from the file when asked for
+        self.close_cache()
+        self.frames = {}
+        self.cache_dirty = False
+        self.cache_checked = True
+        if not use_sprite_cache:
+            return False
+        try:
+            m, f = open_mapped(self.filename + CACHE_SUFFIX)
+        except OSError:
+            return False
+        self.cache_map = m
+        self.cache_file = f
+        size = len(m) if m else f.seek(0, 2)
+        header = len(CACHE_MAGIC) + KEY_BYTES
+        if size < header + 2:
+            self.close_cache()
+            return False
+        head = bytearray(header + 2)
+        read_at(m, f, 0, memoryview(head))
+        n = struct.unpack_from('<H', head, header)[0]
+        pixels = header + 2 + n * 4
+        masks = pixels + n * FRAME_BYTES
+        # A different size rejects the cache at once, otherwise the sheet is hashed, mtimes are not trusted
+        if head[:len(CACHE_MAGIC)] != CACHE_MAGIC or size != masks + n * MASK_BYTES or \
+                head[len(CACHE_MAGIC):(len(CACHE_MAGIC) + 4)] != sheet_size(self.filename) or \
+                head[len(CACHE_MAGIC):header] != self.sheet_key():
+            self.close_cache()
+            return False
+        table = bytearray(n * 4)
+        read_at(m, f, header + 2, memoryview(table))
+        keys = struct.unpack('<' + str(n * 2) + 'H', table)
+        for i in range(n):
+            self.cache_index[(keys[i * 2], keys[i * 2 + 1])] = i
+        self.cache_pixels = pixels
+        self.cache_masks = masks
+        return True
+
+    def sheet_key(self):
+        # Hashed once per load of the sheet, for checking its cache and writing a new one
+        if not self.key:
+            self.key = sheet_key(self.filename)
+        return self.key
+
+    def close_cache(self):
+        if self.cache_map:
+            self.cache_map.close()
+            self.cache_map = None
+        if self.cache_file:
+            self.cache_file.close()
+            self.cache_file = None
+        self.cache_index = {}
+
+    def read_cached(self, i):
+        read_at(self.cache_map, self.cache_file, self.cache_pixels + i * FRAME_BYTES, frame_view)
+        read_at(self.cache_map, self.cache_file, self.cache_masks + i * MASK_BYTES, mask_view)
+        return bytes(frame_buffer), struct.unpack('<32I', mask_buffer)
+
+    def cached_frame(self, key):
+        frame = self.frames.get(key)
+        return frame if frame else self.read_cached(self.cache_index.get(key))
+
+    def save_cache(self):
+        # The frames already cached are copied from the old file into a new one, which then replaces it
+        keys = sorted(set(list(self.cache_index.keys()) + list(self.frames.keys())))
+        filename = self.filename + CACHE_SUFFIX
+        try:
+            write_sprite_cache(filename + '.tmp', self.sheet_key(), keys, self.cached_frame)
+            self.close_cache()
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+            os.rename(filename + '.tmp', filename)
+            self.frames = {}
+            self.cache_dirty = False
+            self.load_cache()
+        except OSError:
+            print("Failed to write sprite cache for " + self.filename)
+        return len(keys)
+
+    def open_source(self):
+        # The sheet stays on disk, mapped on CPython, otherwise read a frame at a time
+        self.map, self.file = open_mapped(self.filename)
+
+    def close_source(self):
+        if self.map:
+            self.map.close()
+            self.map = None
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def read_pixels(self, x, y):
+        if not self.file and not self.map:
+            self.open_source()
+        src = 4 + (y * self.width + x) * 2
+        stride = self.width * 2
+        for i in range(32):
+            read_at(self.map, self.file, src, frame_view[(i * 64):(i * 64 + 64)])
+            src = src + stride
+        return bytes(frame_buffer)
+
+    def extract_frame(self, x, y):
+        data = self.read_pixels(x, y)
+        return data, mask_rows(data)
+
+    def get_frame(self, rect):
+        # Pixels and mask rows of a 32x32 frame, from the cache when possible
+        key = (rect.tl.x, rect.tl.y)
+        frame = self.frames.get(key)
+        if frame:
+            return frame
+        if not self.cache_checked and use_sprite_cache:
+            self.load_cache()
+        if key in self.cache_index:
+            return self.read_cached(self.cache_index.get(key))
+        frame = self.extract_frame(rect.tl.x, rect.tl.y)
+        if use_sprite_cache:
+            # Kept until written out, see save_cache
+            self.frames[key] = frame
+            self.cache_dirty = True
+        return frame
+
     def get_sprite_data(self, rect):
         if rect in self.sprites:
             return self.sprites.get(rect)
         if rect.valid() and self.rect.contains(rect) and rect.width() == 32 and rect.height() == 32:
-            data = bytearray(32 * 32 * 2)
-            src = (rect.tl.y * self.width + rect.tl.x) * 2
-            dst = 0
-            mask = BitMatrix(32, 32)
-            mask.setall(True)
-            for i in range(32):
-                data[dst:(dst + 64)] = self.data[src:(src + 64)]
-                for j in range(32):
-                    if data[dst + j * 2] == 0x20 and data[dst + j * 2 + 1] == 0:
-                        mask.set(j, i, False)
-                dst = dst + 64
-                src = src + self.width * 2
-            sprite_data = sprites_manager.allocate(bytes(data)), mask
+            data, rows = self.get_frame(rect)
+            digest, sprite_data = sprites_manager.find_shared(data, rows)
+            if not sprite_data:
+                mask = BitMatrix(32, 32, False)
+                mask.set_rows(rows)
+                x, y = rect.tl.x, rect.tl.y
+                # An evicted frame is read back from the sheet, without the cache or the mask
+                sprite_data = sprites_manager.allocate(lambda: self.read_pixels(x, y), data), mask, 0
+                sprites_manager.shared[digest] = sprite_data
             self.sprites[rect] = sprite_data
         else:
-            sprite_data = -1, None
+            sprite_data = -1, None, 0
         return sprite_data
 
 
@@ -100,29 +455,83 @@ def get_sprite_sheet(filename):
 
 # EXPORT
 class Sprite(object):
+    # Draw flags, the frame is rotated clockwise first and then flipped.
+    # Backends keep a transformed copy of each slot, so no sheet needs mirrored frames.
+    FLIP_H = FLIP_H
+    FLIP_V = FLIP_V
+    ROTATE_90 = ROTATE_90
+    ROTATE_180 = 3
+    ROTATE_270 = 7
+    FLAG_NAMES = {'FlipH': 1, 'FlipV': 2, 'Rotate90': 4, 'Rotate180': 3, 'Rotate270': 7}
+
     def __init__(self, sprite_id, mask, duration=0.0, flags=0):
+        # sprite_id is either a fixed slot index or a SpriteSlot owned through sprites_manager
+        self.slot = None
+        self.owned = False
+        if isinstance(sprite_id, SpriteSlot):
+            self.slot = sprite_id
+            sprite_id = -1
+            self.acquire()
         self.sprite_id = sprite_id
         self.mask = mask
         self.duration = duration
         self.flags = flags
 
+    def acquire(self):
+        if self.slot and not self.owned:
+            sprites_manager.add_ref(self.slot)
+            self.owned = True
+
+    def release(self):
+        if self.owned:
+            sprites_manager.release(self.slot)
+            self.owned = False
+
     def draw(self, position):
-        get_screen().draw_sprite(position.x, position.y, self.sprite_id, self.flags)
+        sprite_id = self.sprite_id
+        if self.slot:
+            self.acquire()
+            sprite_id = sprites_manager.use(self.slot)
+        get_screen().draw_sprite(position.x, position.y, sprite_id, self.flags)
 
     @staticmethod
     def get_rect():
         return Rect(0, 0, 32, 32)
 
+    @staticmethod
+    def parse_flags(flags):
+        # Either a number or names joined by '|', like "FlipH|Rotate90"
+        if isinstance(flags, str):
+            value = 0
+            for name in flags.split('|'):
+                name = name.strip()
+                if name:
+                    value ^= Sprite.FLAG_NAMES[name]
+            return value
+        return int(flags)
+
+    @staticmethod
+    def mirror_flags(flags):
+        # Flags drawing a horizontally mirrored slot the same as the original with flags
+        return flags ^ (Sprite.FLIP_V if flags & Sprite.ROTATE_90 else Sprite.FLIP_H)
+
     @staticmethod
     def deserialize(filename, obj):
         r = [int(a) for a in obj['Rect'].strip().split(',')]
         dur = obj['Duration']
         flags = 0
         if 'Flags' in obj:
-            flags = obj['Flags']
+            flags = Sprite.parse_flags(obj['Flags'])
         rect = Rect(r[0], r[1], r[2], r[3])
         sheet = get_sprite_sheet(filename)
-        sprite_id, mask = sheet.get_sprite_data(rect)
+        sprite_id, mask, mirrored = sheet.get_sprite_data(rect)
+        if flags and mask:
+            # The mask follows the frame as drawn
+            rows = mask.rows
+            mask = BitMatrix(32, 32, False)
+            mask.set_rows(transform_rows(rows, flags))
+        if mirrored:
+            flags = Sprite.mirror_flags(flags)
         return Sprite(sprite_id, mask, dur, flags)
 
 
@@ -141,6 +550,10 @@ class AnimationSequence(object):
         for frame in seq['Frames']:
             self.add_sprite(Sprite.deserialize(filename, frame))
 
+    def release(self):
+        for sprite in self.sprites:
+            sprite.release()
+
     def __getitem__(self, index):
         return self.sprites[index]
 
@@ -165,6 +578,10 @@ class StaticSprite:
         if self.sprite:
             self.sprite.draw(pos)
 
+    def release(self):
+        # The sprite is shared and owned by whoever loaded it
+        pass
+
 
 # EXPORT
 class AnimatedSprite(object):
@@ -213,6 +630,10 @@ class AnimatedSprite(object):
             self.dt = 0.0
             self.cur_sprite = 0
 
+    def release(self):
+        for name in self.sequences:
+            self.sequences.get(name).release()
+
     def add_sequence(self, seq):
         self.sequences[seq.name] = seq
         if not self.active_sequence:
@@ -312,5 +733,209 @@ def load_str(s):
     return load_json_str(s)
 
 
+def build_sprite_cache(filename):
+    # Extracts every frame referenced by an animation file and writes its sheet cache
+    obj = json.load(open(filename, "r"))
+    sheet = SpriteSheet()
+    sheet.load(obj['Image'])
+    for seq in obj['Sequences']:
+        for frame in seq['Frames']:
+            r = [int(a) for a in frame['Rect'].strip().split(',')]
+            rect = Rect(r[0], r[1], r[2], r[3])
+            if rect.valid() and sheet.rect.contains(rect) and rect.width() == 32 and rect.height() == 32:
+                sheet.get_frame(rect)
+    count = sheet.save_cache()
+    sheet.clean()
+    return count
+
+
+def benchmark_startup(filenames):
+    # Loads a set of animation files with and without sheet caches, on a headless screen
+    import time
+    from . import app
+    from gpu.screen import Screen, NullUART
+    global use_sprite_cache
+    saved = app.app_screen, use_sprite_cache, gc.collect
+    app.app_screen = Screen(NullUART())
+    results = {}
+    gc_time = [0.0]
+
+    def timed_collect():
+        # A full collection costs far more on a desktop heap than on the board, so it is reported apart
+        t = time.perf_counter()
+        saved[2]()
+        gc_time[0] += time.perf_counter() - t
+
+    gc.collect = timed_collect
+    try:
+        for name in ('no_cache', 'build', 'cached'):
+            use_sprite_cache = name != 'no_cache'
+            if name == 'build':
+                for filename in filenames:
+                    sheet = json.load(open(filename, "r"))['Image']
+                    if os.path.exists(sheet + CACHE_SUFFIX):
+                        os.remove(sheet + CACHE_SUFFIX)
+            sprite_sheets.clear()
+            sprites_manager.clear()
+            gc_time[0] = 0.0
+            start = time.perf_counter()
+            for filename in filenames:
+                AnimatedSprite().load(filename)
+            total = time.perf_counter() - start
+            results[name] = total - gc_time[0], total
+        for name in results:
+            print(name + ": " + str(round(results[name][0] * 1000, 1)) + " ms, " +
+                  str(round(results[name][1] * 1000, 1)) + " ms including gc.collect")
+    finally:
+        app.app_screen, use_sprite_cache, gc.collect = saved
+        sprite_sheets.clear()
+        sprites_manager.clear()
+    return results
+
+
+def benchmark_dedup(filenames):
+    # Slots and upload bytes saved by sharing identical and mirrored frames
+    from . import app
+    from gpu.screen import Screen, NullUART
+    saved = app.app_screen
+    app.app_screen = Screen(NullUART())
+    sprite_sheets.clear()
+    sprites_manager.clear()
+    try:
+        for filename in filenames:
+            AnimatedSprite().load(filename)
+        m = sprites_manager
+        frames = sum([len(sprite_sheets.get(name).sprites) for name in sprite_sheets])
+        slots = m.last_used + 1
+        print(str(frames) + " frames in " + str(slots) + " slots: " + str(m.shared_frames) + " identical, " +
+              str(m.mirrored_frames) + " mirrored, " + str((frames - slots) * FRAME_BYTES) + " upload bytes saved")
+    finally:
+        app.app_screen = saved
+        sprite_sheets.clear()
+        sprites_manager.clear()
+    return frames, slots
+
+
+def benchmark_memory(filenames, cache=None):
+    # Peak traced heap while loading a set of animation files, with or without sheet caches.
+    # By default use_sprite_cache is left as it is, build the caches first to measure the cached path.
+    import tracemalloc
+    from . import app
+    from gpu.screen import Screen, NullUART
+    global use_sprite_cache
+    saved = app.app_screen, use_sprite_cache
+    app.app_screen = Screen(NullUART())
+    if cache is not None:
+        use_sprite_cache = cache
+    sprite_sheets.clear()
+    sprites_manager.clear()
+    tracemalloc.start()
+    try:
+        for filename in filenames:
+            AnimatedSprite().load(filename)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        app.app_screen, use_sprite_cache = saved
+        sprite_sheets.clear()
+        sprites_manager.clear()
+    print("Peak heap: " + str(peak // 1024) + " KB")
+    return peak
+
+
+def stress_test(animations=20, frames_per_animation=12, steps=90):
+    # Animates more unique frames than there are slots and checks every draw shows its own pixels
+    from . import app
+    from .utils import Point
+
+    class SlotScreen(object):
+        def __init__(self):
+            self.slots = {}
+            self.drawn = -1
+
+        def set_sprite(self, index, pixels):
+            self.slots[index] = bytes(pixels)
+
+        def draw_sprite(self, x, y, index, flags):
+            self.drawn = index
+
+    def frame_pixels(i):
+        return bytes([i & 255, i >> 8]) * (FRAME_BYTES // 2)
+
+    saved = app.app_screen
+    scr = SlotScreen()
+    app.app_screen = scr
+    sprites_manager.clear()
+    ok = True
+    try:
+        anims = []
+        for a in range(animations):
+            anim = AnimatedSprite()
+            seq = AnimationSequence('Loop', 0.0)
+            for f in range(frames_per_animation):
+                i = a * frames_per_animation + f
+                slot = sprites_manager.allocate(lambda i=i: frame_pixels(i))
+                sprite = Sprite(slot, None, 1.0 / 30)
+                sprite.pixels = i
+                seq.add_sprite(sprite)
+            anim.add_sequence(seq)
+            anims.append(anim)
+        for step in range(steps):
+            for anim in anims:
+                anim.advance(1.0 / 30, Point(0, 0))
+                spr = anim.get_current_sprite()
+                spr.draw(Point(0, 0))
+                if scr.drawn < 0 or scr.slots.get(scr.drawn) != frame_pixels(spr.pixels):
+                    print("Wrong pixels for frame " + str(spr.pixels) + " at step " + str(step))
+                    ok = False
+        m = sprites_manager
+        print(str(animations * frames_per_animation) + " unique frames, " + str(m.limit) + " slots: " +
+              str(m.hits) + " hits, " + str(m.misses) + " misses, " + str(m.uploads) + " uploads, " +
+              str(m.evictions) + " evictions")
+        for anim in anims:
+            anim.release()
+        if len(m.free_indices) != m.last_used + 1 or any(m.resident):
+            print("Slots not freed after release")
+            ok = False
+    finally:
+        app.app_screen = saved
+        sprites_manager.clear()
+    if ok:
+        print("All tests successful")
+    return ok
+
+
+def cache_test():
+    # A sheet edited in place, same size and modification time, must not be served from its old cache
+    import tempfile
+    filename = os.path.join(tempfile.mkdtemp(), 'sheet.raw16')
+    frame = Rect(0, 0, 32, 32)
+    ok = True
+    try:
+        for color in (0x1234, 0x4321):
+            with open(filename, 'wb') as f:
+                f.write(struct.pack('<HH', 32, 32) + struct.pack('<H', color) * (32 * 32))
+            if color == 0x1234:
+                st = os.stat(filename)
+            else:
+                os.utime(filename, (st[7], st[8]))
+            sheet = SpriteSheet(filename)
+            if sheet.get_frame(frame)[0][:2] != struct.pack('<H', color):
+                print("Stale frame from the cache of an edited sheet")
+                ok = False
+            sheet.save_cache()
+            if not sheet.cache_index or sheet.get_frame(frame)[0][:2] != struct.pack('<H', color):
+                print("Frame not read back from the cache")
+                ok = False
+            sheet.clean()
+    finally:
+        for name in (filename, filename + CACHE_SUFFIX):
+            if os.path.exists(name):
+                os.remove(name)
+    if ok:
+        print("All tests successful")
+    return ok
+
+
 if __name__ == '__main__':
     print(os.getcwd())
@@ -0,0 +1,231 @@
+from array import array
+
+from .utils import Point, Rect
+
+
+class Tile(object):
+    # Passed as the other party of a collision with a tile, tiles never react to it
+    def __init__(self, layer, col, row):
+        self.layer = layer
+        self.col = col
+        self.row = row
+        self.sprite = layer.get_tile(col, row)
+
+    @property
+    def is_dynamic(self):
+        return False
+
+    def get_position(self):
+        return self.layer.tile_position(self.col, self.row)
+
+    def get_rect(self):
+        return self.layer.tile_rect(self.col, self.row)
+
+    def collision(self, other, col_point):
+        pass
+
+
+# EXPORT
+class TileMap(object):
+    # A grid of sprites drawn behind the scene's entities.
+    # Each cell holds an index into the palette of distinct (sprite, solid) pairs, or -1 when empty.
+    def __init__(self, columns, rows, tile_size=32, origin=None):
+        self.columns = columns
+        self.rows = rows
+        self.tile_size = tile_size
+        self.origin = Point(origin) if origin else Point(0, 0)
+        self.tiles = array('h', [-1] * (columns * rows))
+        self.sprites = []
+        self.solid = bytearray()
+        self.palette = {}
+        self.version = 0
+
+    def add_sprite(self, sprite, solid=True):
+        key = (id(sprite), solid)
+        index = self.palette.get(key)
+        if index is None:
+            index = len(self.sprites)
+            self.sprites.append(sprite)
+            self.solid.append(1 if solid else 0)
+            self.palette[key] = index
+        return index
+
+    def set_tile(self, col, row, sprite, solid=True):
+        # Solid tiles collide with entities through their sprite's mask, a None sprite clears the cell
+        if 0 <= col < self.columns and 0 <= row < self.rows:
+            self.tiles[row * self.columns + col] = self.add_sprite(sprite, solid) if sprite else -1
+            self.version += 1
+
+    def get_tile(self, col, row):
+        if 0 <= col < self.columns and 0 <= row < self.rows:
+            index = self.tiles[row * self.columns + col]
+            if index >= 0:
+                return self.sprites[index]
+        return None
+
+    def is_solid(self, col, row):
+        if 0 <= col < self.columns and 0 <= row < self.rows:
+            index = self.tiles[row * self.columns + col]
+            return index >= 0 and self.solid[index] == 1
+        return False
+
+    def cell_at(self, pos):
+        ts = self.tile_size
+        return int((pos.x - self.origin.x) // ts), int((pos.y - self.origin.y) // ts)
+
+    def tile_position(self, col, row):
+        ts = self.tile_size
+        return Point(self.origin.x + col * ts, self.origin.y + row * ts)
+
+    def tile_rect(self, col, row):
+        p = self.tile_position(col, row)
+        return Rect(p.x, p.y, p.x + self.tile_size, p.y + self.tile_size)
+
+    def get_rect(self):
+        o = self.origin
+        return Rect(o.x, o.y, o.x + self.columns * self.tile_size, o.y + self.rows * self.tile_size)
+
+    def cell_range(self, rect):
+        # Cells overlapping rect, clipped to the map, as col0, row0, col1, row1 inclusive
+        ts = self.tile_size
+        ox = self.origin.x
+        oy = self.origin.y
+        return (max(int((rect.tl.x - ox) // ts), 0), max(int((rect.tl.y - oy) // ts), 0),
+                min(int((rect.br.x - ox - 1) // ts), self.columns - 1),
+                min(int((rect.br.y - oy - 1) // ts), self.rows - 1))
+
+    def tiles_in(self, rect):
+        # (col, row) of the occupied cells overlapping rect
+        c0, r0, c1, r1 = self.cell_range(rect)
+        tiles = self.tiles
+        res = []
+        for row in range(r0, r1 + 1):
+            base = row * self.columns
+            for col in range(c0, c1 + 1):
+                if tiles[base + col] >= 0:
+                    res.append((col, row))
+        return res
+
+    def snap(self, rect):
+        # rect grown to whole cells, so redrawing the tiles it touches stays inside it
+        ts = self.tile_size
+        ox = self.origin.x
+        oy = self.origin.y
+        x0 = ox + ((rect.tl.x - ox) // ts) * ts
+        y0 = oy + ((rect.tl.y - oy) // ts) * ts
+        x1 = ox - ((ox - rect.br.x) // ts) * ts
+        y1 = oy - ((oy - rect.br.y) // ts) * ts
+        return Rect(x0, y0, x1, y1)
+
+    def draw_tile(self, view, col, row):
+        index = self.tiles[row * self.columns + col]
+        if index >= 0:
+            ts = self.tile_size
+            tl = view.rect.tl
+            self.sprites[index].draw(Point(self.origin.x + col * ts - tl.x, self.origin.y + row * ts - tl.y))
+
+    def draw(self, view, rect=None):
+        # Only the cells inside the view, or rect within it, are visited, returns the number of tiles drawn
+        c0, r0, c1, r1 = self.cell_range(rect if rect else view.rect)
+        tiles = self.tiles
+        sprites = self.sprites
+        ts = self.tile_size
+        x0 = self.origin.x - view.rect.tl.x
+        y = self.origin.y - view.rect.tl.y + r0 * ts
+        count = 0
+        for row in range(r0, r1 + 1):
+            base = row * self.columns
+            for col in range(c0, c1 + 1):
+                index = tiles[base + col]
+                if index >= 0:
+                    sprites[index].draw(Point(x0 + col * ts, y))
+                    count += 1
+            y += ts
+        return count
+
+    def collide(self, entity, mask, rect):
+        # Tests the entity's mask against the solid tiles under rect, returns (pairs, contacts)
+        pos = entity.get_position()
+        c0, r0, c1, r1 = self.cell_range(rect)
+        tiles = self.tiles
+        ts = self.tile_size
+        pairs = 0
+        contacts = 0
+        for row in range(r0, r1 + 1):
+            base = row * self.columns
+            for col in range(c0, c1 + 1):
+                index = tiles[base + col]
+                if index < 0 or not self.solid[index]:
+                    continue
+                tile_mask = self.sprites[index].mask
+                if not tile_mask:
+                    continue
+                ox = int(self.origin.x + col * ts - pos.x)
+                oy = int(self.origin.y + row * ts - pos.y)
+                pairs += 1
+                pt = mask.overlap(tile_mask, Point(ox, oy))
+                if pt:
+                    contacts += 1
+                    entity.collision(Tile(self, col, row), Point(pt.x, pt.y))
+        return pairs, contacts
+
+    def release(self):
+        for sprite in self.sprites:
+            sprite.release()
+
+
+def unit_test():
+    from .bitmatrix import BitMatrix
+
+    def full_mask():
+        mask = BitMatrix(32, 32)
+        mask.setall(True)
+        return mask
+
+    class Block(object):
+        def __init__(self):
+            self.mask = full_mask()
+            self.drawn = []
+
+        def draw(self, position):
+            self.drawn.append((position.x, position.y))
+
+        def release(self):
+            pass
+
+    class Body(object):
+        def __init__(self, x, y):
+            self.pos = Point(x, y)
+            self.hits = []
+
+        def get_position(self):
+            return self.pos
+
+        def collision(self, other, col_point):
+            self.hits.append((other.col, other.row, col_point.x, col_point.y))
+
+    class FakeView(object):
+        def __init__(self, x, y):
+            self.rect = Rect(x, y, x + 640, y + 480)
+
+    block = Block()
+    m = TileMap(100, 15, origin=Point(-64, 0))
+    for col in range(100):
+        m.set_tile(col, 14, block)
+    m.set_tile(10, 5, block, False)
+    ok = len(m.sprites) == 2 and m.is_solid(3, 14) and not m.is_solid(10, 5) and not m.get_tile(3, 3)
+    count = m.draw(FakeView(1000, 0))
+    ok = ok and count == 21 and block.drawn[0] == (-8, 448)
+    body = Body(100.5, 430)
+    pairs, contacts = m.collide(body, full_mask(), Rect(100, 430, 132, 462))
+    ok = ok and pairs == 2 and contacts == 2 and body.hits[0] == (5, 14, 0, 18)
+    body = Body(320, 160)
+    ok = ok and m.collide(body, full_mask(), Rect(320, 160, 352, 192)) == (0, 0)
+    s = m.snap(Rect(-60, 5, 10, 40))
+    ok = ok and (s.tl.x, s.tl.y, s.br.x, s.br.y) == (-64, 0, 32, 64)
+    print("All tests successful" if ok else "TileMap test failed")
+    return ok
+
+
+if __name__ == '__main__':
+    unit_test()
@@ -9,19 +9,20 @@ def rgb(r, g, b):
 
 # EXPORT
 class Point(object):
-    def __init__(self, *args):
-        if len(args) == 2:
-            self.x = args[0]
-            self.y = args[1]
-        elif len(args) == 1:
-            if isinstance(args[0], Point):
-                self.x = args[0].x
-                self.y = args[0].y
-            elif isinstance(args[0], tuple):
-                self.x = args[0][0]
-                self.y = args[0][1]
-            else:
-                raise TypeError()
+    __slots__ = ('x', 'y')
+
+    def __init__(self, x, y=None):
+        if y is not None:
+            self.x = x
+            self.y = y
+        elif isinstance(x, Point):
+            self.x = x.x
+            self.y = x.y
+        elif isinstance(x, tuple):
+            self.x = x[0]
+            self.y = x[1]
+        else:
+            raise TypeError()
 
     def as_tuple(self):
         return self.x, self.y
@@ -88,6 +89,16 @@ class Point(object):
     def scaled(self, s):
         return Point(self.x * s, self.y * s)
 
+    def add_to(self, dx, dy):
+        self.x += dx
+        self.y += dy
+        return self
+
+    def scale_inplace(self, s):
+        self.x *= s
+        self.y *= s
+        return self
+
     def length(self):
         return math.sqrt(self.x * self.x + self.y * self.y)
 
@@ -110,16 +121,18 @@ def vector2(*args):
 
 # EXPORT
 class Rect(object):
-    def __init__(self, *args):
-        if len(args) == 2 and isinstance(args[0], Point) and isinstance(args[1], Point):
-            self.tl = Point(args[0])
-            self.br = Point(args[1])
-        elif len(args) == 4:
-            self.tl = Point(args[0], args[1])
-            self.br = Point(args[2], args[3])
-        elif len(args) == 1 and isinstance(args[0], Rect):
-            self.tl = Point(args[0].tl)
-            self.br = Point(args[0].br)
+    __slots__ = ('tl', 'br')
+
+    def __init__(self, a=None, b=None, c=None, d=None):
+        if d is not None:
+            self.tl = Point(a, b)
+            self.br = Point(c, d)
+        elif isinstance(a, Rect):
+            self.tl = Point(a.tl.x, a.tl.y)
+            self.br = Point(a.br.x, a.br.y)
+        elif isinstance(a, Point) and isinstance(b, Point):
+            self.tl = Point(a.x, a.y)
+            self.br = Point(b.x, b.y)
         else:
             self.tl = Point(0, 0)
             self.br = Point(0, 0)
@@ -166,6 +179,15 @@ class Rect(object):
         self.br = self.br + offset
         return self
 
+    def move_inplace(self, dx, dy):
+        tl = self.tl
+        br = self.br
+        tl.x += dx
+        tl.y += dy
+        br.x += dx
+        br.y += dy
+        return self
+
     def inflate(self, d):
         if isinstance(d, Point):
             self.tl -= d
@@ -193,16 +215,29 @@ class Rect(object):
                     min(self.br.y, r.br.y))
 
     def overlaps(self, r):
-        intr = self.intersection(r)
-        return intr.br.x > intr.tl.x and intr.br.y > intr.tl.y
+        # Same as intersection(r).valid(), without building the intersection
+        a = self.tl
+        b = self.br
+        c = r.tl
+        d = r.br
+        return (a.x < d.x and c.x < b.x and a.x < b.x and c.x < d.x and
+                a.y < d.y and c.y < b.y and a.y < b.y and c.y < d.y)
 
     def contains(self, r):
-        return r.tl.x >= self.tl.x and r.tl.y >= self.tl.y and r.br.x <= self.br.x and r.br.y <= self.br.y
+        a = self.tl
+        b = self.br
+        c = r.tl
+        d = r.br
+        return c.x >= a.x and c.y >= a.y and d.x <= b.x and d.y <= b.y
 
     def is_point_inside(self, p):
-        if not isinstance(p, Point):
-            p = Point(p)
-        return self.br.x > p.x >= self.tl.x and self.br.y > p.y >= self.tl.y
+        if isinstance(p, Point):
+            x = p.x
+            y = p.y
+        else:
+            x = p[0]
+            y = p[1]
+        return self.br.x > x >= self.tl.x and self.br.y > y >= self.tl.y
 
     def __eq__(self, r):
         if not isinstance(r, Rect):
@@ -264,3 +299,46 @@ def parse_color(s):
 def all_pixels(s):
     pass
     # return itertools.product(range(s.width()), range(s.height()))
+
+
+def benchmark_allocations(n=200, frames=30):
+    # Counts Point and Rect constructions per simulated frame of a headless scene
+    from random import randint, seed
+    from .entity import Entity
+    from .scene import Scene
+    from .sprite import AnimatedSprite
+    from .view import View
+    seed(1)
+    scene = Scene()
+    view = View(Rect(0, 0, 640, 480))
+    for i in range(n):
+        e = Entity(AnimatedSprite())
+        e.set_position(randint(0, 1280), randint(0, 960))
+        e.set_velocity(randint(-50, 50), randint(-50, 50))
+        scene.add(e)
+    counts = {'Point': 0, 'Rect': 0}
+    point_init = Point.__init__
+    rect_init = Rect.__init__
+
+    def counting_point(self, *args):
+        counts['Point'] += 1
+        point_init(self, *args)
+
+    def counting_rect(self, *args):
+        counts['Rect'] += 1
+        rect_init(self, *args)
+
+    Point.__init__ = counting_point
+    Rect.__init__ = counting_rect
+    try:
+        for _ in range(frames):
+            scene.advance(1.0 / 30)
+            scene.draw(view)
+            for eid in scene.dynamics:
+                view.get_rect().overlaps(scene.entities.get(eid).get_rect())
+    finally:
+        Point.__init__ = point_init
+        Rect.__init__ = rect_init
+    print("Per frame, " + str(n) + " entities: " + str(counts['Point'] // frames) + " Points, " +
+          str(counts['Rect'] // frames) + " Rects")
+    return counts
@@ -1,9 +1,11 @@
-from .utils import Rect
+from .utils import Point, Rect
 
 
 # EXPORT
 class View(object):
     def __init__(self, rect=None):
+        # Fraction of a fixed step since the last one, dynamic entities are drawn interpolated
+        self.alpha = 1.0
         if rect:
             self.rect = rect
         else:
@@ -21,7 +23,8 @@ class View(object):
         self.rect = Rect(pos.x, pos.y, pos.x + self.rect.width(), pos.y + self.rect.height())
 
     def relative_position(self, pos):
-        return pos - self.rect.tl
+        tl = self.rect.tl
+        return Point(pos.x - tl.x, pos.y - tl.y)
 
     def get_rect(self):
         return Rect(self.rect)
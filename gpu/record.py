@@ -0,0 +1,262 @@
+from .screen import *
+
+# Payload size of each command after its opcode, variable length ones are handled apart
+ARG_BYTES = {
+    CMD_NOP: 0, CMD_CLS: 0, CMD_FLIP: 1, CMD_TEXT_NEWLINE: 0, CMD_PIXEL_CURSOR: 4, CMD_TEXT_CURSOR: 2,
+    CMD_FG_COLOR: 2, CMD_BG_COLOR: 2, CMD_PUSH_CURSOR: 0, CMD_POP_CURSOR: 0, CMD_BLINK_CURSOR: 1,
+    CMD_FILL_RECT: 4, CMD_HORZ_LINE: 2, CMD_VERT_LINE: 2, CMD_DRAW_SPRITE: 3, CMD_TRANSPARENT_COLOR: 3
+}
+
+CMD_NAMES = {
+    CMD_NOP: 'nop', CMD_CLS: 'cls', CMD_FLIP: 'flip', CMD_TEXT_NEWLINE: 'text_newline',
+    CMD_PIXEL_CURSOR: 'pixel_cursor', CMD_TEXT_CURSOR: 'text_cursor', CMD_FG_COLOR: 'fg_color',
+    CMD_BG_COLOR: 'bg_color', CMD_PUSH_CURSOR: 'push_cursor', CMD_POP_CURSOR: 'pop_cursor',
+    CMD_BLINK_CURSOR: 'blink', CMD_FILL_RECT: 'fill_rect', CMD_HORZ_LINE: 'horz_line', CMD_VERT_LINE: 'vert_line',
+    CMD_HORZ_PIXELS: 'horz_pixels', CMD_TEXT: 'text', CMD_SET_SPRITE: 'set_sprite', CMD_DRAW_SPRITE: 'draw_sprite',
+    CMD_TRANSPARENT_COLOR: 'transparent_color'
+}
+
+# Commands the screen methods precede with their own pixel cursor
+POSITIONED = (CMD_FILL_RECT, CMD_HORZ_LINE, CMD_VERT_LINE, CMD_DRAW_SPRITE)
+
+# Screen methods that issue display commands, everything else goes to the wrapped screen only
+COMMANDS = ('cls', 'flip', 'text_newline', 'pixel_cursor', 'text_cursor', 'fg_color', 'bg_color', 'text',
+            'println', 'push_cursor', 'pop_cursor', 'blink', 'fill_rect', 'horz_line', 'vert_line', 'horz_pixels',
+            'set_sprite', 'draw_sprite', 'set_transparent_color')
+
+
+class FileUART:
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, data):
+        return self.f.write(data)
+
+    @staticmethod
+    def read(n=-1):
+        return None
+
+
+class Recorder(object):
+    # Wraps a screen of either backend, every command is passed on and also
+    # encoded into the log exactly as gpu.screen sends it over the UART.
+    # Without a log file the stream is kept in memory, see data().
+    def __init__(self, target, log=None):
+        sink = FileUART(log) if log else LoopbackUART()
+        object.__setattr__(self, 'target', target)
+        object.__setattr__(self, 'sink', sink)
+        object.__setattr__(self, 'encoder', Screen(sink))
+
+    def __getattr__(self, name):
+        if name in COMMANDS:
+            method = getattr(self.target, name)
+            encode = getattr(self.encoder, name)
+
+            def command(*args):
+                encode(*args)
+                return method(*args)
+            return command
+        return getattr(self.target, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.target, name, value)
+
+    def close(self):
+        self.encoder.flush()
+
+    def data(self):
+        self.encoder.flush()
+        return bytes(self.sink.data)
+
+
+def u16(data, i):
+    return data[i] | (data[i + 1] << 8)
+
+
+def s16(data, i):
+    v = data[i] | (data[i + 1] << 8)
+    return v - 65536 if v >= 32768 else v
+
+
+def command_size(data, i):
+    cmd = data[i]
+    if cmd in ARG_BYTES:
+        return 1 + ARG_BYTES.get(cmd)
+    if cmd == CMD_HORZ_PIXELS:
+        return 2 + data[i + 1] * 2
+    if cmd == CMD_TEXT:
+        return 2 + data[i + 1]
+    if cmd == CMD_SET_SPRITE:
+        return 3 + 32 * 32 * 2
+    raise ValueError("Unknown command " + str(cmd) + " at offset " + str(i))
+
+
+def frames(data):
+    # (start, end) offsets of each frame, a frame ends with its flip command
+    res = []
+    start = 0
+    i = 0
+    n = len(data)
+    while i < n:
+        size = command_size(data, i)
+        if data[i] == CMD_FLIP:
+            res.append((start, i + size))
+            start = i + size
+        i += size
+    if start < n:
+        res.append((start, n))
+    return res
+
+
+def analyze(data):
+    # Bytes and counts per command, and bytes per frame
+    per_cmd = {}
+    i = 0
+    n = len(data)
+    while i < n:
+        size = command_size(data, i)
+        name = CMD_NAMES.get(data[i])
+        count, total = per_cmd.get(name, (0, 0))
+        per_cmd[name] = count + 1, total + size
+        i += size
+    sizes = [e - s for s, e in frames(data)]
+    return {'bytes': n, 'frames': len(sizes), 'frame_bytes': sizes, 'commands': per_cmd}
+
+
+def diff(a, b):
+    # First frame whose commands differ, as (frame, offset in frame, command name), or None
+    fa = frames(a)
+    fb = frames(b)
+    for k in range(min(len(fa), len(fb))):
+        x = a[fa[k][0]:fa[k][1]]
+        y = b[fb[k][0]:fb[k][1]]
+        if x != y:
+            i = 0
+            while i < len(x) and i < len(y):
+                size = command_size(x, i)
+                if x[i:(i + size)] != y[i:(i + size)]:
+                    return k, i, CMD_NAMES.get(x[i])
+                i += size
+            return k, i, None
+    if len(fa) != len(fb):
+        return min(len(fa), len(fb)), 0, None
+    return None
+
+
+def replay(scr, data, present=False):
+    # Feeds a recorded stream into a screen as fast as it decodes, returns the number of frames.
+    # Flips only present the frame when asked to.
+    data = memoryview(data)
+    n = len(data)
+    i = 0
+    x = 0
+    y = 0
+    count = 0
+    while i < n:
+        cmd = data[i]
+        if cmd == CMD_PIXEL_CURSOR:
+            x = s16(data, i + 1)
+            y = s16(data, i + 3)
+            i += 5
+            if i >= n or data[i] not in POSITIONED:
+                scr.pixel_cursor(x, y)
+        elif cmd == CMD_DRAW_SPRITE:
+            scr.draw_sprite(x, y, u16(data, i + 1), data[i + 3])
+            i += 4
+        elif cmd == CMD_FILL_RECT:
+            scr.fill_rect(x, y, u16(data, i + 1), u16(data, i + 3))
+            i += 5
+        elif cmd == CMD_BG_COLOR:
+            scr.bg_color(u16(data, i + 1))
+            i += 3
+        elif cmd == CMD_FG_COLOR:
+            scr.fg_color(u16(data, i + 1))
+            i += 3
+        elif cmd == CMD_FLIP:
+            count += 1
+            if present:
+                scr.flip()
+            i += 2
+        elif cmd == CMD_SET_SPRITE:
+            scr.set_sprite(u16(data, i + 1), data[(i + 3):(i + 3 + 2048)])
+            i += 3 + 2048
+        elif cmd == CMD_TEXT:
+            length = data[i + 1]
+            scr.text(str(bytes(data[(i + 2):(i + 2 + length)]), 'ascii'))
+            i += 2 + length
+        elif cmd == CMD_TEXT_CURSOR:
+            scr.text_cursor(data[i + 1], data[i + 2])
+            i += 3
+        elif cmd == CMD_HORZ_LINE:
+            scr.horz_line(x, x + u16(data, i + 1), y)
+            i += 3
+        elif cmd == CMD_VERT_LINE:
+            scr.vert_line(x, y, y + u16(data, i + 1))
+            i += 3
+        elif cmd == CMD_HORZ_PIXELS:
+            length = data[i + 1]
+            scr.horz_pixels([u16(data, i + 2 + k * 2) for k in range(length)])
+            i += 2 + length * 2
+        elif cmd == CMD_TRANSPARENT_COLOR:
+            scr.set_transparent_color(data[i + 1] != 0, u16(data, i + 2))
+            i += 4
+        elif cmd == CMD_CLS:
+            scr.cls()
+            i += 1
+        elif cmd == CMD_TEXT_NEWLINE:
+            scr.text_newline()
+            i += 1
+        elif cmd == CMD_PUSH_CURSOR:
+            scr.push_cursor()
+            i += 1
+        elif cmd == CMD_POP_CURSOR:
+            scr.pop_cursor()
+            i += 1
+        elif cmd == CMD_BLINK_CURSOR:
+            scr.blink(data[i + 1] != 0)
+            i += 2
+        else:
+            i += command_size(data, i)
+    return count
+
+
+def unit_test():
+    # A recorded stream replayed into another recorder must encode to the same bytes
+    rec = Recorder(Screen(NullUART()))
+    rec.set_transparent_color(True, 0x20)
+    rec.set_sprite(3, bytes(range(256)) * 8)
+    for frame in range(3):
+        rec.bg_color(0x1234 + frame)
+        rec.fill_rect(0, 0, 640, 480)
+        rec.draw_sprite(-5, 470, 3, 1)
+        rec.draw_sprite(100 + frame, 200, 3, 0)
+        rec.text_cursor(1, 2)
+        rec.fg_color(0xFFFF)
+        rec.text('Frame ' + str(frame))
+        rec.horz_line(10, 50, 60)
+        rec.vert_line(70, 10, 40)
+        rec.pixel_cursor(5, 6)
+        rec.horz_pixels([1, 2, 3, 0x8000])
+        rec.flip()
+    data = rec.data()
+    again = Recorder(Screen(NullUART()))
+    n = replay(again, data, present=True)
+    if n != 3 or again.data() != data or diff(data, again.data()) is not None:
+        print("Replay mismatch")
+        return False
+    info = analyze(data)
+    if info['frames'] != 3 or sum(info['frame_bytes']) != len(data):
+        print("Analysis mismatch")
+        return False
+    changed = bytearray(data)
+    start = frames(data)[2][0]
+    changed[start + 1] ^= 1
+    if diff(data, bytes(changed)) != (2, 0, 'bg_color'):
+        print("Diff mismatch " + str(diff(data, bytes(changed))))
+        return False
+    print("All tests successful")
+    return True
+
+
+if __name__ == '__main__':
+    unit_test()
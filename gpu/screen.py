@@ -1,7 +1,3 @@
-from machine import UART
-from fpioa_manager import fm
-from board import board_info
-
 N_SPRITES = 160
 
 CMD_NOP = 0
@@ -24,56 +20,186 @@ CMD_SET_SPRITE = 40
 CMD_DRAW_SPRITE = 41
 CMD_TRANSPARENT_COLOR = 42
 
+CMD_BUFFER_SIZE = 4096
+
+
+def open_uart():
+    from machine import UART
+    from fpioa_manager import fm
+    fm.register(25, fm.fpioa.UART2_RX)
+    fm.register(24, fm.fpioa.UART2_TX)
+    return UART(UART.UART2, 460800)
+
+
+class LoopbackUART:
+    # Stand-in for the board UART, records everything written to it
+    def __init__(self):
+        self.data = bytearray()
+        self.writes = 0
+
+    def write(self, data):
+        self.data.extend(data)
+        self.writes += 1
+        return len(data)
+
+    @staticmethod
+    def read(n=-1):
+        return None
+
+    def reset(self):
+        self.data = bytearray()
+        self.writes = 0
+
+
+class NullUART:
+    # Discards everything, for measuring the host side alone
+    @staticmethod
+    def write(data):
+        return len(data)
+
+    @staticmethod
+    def read(n=-1):
+        return None
+
 
 # EXPORT
 class Screen:
-    def __init__(self):
-        fm.register(25, fm.fpioa.UART2_RX)
-        fm.register(24, fm.fpioa.UART2_TX)
-        self.uart = UART(UART.UART2, 460800)
+    buffer_count = 2
+    profiler = None
+
+    def __init__(self, uart=None, flush_threshold=CMD_BUFFER_SIZE):
+        self.uart = uart if uart else open_uart()
+        self.buffer = bytearray(CMD_BUFFER_SIZE)
+        self.view = memoryview(self.buffer)
+        self.pos = 0
+        self.flush_threshold = min(flush_threshold, CMD_BUFFER_SIZE)
         self.byte_count = 0
         self.nop(16)
 
     def reset_count(self):
         self.byte_count = 0
 
+    @staticmethod
+    def width():
+        return 640
+
+    @staticmethod
+    def height():
+        return 480
+
+    def flush(self):
+        if self.pos > 0:
+            p = self.profiler
+            if p:
+                t0 = p.start()
+            self.uart.write(self.view[:self.pos])
+            if p:
+                p.stop('flush', t0)
+                p.add('bytes', self.pos)
+            self.pos = 0
+
+    def reserve(self, n):
+        if self.pos + n > CMD_BUFFER_SIZE:
+            self.flush()
+        pos = self.pos
+        self.pos = pos + n
+        self.byte_count = self.byte_count + n
+        return pos
+
+    def commit(self):
+        if self.pos >= self.flush_threshold:
+            self.flush()
+
     def send(self, data):
-        self.byte_count = self.byte_count + len(data)
-        self.uart.write(data)
+        n = len(data)
+        if n > CMD_BUFFER_SIZE - self.pos:
+            # Large payloads go straight out after whatever is queued
+            self.flush()
+            self.byte_count = self.byte_count + n
+            p = self.profiler
+            if p:
+                t0 = p.start()
+            self.uart.write(data)
+            if p:
+                p.stop('flush', t0)
+                p.add('bytes', n)
+        else:
+            pos = self.reserve(n)
+            self.buffer[pos:(pos + n)] = data
+            self.commit()
+
+    def put_cmd(self, cmd):
+        self.buffer[self.reserve(1)] = cmd
+        self.commit()
+
+    def put_cmd8(self, cmd, a):
+        b = self.buffer
+        pos = self.reserve(2)
+        b[pos] = cmd
+        b[pos + 1] = a & 255
+        self.commit()
+
+    def put_cmd16(self, cmd, a):
+        b = self.buffer
+        pos = self.reserve(3)
+        b[pos] = cmd
+        b[pos + 1] = a & 255
+        b[pos + 2] = (a >> 8) & 255
+        self.commit()
+
+    def put_cmd16x2(self, cmd, a, c):
+        b = self.buffer
+        pos = self.reserve(5)
+        b[pos] = cmd
+        b[pos + 1] = a & 255
+        b[pos + 2] = (a >> 8) & 255
+        b[pos + 3] = c & 255
+        b[pos + 4] = (c >> 8) & 255
+        self.commit()
 
     def nop(self, n=1):
-        self.send(bytes([CMD_NOP] * n))
+        for _ in range(n):
+            self.put_cmd(CMD_NOP)
+        self.flush()
         self.uart.read(4096)
 
     def cls(self):
-        self.send(bytes([CMD_CLS]))
+        self.put_cmd(CMD_CLS)
 
     def flip(self, double_buffer=1):
+        # Presenting is sending the flip, the time also shows up under flush
+        p = self.profiler
+        if p:
+            t0 = p.start()
         db = 1 if double_buffer else 0
-        self.send(bytes([CMD_FLIP, db]))
+        self.put_cmd8(CMD_FLIP, db)
+        self.flush()
+        if p:
+            p.stop('present', t0)
 
     def text_newline(self):
-        self.send(bytes([CMD_TEXT_NEWLINE]))
+        self.put_cmd(CMD_TEXT_NEWLINE)
 
     def pixel_cursor(self, x, y):
-        x = int(x)
-        y = int(y)
-        self.send(bytes([CMD_PIXEL_CURSOR, (x & 255), (x >> 8) & 255, (y & 255), (y >> 8) & 255]))
+        self.put_cmd16x2(CMD_PIXEL_CURSOR, int(x), int(y))
 
     def text_cursor(self, x, y):
-        x = int(x)
-        y = int(y)
-        self.send(bytes([CMD_TEXT_CURSOR, x, y]))
+        b = self.buffer
+        pos = self.reserve(3)
+        b[pos] = CMD_TEXT_CURSOR
+        b[pos + 1] = int(x) & 255
+        b[pos + 2] = int(y) & 255
+        self.commit()
 
     def fg_color(self, c):
-        self.send(bytes([CMD_FG_COLOR, (c & 255), (c >> 8) & 255]))
+        self.put_cmd16(CMD_FG_COLOR, c)
 
     def bg_color(self, c):
-        self.send(bytes([CMD_BG_COLOR, (c & 255), (c >> 8) & 255]))
+        self.put_cmd16(CMD_BG_COLOR, c)
 
     def text(self, s):
         if len(s) < 256:
-            self.send(bytes([CMD_TEXT, len(s)]))
+            self.put_cmd8(CMD_TEXT, len(s))
             self.send(bytes(s, 'ascii'))
 
     def println(self, s):
@@ -81,34 +207,30 @@ class Screen:
         self.text_newline()
 
     def push_cursor(self):
-        self.send(bytes([CMD_PUSH_CURSOR]))
+        self.put_cmd(CMD_PUSH_CURSOR)
 
     def pop_cursor(self):
-        self.send(bytes([CMD_POP_CURSOR]))
+        self.put_cmd(CMD_POP_CURSOR)
 
     def blink(self, on):
         state = 1 if on else 0
-        self.send(bytes([CMD_BLINK_CURSOR, state]))
+        self.put_cmd8(CMD_BLINK_CURSOR, state)
 
     def fill_rect(self, x, y, w, h):
         self.pixel_cursor(x, y)
-        w = int(w)
-        h = int(h)
-        self.send(bytes([CMD_FILL_RECT, (w & 255), (w >> 8) & 255, (h & 255), (h >> 8) & 255]))
+        self.put_cmd16x2(CMD_FILL_RECT, int(w), int(h))
 
     def horz_line(self, x0, x1, y):
         self.pixel_cursor(x0, y)
-        w = int(x1 - x0)
-        self.send(bytes([CMD_HORZ_LINE, (w & 255), (w >> 8) & 255]))
+        self.put_cmd16(CMD_HORZ_LINE, int(x1 - x0))
 
     def vert_line(self, x, y0, y1):
         self.pixel_cursor(x, y0)
-        h = int(y1 - y0)
-        self.send(bytes([CMD_VERT_LINE, (h & 255), (h >> 8) & 255]))
+        self.put_cmd16(CMD_VERT_LINE, int(y1 - y0))
 
     @staticmethod
     def pixels2bytes(pixels):
-        if isinstance(pixels, bytes):
+        if isinstance(pixels, (bytes, bytearray, memoryview)):
             return pixels
         vals = [None] * (len(pixels) * 2)
         for i in range(len(pixels)):
@@ -122,7 +244,7 @@ class Screen:
         pixels = self.pixels2bytes(pixels)
         n = (len(pixels) >> 1)
         if n < 256:
-            self.send(bytes[CMD_HORZ_PIXELS, n])
+            self.put_cmd8(CMD_HORZ_PIXELS, n)
             self.send(pixels)
 
     def set_sprite(self, index, pixels):
@@ -130,7 +252,7 @@ class Screen:
             pixels = self.pixels2bytes(pixels)
             if len(pixels) == (32 * 32 * 2):
                 print("Setting sprite " + str(index))
-                self.send(bytes([CMD_SET_SPRITE, (index & 255), (index >> 8) & 255]))
+                self.put_cmd16(CMD_SET_SPRITE, index)
                 self.send(pixels)
             else:
                 print("Failed to set sprite " + str(index) + "  len(pixels)=" + str(len(pixels)))
@@ -139,12 +261,22 @@ class Screen:
         if 0 <= index < N_SPRITES:
             self.pixel_cursor(x, y)
             index = int(index)
-            flags = int(flags)
-            self.send(bytes([CMD_DRAW_SPRITE, (index & 255), (index >> 8) & 255, flags]))
+            b = self.buffer
+            pos = self.reserve(4)
+            b[pos] = CMD_DRAW_SPRITE
+            b[pos + 1] = index & 255
+            b[pos + 2] = (index >> 8) & 255
+            b[pos + 3] = int(flags) & 255
+            self.commit()
 
     def set_transparent_color(self, enabled, color):
-        en = 1 if enabled else 0
-        self.send(bytes([CMD_TRANSPARENT_COLOR, en, color & 255, (color >> 8) & 255]))
+        b = self.buffer
+        pos = self.reserve(4)
+        b[pos] = CMD_TRANSPARENT_COLOR
+        b[pos + 1] = 1 if enabled else 0
+        b[pos + 2] = color & 255
+        b[pos + 3] = (color >> 8) & 255
+        self.commit()
 
     @staticmethod
     def start():
@@ -155,4 +287,60 @@ class Screen:
         pass
 
 
-screen = Screen()
+def expected_frame_bytes(sprites):
+    # Byte stream of a test frame, encoded the way each command was sent before batching
+    data = bytearray([CMD_BG_COLOR, 0x1F, 0x00])
+    data.extend([CMD_PIXEL_CURSOR, 0, 0, 0, 0, CMD_FILL_RECT, 0x80, 0x02, 0xE0, 0x01])
+    for i in range(sprites):
+        x = (i * 37) % 600
+        y = (i * 23) % 440
+        data.extend([CMD_PIXEL_CURSOR, x & 255, x >> 8, y & 255, y >> 8])
+        data.extend([CMD_DRAW_SPRITE, i % N_SPRITES, 0, i & 1])
+    data.extend([CMD_TEXT_CURSOR, 1, 2, CMD_TEXT, 5])
+    data.extend(b'Hello')
+    data.extend([CMD_FLIP, 1])
+    return bytes(data)
+
+
+def unit_test(sprites=100):
+    uart = LoopbackUART()
+    scr = Screen(uart)
+    if bytes(uart.data) != bytes(16) or uart.writes != 1:
+        print("Failed NOP preamble")
+        return False
+    for threshold in (CMD_BUFFER_SIZE, 64):
+        uart.reset()
+        scr.flush_threshold = threshold
+        scr.reset_count()
+        scr.bg_color(0x001F)
+        scr.fill_rect(0, 0, 640, 480)
+        for i in range(sprites):
+            scr.draw_sprite((i * 37) % 600, (i * 23) % 440, i % N_SPRITES, i & 1)
+        scr.text_cursor(1, 2)
+        scr.text('Hello')
+        scr.flip()
+        expected = expected_frame_bytes(sprites)
+        if bytes(uart.data) != expected or scr.byte_count != len(expected):
+            print("Byte stream mismatch, threshold=" + str(threshold))
+            return False
+        print("threshold=" + str(threshold) + ": " + str(len(expected)) + " bytes in " + str(uart.writes) +
+              " writes per frame (" + str(2 * sprites + 7) + " before batching)")
+    uart.reset()
+    pixels = bytes(range(256)) * 8
+    scr.set_sprite(3, pixels)
+    scr.flush()
+    if bytes(uart.data) != bytes([CMD_SET_SPRITE, 3, 0]) + pixels:
+        print("Sprite upload mismatch")
+        return False
+    print("All tests successful")
+    return True
+
+
+try:
+    screen = Screen()
+except ImportError:
+    # Not on the board, screens can still be built with a LoopbackUART
+    screen = None
+
+if __name__ == '__main__':
+    unit_test()
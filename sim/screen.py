@@ -11,26 +11,56 @@ from .font import Font
 from engine.utils import Rect, Point
 
 N_SPRITES = 160
+SPRITE_SIZE = 32
+ALPHA_CACHE_SIZE = 4
+GLYPH_CACHE_SIZE = 8
+BLINK_PERIOD = 0.5
+
+# draw_sprite flag bits, the values of engine.sprite.FLIP_H, FLIP_V and ROTATE_90
+FLIP_H = 1
+FLIP_V = 2
+ROTATE_90 = 4
 
 
 def cvt16to32(c):
     return (c & 0x1F) << 3, (c >> 3) & 0xFC, (c >> 8) & 0xF8, 255
 
 
+def pixels16(pixels):
+    # Buffers (bytes, bytearray, memoryview) are viewed in place as little-endian RGB565.
+    # Lists may hold either 16-bit pixel values or byte pairs.
+    if isinstance(pixels, (bytes, bytearray, memoryview)):
+        return np.frombuffer(pixels, dtype='<u2')
+    p = np.asarray(pixels, dtype=np.uint16)
+    if p.size == 2 * SPRITE_SIZE * SPRITE_SIZE:
+        p = p[0::2] | (p[1::2] << 8)
+    return p
+
+
+def cvt16to32_array(p16, out):
+    out[..., 0] = (p16 & 0x1F) << 3
+    out[..., 1] = (p16 >> 3) & 0xFC
+    out[..., 2] = (p16 >> 8) & 0xF8
+    out[..., 3] = 255
+    return out
+
+
 # EXPORT
 class Screen:
     Cursor: Tuple[int, int]
+    buffer_count = 1
+    profiler = None
 
-    def __init__(self):
+    def __init__(self, window=True):
         self.Image = np.ndarray((480, 640, 4), dtype=np.uint8)
-        self.Sprites = [np.ndarray((32, 32, 4), dtype=np.uint8) for _ in range(N_SPRITES)]
-        self.Sprites16 = [np.ndarray((32, 32), dtype=np.uint16) for _ in range(N_SPRITES)]
-        for i in range(N_SPRITES):
-            sprite = self.Sprites[i]
-            sprite[:] = (0, 0, 0, 255)
-            sprite = self.Sprites16[i]
-            sprite[:] = 0
-            self.Sprites16[i] = sprite
+        self.Sprites = np.zeros((N_SPRITES, SPRITE_SIZE, SPRITE_SIZE, 4), dtype=np.uint8)
+        self.Sprites[:, :, :, 3] = 255
+        self.Sprites16 = np.zeros((N_SPRITES, SPRITE_SIZE, SPRITE_SIZE), dtype=np.uint16)
+        self.sprite_versions = np.zeros(N_SPRITES, dtype=np.uint32)
+        self.alpha_cache = {}
+        self.glyph_cache = {}
+        # Per slot, the pixels and opaque mask of each transform drawn so far
+        self.variants = [None] * N_SPRITES
         self.transparency = False
         self.transparent = 0
         self.updated = True
@@ -40,12 +70,36 @@ class Screen:
         self.bg = 0, 0, 0, 255
         self.Cursor = 0, 0
         self.CursorStack = []
+        # Sprites and rect fills only touch pixels inside the clip, x0, y0, x1, y1
+        self.clip = (0, 0, 640, 480)
+        # Offscreen layer for pre-composited static content, swapped with Image while drawing into it
+        self.Background = None
+        self.in_background = False
+        self.saved_cursor = None
         self.font = Font()
         self.cls()
         self.cursor_block = np.ones((16, 8, 4), dtype=np.uint8)
         self.cursor_block[:] = 255, 255, 255, 255
         self.cursor_on = False
-        cv2.namedWindow('vis')
+        # Finished frames are copied to ready by flip(), the presenter thread swaps it with shown
+        self.ready = np.copy(self.Image)
+        self.shown = np.copy(self.Image)
+        self.ready_cursor = self.Cursor
+        self.shown_cursor = self.Cursor
+        self.cursor_drawn = False
+        self.pending = False
+        self.flip_ts = 0.0
+        self.cond = threading.Condition()
+        self.presenter = None
+        self.terminate = False
+        self.reset_present_stats()
+        self.window = window
+        if window:
+            try:
+                cv2.namedWindow('vis')
+            except cv2.error:
+                # OpenCV without GUI support, frames are only rendered into Image
+                self.window = False
 
     def flush(self):
         pass
@@ -53,18 +107,12 @@ class Screen:
     def nop(self):
         pass
 
-    def draw_cursor(self):
-        self.cursor_on = not self.cursor_on
-        x, y = self.Cursor
-        c = self.cursor_block
-        sub = self.Image[y:y + c.shape[0], x:x + c.shape[1]]
-        sub = cv2.bitwise_xor(sub, c)
-        self.Image[y:y + c.shape[0], x:x + c.shape[1]] = sub
-
-    def toggle_blink(self):
-        if self.blinking:
-            self.draw_cursor()
-            self.updated = True
+    def draw_cursor(self, img, pos):
+        # Drawing it again erases it
+        x, y = pos
+        sub = img[y:y + self.cursor_block.shape[0], x:x + self.cursor_block.shape[1]]
+        c = self.cursor_block[:sub.shape[0], :sub.shape[1]]
+        img[y:y + c.shape[0], x:x + c.shape[1]] = cv2.bitwise_xor(sub, c)
 
     def cls(self):
         self.Image[:] = (0, 0, 0, 255)
@@ -74,7 +122,26 @@ class Screen:
         self.updated = True
 
     def flip(self):
-        self.show()
+        # Hands the frame to the presenter, without a presenter thread it is shown right away
+        p = self.profiler
+        if p:
+            t0 = p.start()
+        if self.presenter is None:
+            self.display(self.Image)
+            self.presented += 1
+        else:
+            with self.cond:
+                if self.pending:
+                    self.dropped += 1
+                np.copyto(self.ready, self.Image)
+                self.ready_cursor = self.Cursor
+                self.pending = True
+                self.flip_ts = time.perf_counter()
+                self.cond.notify()
+        self.flips += 1
+        self.updated = False
+        if p:
+            p.stop('present', t0)
 
     def height(self):
         return self.Image.shape[0]
@@ -96,8 +163,6 @@ class Screen:
         self.Cursor = (0, y)
 
     def pixel_cursor(self, x, y):
-        if self.blinking and self.cursor_on:
-            self.draw_cursor()
         if 0 <= x < self.width() and 0 <= y < self.height():
             self.Cursor = (x, y)
 
@@ -112,18 +177,32 @@ class Screen:
     def bg_color(self, c):
         self.bg = cvt16to32(c)
 
+    def glyph_atlas(self):
+        # All glyphs in the current colors, laid out (row, char, column, channel) so a
+        # string gathers straight into a framebuffer strip. Cached per color pair.
+        key = (self.fg, self.bg)
+        atlas = self.glyph_cache.get(key)
+        if atlas is None:
+            if len(self.glyph_cache) >= GLYPH_CACHE_SIZE:
+                del self.glyph_cache[next(iter(self.glyph_cache))]
+            mask = self.font.atlas().transpose(1, 0, 2)
+            atlas = np.where(mask[:, :, :, None], np.array(self.fg, dtype=np.uint8), np.array(self.bg, dtype=np.uint8))
+            self.glyph_cache[key] = atlas
+        return atlas
+
     def text(self, s):
         x, y = self.Cursor
-        for c in s:
-            if x > self.width() - self.font.width():
-                break
-            i = ord(c)
-            p = np.copy(self.font.get(i))
-            p[p[:, :, 0] == 0] = self.bg
-            p[p[:, :, 0] == 255] = self.fg
-            self.Image[y:(y + self.font.height()), x:(x + self.font.width())] = p
-            x = x + self.font.width()
-        self.pixel_cursor(x, y)
+        fw = self.font.width()
+        n = min(len(s), max(0, (self.width() - x) // fw))
+        rows = min(self.font.height(), self.height() - y)
+        if n > 0 and rows > 0:
+            try:
+                codes = np.frombuffer(s[:n].encode('latin-1'), dtype=np.uint8)
+            except UnicodeEncodeError:
+                codes = np.array([ord(c) if ord(c) < 256 else 0 for c in s[:n]], dtype=np.uint8)
+            strip = self.glyph_atlas()[:rows, codes]
+            self.Image[y:(y + rows), x:(x + n * fw)] = strip.reshape(rows, n * fw, 4)
+        self.pixel_cursor(x + n * fw, y)
         self.updated = True
 
     def println(self, s):
@@ -139,11 +218,19 @@ class Screen:
             del self.CursorStack[-1]
 
     def blink(self, on):
-        self.blinking = on
+        with self.cond:
+            self.blinking = on
+            self.cond.notify()
 
     def fill_rect(self, x, y, w, h):
         self.pixel_cursor(x, y)
-        self.Image[y:(y + h), x:(x + w)] = self.bg
+        cx0, cy0, cx1, cy1 = self.clip
+        x0 = max(x, cx0)
+        y0 = max(y, cy0)
+        x1 = min(x + w, cx1)
+        y1 = min(y + h, cy1)
+        if x1 > x0 and y1 > y0:
+            self.Image[y0:y1, x0:x1] = self.bg
         self.updated = True
 
     def horz_line(self, x0, x1, y):
@@ -165,108 +252,243 @@ class Screen:
 
     def set_sprite(self, index, pixels):
         if 0 <= index < N_SPRITES:
-            i = 0
+            p16 = pixels16(pixels).reshape((SPRITE_SIZE, SPRITE_SIZE))
             spr = self.Sprites[index]
-            spr16 = self.Sprites16[index]
-            for y in range(spr.shape[0]):
-                for x in range(spr.shape[1]):
-                    pixel = (int(pixels[i * 2 + 1]) << 8) | int(pixels[i * 2])
-                    c = cvt16to32(pixel)
-                    alpha = 255
-                    if self.transparency:
-                        alpha = 0 if pixel == self.transparent else 255
-                    spr[y, x, :] = c[0], c[1], c[2], alpha
-                    spr16[y, x] = pixel
-                    i = i + 1
-
-    def draw_partial(self, x, y, index):
-        s = self.Sprites[index]
-        rdst = Rect(x, y, x + 32, y + 32).intersection(Rect(0, 0, self.width(), self.height()))
+            self.Sprites16[index] = p16
+            cvt16to32_array(p16, spr)
+            if self.transparency:
+                spr[:, :, 3][p16 == self.transparent] = 0
+            self.sprite_versions[index] += 1
+            self.variants[index] = None
+
+    def get_variant(self, index, flags):
+        # Built on first use, see FLIP_H, FLIP_V and ROTATE_90
+        flags = flags & 7
+        cached = self.variants[index]
+        if cached is None:
+            cached = [None] * 8
+            self.variants[index] = cached
+        v = cached[flags]
+        if v is None:
+            s = self.Sprites[index]
+            if flags & ROTATE_90:
+                s = np.rot90(s, -1)
+            if flags & FLIP_H:
+                s = s[:, ::-1]
+            if flags & FLIP_V:
+                s = s[::-1]
+            s = np.ascontiguousarray(s)
+            v = s, (s[:, :, 3:] == 255)
+            cached[flags] = v
+        return v
+
+    def draw_partial(self, x, y, index, flags=0):
+        s, alpha = self.get_variant(index, flags)
+        cx0, cy0, cx1, cy1 = self.clip
+        rdst = Rect(x, y, x + 32, y + 32).intersection(Rect(cx0, cy0, cx1, cy1))
         rsrc = Rect(rdst)
         rsrc.move(Point(-x, -y))
         dst = self.Image[rdst.tl.y:rdst.br.y, rdst.tl.x:rdst.br.x, :]
         src = s[rsrc.tl.y:rsrc.br.y, rsrc.tl.x:rsrc.br.x, :]
-        alpha = (src[:, :, 3] == 255)
-        for c in range(3):
-            np.copyto(dst[:, :, c], src[:, :, c], where=alpha)
+        np.copyto(dst, src, where=alpha[rsrc.tl.y:rsrc.br.y, rsrc.tl.x:rsrc.br.x])
 
     def draw_sprite(self, x, y, index, flags):
         if 0 <= index < N_SPRITES:
             x = int(x)
             y = int(y)
-            if x >= self.width() or (x + 32) <= 0 or y >= self.height() or (y + 32) <= 0:
+            cx0, cy0, cx1, cy1 = self.clip
+            if x >= cx1 or (x + 32) <= cx0 or y >= cy1 or (y + 32) <= cy0:
                 return
-            if x < 0 or y < 0 or (x + 32) > self.width() or (y + 32) > self.height():
-                self.draw_partial(x, y, index)
+            if x < cx0 or y < cy0 or (x + 32) > cx1 or (y + 32) > cy1:
+                self.draw_partial(x, y, index, flags)
             else:
                 self.pixel_cursor(x, y)
-                s = self.Sprites[index]
-                if (flags & 1) == 1:
-                    s = cv2.flip(s, 1)
-                alpha = (s[:, :, 3] == 255)
-                for c in range(3):
-                    np.copyto(self.Image[y:(y + s.shape[0]), x:(x + s.shape[1]), c], s[:, :, c], where=alpha)
+                s, alpha = self.get_variant(index, flags)
+                # Opaque sprite pixels have the same 255 alpha as the image, all four channels copy at once
+                np.copyto(self.Image[y:(y + SPRITE_SIZE), x:(x + SPRITE_SIZE)], s, where=alpha)
             self.updated = True
 
+    def set_clip(self, x, y, w, h):
+        self.clip = (max(x, 0), max(y, 0), min(x + w, self.width()), min(y + h, self.height()))
+
+    def reset_clip(self):
+        self.clip = (0, 0, self.width(), self.height())
+
+    def begin_background(self):
+        # Until end_background() everything is drawn into the offscreen layer
+        if not self.in_background:
+            if self.Background is None:
+                self.Background = np.copy(self.Image)
+            self.Image, self.Background = self.Background, self.Image
+            self.saved_cursor = self.Cursor
+            self.in_background = True
+
+    def end_background(self):
+        if self.in_background:
+            self.Image, self.Background = self.Background, self.Image
+            self.Cursor = self.saved_cursor
+            self.in_background = False
+            self.reset_clip()
+
+    def restore_background(self):
+        # Starts a frame from the offscreen layer, one array copy
+        if self.Background is not None:
+            np.copyto(self.Image, self.Background)
+            self.updated = True
+
+    def shift(self, dx, dy):
+        # Moves the content as the view moving by dx, dy would,
+        # returns the exposed strips as (x, y, w, h) screen rects
+        img = self.Image
+        w = self.width()
+        h = self.height()
+        if abs(dx) >= w or abs(dy) >= h:
+            return [(0, 0, w, h)]
+        if dy > 0:
+            img[0:(h - dy)] = img[dy:h]
+        elif dy < 0:
+            img[-dy:h] = img[0:(h + dy)]
+        if dx > 0:
+            img[:, 0:(w - dx)] = img[:, dx:w]
+        elif dx < 0:
+            img[:, -dx:w] = img[:, 0:(w + dx)]
+        strips = []
+        if dy > 0:
+            strips.append((0, h - dy, w, dy))
+        elif dy < 0:
+            strips.append((0, 0, w, -dy))
+        # The column strip leaves out the rows already exposed
+        y0 = max(0, -dy)
+        y1 = min(h, h - dy)
+        if dx > 0:
+            strips.append((w - dx, y0, dx, y1 - y0))
+        elif dx < 0:
+            strips.append((0, y0, -dx, y1 - y0))
+        return strips
+
+    def alpha_plane(self, color):
+        # Alpha planes are cached per key color, and only slots uploaded since
+        # the plane was last refreshed are compared again
+        entry = self.alpha_cache.get(color)
+        if entry is None:
+            if len(self.alpha_cache) >= ALPHA_CACHE_SIZE:
+                del self.alpha_cache[next(iter(self.alpha_cache))]
+            alpha = np.where(self.Sprites16 == color, 0, 255).astype(np.uint8)
+            self.alpha_cache[color] = alpha, self.sprite_versions.copy()
+            return alpha
+        alpha, versions = entry
+        stale = np.flatnonzero(versions != self.sprite_versions)
+        if stale.size > 0:
+            alpha[stale] = np.where(self.Sprites16[stale] == color, 0, 255)
+            versions[stale] = self.sprite_versions[stale]
+        return alpha
+
     def set_transparent_color(self, enabled, color):
+        # set_sprite keys each upload with the current color, so the alpha
+        # planes only need to be rewritten when the key actually changes
+        if enabled == self.transparency and (color == self.transparent or not enabled):
+            self.transparent = color
+            return
         self.transparency = enabled
         self.transparent = color
-        for index in range(N_SPRITES):
-            spr = self.Sprites[index]
-            spr16 = self.Sprites16[index]
-            for y in range(spr.shape[0]):
-                for x in range(spr.shape[1]):
-                    spr[y, x, 3] = 0 if (enabled and spr16[y, x] == color) else 255
+        self.variants = [None] * N_SPRITES
+        if enabled:
+            self.Sprites[:, :, :, 3] = self.alpha_plane(color)
+        else:
+            self.Sprites[:, :, :, 3] = 255
 
     def show(self):
-        # self.font.write(self.Image, 0, 0, f'FPS: {int(app.fps)}')
-        w = int(self.Scaling * self.Image.shape[1])
-        h = int(self.Scaling * self.Image.shape[0])
-        img = cv2.resize(self.Image, (w, h), interpolation=cv2.INTER_NEAREST)
-        cv2.imshow("vis", img)
-        cv2.waitKey(1)
+        self.flip()
+
+    def display(self, img):
+        if self.window:
+            w = int(self.Scaling * img.shape[1])
+            h = int(self.Scaling * img.shape[0])
+            img = cv2.resize(img, (w, h), interpolation=cv2.INTER_NEAREST)
+            cv2.imshow("vis", img)
+            cv2.waitKey(1)
+
+    def reset_present_stats(self):
+        self.flips = 0
+        self.presented = 0
+        self.dropped = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def present_stats(self):
+        # Latency is from flip() until the frame is on the window, frames replaced before that are dropped
+        n = self.presented
+        return {'flips': self.flips, 'presented': n, 'dropped': self.dropped,
+                'latency_ms': (self.latency_total / n * 1000.0) if n > 0 else 0.0,
+                'max_latency_ms': self.latency_max * 1000.0}
+
+    def wait_for_work(self, next_blink):
+        # Called holding cond, returns when there is a frame, a blink is due or the cursor must go
+        while not self.terminate and not self.pending:
+            if self.blinking:
+                timeout = next_blink - time.perf_counter()
+                if timeout <= 0:
+                    return
+                self.cond.wait(timeout)
+            elif self.cursor_drawn:
+                return
+            else:
+                self.cond.wait()
+
+    def present_loop(self):
+        next_blink = time.perf_counter() + BLINK_PERIOD
+        while True:
+            with self.cond:
+                self.wait_for_work(next_blink)
+                if self.terminate and not self.pending:
+                    break
+                fresh = self.pending
+                if fresh:
+                    self.ready, self.shown = self.shown, self.ready
+                    self.shown_cursor = self.ready_cursor
+                    self.cursor_drawn = False
+                    self.pending = False
+                    ts = self.flip_ts
+            now = time.perf_counter()
+            if self.blinking and now >= next_blink:
+                self.cursor_on = not self.cursor_on
+                next_blink = now + BLINK_PERIOD
+            cursor = self.blinking and self.cursor_on
+            changed = cursor != self.cursor_drawn
+            if changed:
+                self.draw_cursor(self.shown, self.shown_cursor)
+                self.cursor_drawn = cursor
+            if fresh or changed:
+                self.display(self.shown)
+            if fresh:
+                latency = time.perf_counter() - ts
+                self.presented += 1
+                self.latency_total += latency
+                self.latency_max = max(self.latency_max, latency)
 
     @staticmethod
     def wait(ms):
         cv2.waitKey(ms)
 
-    @staticmethod
-    def start():
-        global show_thread
-        show_thread = threading.Thread(target=show_loop)
-        show_thread.start()
+    def start(self):
+        if self.presenter is None:
+            self.terminate = False
+            self.presenter = threading.Thread(target=self.present_loop)
+            self.presenter.daemon = True
+            self.presenter.start()
 
-    @staticmethod
-    def stop():
-        global terminate
-        global show_thread
-        if not terminate:
-            terminate = True
-            if show_thread:
-                # noinspection PyUnresolvedReferences
-                show_thread.join()
+    def stop(self):
+        if self.presenter is not None:
+            with self.cond:
+                self.terminate = True
+                self.cond.notify()
+            self.presenter.join()
+            self.presenter = None
 
 
 # EXPORT
 screen = Screen()
 
-terminate = False
-show_thread = None
-
-
-def show_loop():
-    count = 0
-    while not terminate:
-        if screen.updated:
-            screen.updated = False
-            screen.show()
-        time.sleep(0.05)
-        count = count + 1
-        # uoscore.timer()
-        if count >= 10:
-            count = 0
-            screen.toggle_blink()
-
 
 def get_test_sprite_data():
     data = [
@@ -389,11 +611,146 @@ def unit_test():
     screen.text_newline()
     screen.text_newline()
     screen.text("Press any key")
-    screen.draw_sprite(300, 100, 0)
+    screen.draw_sprite(300, 100, 0, 0)
     screen.show()
     screen.wait(0)
     screen.stop()
 
 
+def benchmark_set_sprite(n=200):
+    import os
+    sprites = [os.urandom(SPRITE_SIZE * SPRITE_SIZE * 2) for _ in range(n)]
+    screen.set_transparent_color(True, 0x20)
+    results = {}
+
+    def per_pixel(index, pixels):
+        # Reference implementation, one pixel converted at a time
+        if 0 <= index < N_SPRITES:
+            i = 0
+            spr = screen.Sprites[index]
+            spr16 = screen.Sprites16[index]
+            for y in range(spr.shape[0]):
+                for x in range(spr.shape[1]):
+                    pixel = (int(pixels[i * 2 + 1]) << 8) | int(pixels[i * 2])
+                    c = cvt16to32(pixel)
+                    alpha = 255
+                    if screen.transparency:
+                        alpha = 0 if pixel == screen.transparent else 255
+                    spr[y, x, :] = c[0], c[1], c[2], alpha
+                    spr16[y, x] = pixel
+                    i = i + 1
+            screen.variants[index] = None
+
+    for name, upload in (('per_pixel', per_pixel), ('vectorized', screen.set_sprite)):
+        start = time.perf_counter()
+        for i in range(n):
+            upload(i % N_SPRITES, sprites[i])
+        results[name] = n / (time.perf_counter() - start)
+    for i in range(min(n, N_SPRITES)):
+        per_pixel(i, sprites[i])
+        expected = screen.Sprites[i].copy()
+        screen.set_sprite(i, memoryview(bytearray(sprites[i])))
+        if not np.array_equal(expected, screen.Sprites[i]):
+            print("Mismatch in sprite " + str(i))
+    print("per-pixel:  " + str(int(results['per_pixel'])) + " sprites/sec")
+    print("vectorized: " + str(int(results['vectorized'])) + " sprites/sec")
+    print("speedup:    " + str(round(results['vectorized'] / results['per_pixel'], 1)) + "x")
+    return results
+
+
+def benchmark_transparent_color(n=1000):
+    import os
+    for i in range(N_SPRITES):
+        screen.set_sprite(i, os.urandom(SPRITE_SIZE * SPRITE_SIZE * 2))
+    keys = [0x20, 0xF81F, 0x20, 0x0000]
+    start = time.perf_counter()
+    for i in range(n):
+        screen.set_transparent_color(i % 5 != 4, keys[i % len(keys)])
+    per_call = (time.perf_counter() - start) / n
+    screen.set_transparent_color(True, 0x20)
+    expected = np.where(screen.Sprites16 == 0x20, 0, 255)
+    if not np.array_equal(expected, screen.Sprites[:, :, :, 3]):
+        print("Alpha plane mismatch")
+    print("set_transparent_color: " + str(round(per_call * 1e6, 1)) + " us/call")
+    return per_call
+
+
+def benchmark_draw_sprite(n=20000):
+    # Draws per second for each transform, variants are built on the first draw only
+    import os
+    for i in range(16):
+        screen.set_sprite(i, os.urandom(SPRITE_SIZE * SPRITE_SIZE * 2))
+    results = {}
+    for flags in range(8):
+        start = time.perf_counter()
+        for i in range(n):
+            screen.draw_sprite((i * 37) % 608, (i * 13) % 448, i & 15, flags)
+        results[flags] = n / (time.perf_counter() - start)
+        print("flags " + str(flags) + ": " + str(int(results[flags])) + " draws/sec")
+    return results
+
+
+def benchmark_text(frames=10):
+    # Characters per second redrawing a full 80x30 text screen, in alternating colors
+    import random
+    random.seed(1)
+    cols = screen.width() // screen.font.width()
+    rows = screen.height() // screen.font.height()
+    lines = [''.join([chr(random.randint(32, 126)) for _ in range(cols)]) for _ in range(rows)]
+    results = {}
+
+    def per_glyph(s):
+        # Reference implementation, a copy of the glyph per character
+        x, y = screen.Cursor
+        for c in s:
+            if x > screen.width() - screen.font.width():
+                break
+            p = np.copy(screen.font.get(ord(c)))
+            p[p[:, :, 0] == 0] = screen.bg
+            p[p[:, :, 0] == 255] = screen.fg
+            screen.Image[y:(y + screen.font.height()), x:(x + screen.font.width())] = p
+            x = x + screen.font.width()
+        screen.pixel_cursor(x, y)
+        screen.updated = True
+
+    for name, draw in (('per_glyph', per_glyph), ('atlas', screen.text)):
+        start = time.perf_counter()
+        for frame in range(frames):
+            for y in range(rows):
+                screen.fg_color(0xFFFF if (frame + y) % 2 else 0x07E0)
+                screen.bg_color(0x0000 if frame % 2 else 0x001F)
+                screen.text_cursor(0, y)
+                draw(lines[y])
+        results[name] = frames * rows * cols / (time.perf_counter() - start)
+        if name == 'per_glyph':
+            expected = screen.Image.copy()
+    if not np.array_equal(expected, screen.Image):
+        print("Text mismatch")
+    print("per-glyph: " + str(int(results['per_glyph'])) + " chars/sec")
+    print("atlas:     " + str(int(results['atlas'])) + " chars/sec")
+    print("speedup:   " + str(round(results['atlas'] / results['per_glyph'], 1)) + "x")
+    return results
+
+
+def benchmark_present(n=300, draw_ms=2.0):
+    # Game thread cost of flip() and what the presenter made of the frames
+    screen.start()
+    screen.reset_present_stats()
+    cost = 0.0
+    for i in range(n):
+        screen.bg_color(i * 0x0841)
+        screen.fill_rect(0, 0, 640, 480)
+        time.sleep(draw_ms / 1000.0)
+        start = time.perf_counter()
+        screen.flip()
+        cost += time.perf_counter() - start
+    screen.stop()
+    stats = screen.present_stats()
+    print("flip: " + str(round(cost / n * 1e6, 1)) + " us/frame on the game thread")
+    print("presented " + str(stats['presented']) + " dropped " + str(stats['dropped']) +
+          " latency avg " + str(round(stats['latency_ms'], 2)) + " ms max " + str(round(stats['max_latency_ms'], 2)) + " ms")
+    return stats
+
+
 if __name__ == '__main__':
     unit_test()
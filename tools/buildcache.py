@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from engine.sprite import build_sprite_cache
+
+
+def main():
+    # Run from the game directory, image paths in the animation files are relative to it
+    if len(sys.argv) < 2:
+        print("Usage: buildcache.py <animation json files>")
+    else:
+        for filename in sys.argv[1:]:
+            print(filename + ": " + str(build_sprite_cache(filename)) + " frames")
+
+
+if __name__ == '__main__':
+    main()
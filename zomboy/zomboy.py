@@ -1,5 +1,4 @@
 import random
-import utime
 from engine import *
 from monster import Monster
 from player import Player
@@ -22,10 +21,14 @@ class GameApplication(Application):
         super().__init__()
         self.player = Player()
         self.scene.add(self.player)
+        self.tiles = TileMap(20, 15)
+        self.scene.add_layer(self.tiles)
         # self.add_static_sprites(generate_platform(14), Point(100, 320))
         # self.add_static_sprites(generate_platform(6), Point(300, 320 - 64))
         self.generate_level()
         self.bg = rgb(212, 189, 127)
+        self.profiling = False
+        self.profile_key = False
 
     def generate_level(self):
         rows = BitMatrix(30, 6)
@@ -50,29 +53,34 @@ class GameApplication(Application):
         self.add_static_sprites(generate_platform(18), Point(32, 416))
 
     def add_static_sprites(self, sprites, pos):
-        for sprite in sprites:
-            e = Entity(StaticSprite(sprite))
-            e.dynamic = False
-            e.set_position(pos)
-            self.scene.add(e)
-            pos = pos + Point(32, 0)
+        col, row = self.tiles.cell_at(pos)
+        for i in range(len(sprites)):
+            self.tiles.set_tile(col + i, row, sprites[i])
 
     def handle_events(self):
         self.player.handle_events()
         if is_pressed('escape'):
             return False
+        key = is_pressed('p')
+        if key and not self.profile_key:
+            # P toggles the frame profiler and its overlay
+            self.profiling = not self.profiling
+            if self.profiling:
+                enable_profiler(overlay=True)
+            else:
+                disable_profiler()
+        self.profile_key = key
         return super().handle_events()
 
     def draw(self, view):
-        scr = get_screen()
-        scr.reset_count()
-        start = utime.ticks_ms()
         r = view.get_rect()
-        scr.bg_color(self.bg)
-        scr.fill_rect(r.tl.x, r.tl.y, r.br.x, r.br.y)
+        if self.renderer:
+            self.renderer.bg_color = self.bg
+        else:
+            scr = get_screen()
+            scr.bg_color(self.bg)
+            scr.fill_rect(r.tl.x, r.tl.y, r.br.x, r.br.y)
         super().draw(view)
-        dur = utime.ticks_ms() - start
-        print("Render time: "+str(dur)+"ms  "+str(scr.byte_count))
 
 
 def main(*args):